@@ -0,0 +1,223 @@
+"""mario command line
+
+Only typer is imported at start-up. Each command imports what it needs when
+it runs, so `mario --help` stays fast and pods that run a single short
+command do not pay for boto3, metaflow or the Chowda models.
+"""
+
+from typing import List, Optional
+
+import typer
+
+app = typer.Typer(help='The Pipeline Runner', no_args_is_help=True)
+
+
+def read_mmif(location: str) -> dict:
+    """Read an mmif from a local file or `s3://bucket/key`"""
+    from mario.mmif import download, read
+
+    if location.startswith('s3://'):
+        bucket, _, key = location[len('s3://') :].partition('/')
+        return download(bucket, key)
+    with open(location, 'rb') as f:
+        return read(f)
+
+
+def read_spec(spec: str):
+    """A JSON spec, or `@path` to a file containing one"""
+    if spec.startswith('@'):
+        with open(spec[1:]) as f:
+            return f.read()
+    return spec
+
+
+def pipeline_apps(pipeline: Optional[str], spec: Optional[str]) -> list:
+    from mario.dag import chain, parse
+
+    if spec:
+        return parse(read_spec(spec))
+    if pipeline:
+        return chain(pipeline.split(','))
+    raise typer.BadParameter('Give a --pipeline or a --spec')
+
+
+@app.command()
+def run(
+    mmif: str = typer.Argument(..., help='Input mmif file or s3:// url'),
+    pipeline: Optional[str] = typer.Option(None, help='Comma separated CLAMS app urls'),
+    spec: Optional[str] = typer.Option(
+        None, help='JSON pipeline spec, or @file containing one'
+    ),
+    output: Optional[str] = typer.Option(
+        None, '--output', '-o', help='Output mmif file. Defaults to stdout'
+    ),
+    encoding: str = typer.Option('identity', help='gzip, zstd or identity'),
+):
+    """Run an mmif through a CLAMS pipeline locally"""
+    from mario.client import client
+    from mario.dag import DAGRun
+    from mario.mmif import dumps, run_projected, write
+    from mario.utils import CLAMSAppError
+
+    def run_app(index: int, app, mmif: dict) -> dict:
+        typer.echo(f'Running {app.name}', err=True)
+
+        def post(sent: dict) -> dict:
+            response = client().post(app.url, json=sent)
+            if response.status_code != 200:
+                raise CLAMSAppError(
+                    f'{app.url} failed: {response.status_code} - {response.content}'
+                )
+            return response.json()
+
+        return run_projected(mmif, post, app.consumes)
+
+    apps = pipeline_apps(pipeline, spec)
+    dag = DAGRun(apps, read_mmif(mmif), run_app)
+    result = dag.run(max_workers=max(1, len(apps)))
+    typer.echo(f'Ran {len(apps)} apps in {dag.timings["wall"]:.2f}s', err=True)
+    if output:
+        with open(output, 'wb') as f:
+            write(result, f, encoding)
+    else:
+        typer.echo(dumps(result))
+
+
+@app.command()
+def inspect(
+    mmif: Optional[str] = typer.Argument(None, help='Mmif file or s3:// url'),
+    pipeline: Optional[str] = typer.Option(None, help='Comma separated CLAMS app urls'),
+    spec: Optional[str] = typer.Option(
+        None, help='JSON pipeline spec, or @file containing one'
+    ),
+):
+    """Show the documents and views of an mmif, or the apps of a pipeline"""
+    if pipeline or spec:
+        for index, app in enumerate(pipeline_apps(pipeline, spec)):
+            after = ', '.join(app.after) or '-'
+            line = f'{index:2d}  {app.name}  {app.url}  after: {after}'
+            if app.consumes is not None:
+                line += f'  consumes: {", ".join(app.consumes) or "-"}'
+            typer.echo(line)
+    if not mmif:
+        return
+    data = read_mmif(mmif)
+    for document in data.get('documents', []):
+        properties = document.get('properties', {})
+        typer.echo(f'{properties.get("id")}  {document.get("@type")}')
+        typer.echo(f'    {properties.get("location", "")}')
+    for view in data.get('views', []):
+        metadata = view.get('metadata', {})
+        annotations = len(view.get('annotations', []))
+        typer.echo(f'{view["id"]}  {metadata.get("app")}  {annotations} annotations')
+        if 'error' in metadata:
+            typer.echo(f'    error: {metadata["error"]}')
+
+
+@app.command()
+def bench(
+    name: Optional[str] = typer.Argument(None, help='Benchmark to run'),
+    args: Optional[List[str]] = typer.Argument(None, help='Benchmark arguments'),
+):
+    """Run a benchmark from mario.benchmarks, or list them"""
+    from importlib import import_module
+    from pkgutil import iter_modules
+
+    import mario.benchmarks
+
+    if not name:
+        for module in iter_modules(mario.benchmarks.__path__):
+            typer.echo(module.name)
+        return
+    module = import_module(f'mario.benchmarks.{name}')
+    args = [int(arg) if arg.isdigit() else arg for arg in args or []]
+    typer.echo(mario.benchmarks.table(module.run(*args)))
+
+
+@app.command()
+def importtime(
+    modules: Optional[List[str]] = typer.Argument(
+        None, help='Modules to import. Defaults to the mario CLI'
+    ),
+    budget: Optional[float] = typer.Option(
+        None, help='Seconds allowed. Defaults to IMPORT_BUDGET'
+    ),
+):
+    """Check start-up import time against a budget. Exits 1 if over budget"""
+    from mario.benchmarks import table
+    from mario.benchmarks.importtime import measure
+    from mario.benchmarks.importtime import run as check
+    from mario.config import IMPORT_BUDGET
+
+    budget = IMPORT_BUDGET if budget is None else budget
+    results = check(*(modules or []), budget=budget)
+    typer.echo(table(results))
+    for row in results:
+        if not row['ok']:
+            typer.echo(f'\nSlowest imports of {row["module"]}:')
+            for name, seconds in measure(row['module'])['slowest']:
+                typer.echo(f'  {seconds:.4f}s  {name}')
+    raise typer.Exit(0 if all(row['ok'] for row in results) else 1)
+
+
+@app.command()
+def enqueue(
+    guids: Optional[List[str]] = typer.Argument(None, help='GUIDs to process'),
+    batch_id: Optional[int] = typer.Option(None, help='Queue every GUID of a batch'),
+    priority: Optional[str] = typer.Option(
+        None, help='high, default or low. Batches default to low'
+    ),
+    pipeline: Optional[str] = typer.Option(None, help='Comma separated CLAMS app urls'),
+    spec: Optional[str] = typer.Option(
+        None, help='JSON pipeline spec, or @file containing one'
+    ),
+):
+    """Queue pipeline jobs for rq workers, and show the queue depths"""
+    from mario.jobs import depths, redis, submit, submit_batch
+
+    connection = redis()
+    parameters = {
+        'pipeline': pipeline.split(',') if pipeline else None,
+        'spec': read_spec(spec) if spec else None,
+    }
+    for guid in guids or []:
+        job = submit(guid, priority or 'default', connection, **parameters)
+        typer.echo(f'{guid}  {job.id}')
+    if batch_id is not None:
+        jobs = submit_batch(batch_id, priority or 'low', connection, **parameters)
+        typer.echo(f'Queued {len(jobs)} jobs from batch {batch_id}')
+    for name, depth in depths(connection).items():
+        typer.echo(f'{name:8s}  {depth}', err=True)
+
+
+@app.command()
+def token(
+    watch: bool = typer.Option(
+        False, help='Keep running, refreshing the secret before each expiry'
+    ),
+    namespace: Optional[str] = typer.Option(None, help='Namespace of the secret'),
+    name: Optional[str] = typer.Option(None, help='Name of the secret'),
+):
+    """Fetch a Chowda API token and write it to a Kubernetes secret"""
+    from functools import partial
+
+    from mario.config import TOKEN_SECRET_NAME, TOKEN_SECRET_NAMESPACE
+    from mario.token import TokenProvider, patch_secret
+
+    publish = partial(
+        patch_secret,
+        namespace=namespace or TOKEN_SECRET_NAMESPACE,
+        name=name or TOKEN_SECRET_NAME,
+    )
+    provider = TokenProvider(on_refresh=publish)
+    if not watch:
+        provider.refresh()
+        return
+    try:
+        provider.run()
+    except KeyboardInterrupt:
+        provider.stop()
+
+
+if __name__ == '__main__':
+    app()
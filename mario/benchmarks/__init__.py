@@ -0,0 +1,106 @@
+"""Local benchmarks for mario
+
+Each module has a `run` function that returns a list of result rows, and can
+be run directly with `python -m mario.benchmarks.<name>`.
+"""
+
+from multiprocessing import get_context
+from resource import RUSAGE_SELF, getrusage
+from sys import platform
+from typing import Any, Callable, Dict, List, Tuple
+
+VIDEO_DOCUMENT = 'http://mmif.clams.ai/vocabulary/VideoDocument/v1'
+TIME_FRAME = 'http://mmif.clams.ai/vocabulary/TimeFrame/v2'
+
+
+def synthetic_mmif(views: int = 10, annotations: int = 1000) -> dict:
+    """An mmif with one video document and `views` views of TimeFrames"""
+    return {
+        'metadata': {'mmif': 'http://mmif.clams.ai/1.0.0'},
+        'documents': [
+            {
+                '@type': VIDEO_DOCUMENT,
+                'properties': {
+                    'id': 'd1',
+                    'mime': 'video/mp4',
+                    'location': 'file:///m/cpb-aacip-000-00000000.mp4',
+                },
+            }
+        ],
+        'views': [synthetic_view(f'v_{v}', annotations) for v in range(views)],
+    }
+
+
+def synthetic_view(view_id: str, annotations: int, app: str = 'synthetic') -> dict:
+    """A view of `annotations` TimeFrames over document d1"""
+    return {
+        'id': view_id,
+        'metadata': {
+            'app': f'http://apps.clams.ai/{app}/v1.0',
+            'timestamp': '2023-01-01T00:00:00.000000',
+            'contains': {TIME_FRAME: {'document': 'd1', 'timeUnit': 'milliseconds'}},
+        },
+        'annotations': [
+            {
+                '@type': TIME_FRAME,
+                'properties': {
+                    'id': f'tf_{a}',
+                    'start': a * 1000,
+                    'end': a * 1000 + 999,
+                    'frameType': 'bars',
+                    'label': 'bars',
+                    'classification': {'bars': 0.98, 'slate': 0.01},
+                },
+            }
+            for a in range(annotations)
+        ],
+    }
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process, in bytes"""
+    rss = getrusage(RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if platform == 'darwin' else rss * 1024
+
+
+def _call(func: Callable, args: tuple, kwargs: dict) -> Tuple[Any, int]:
+    return func(*args, **kwargs), peak_rss()
+
+
+def isolated(func: Callable, *args, **kwargs) -> Tuple[Any, int]:
+    """Run `func` in a fresh process, returning its result and peak RSS
+
+    Peak RSS only ever grows within a process, so each configuration of a
+    benchmark needs its own process to be measured fairly.
+    """
+    with get_context('spawn').Pool(1) as pool:
+        return pool.apply(_call, (func, args, kwargs))
+
+
+def percentile(values: List[float], p: float) -> float:
+    """The `p`th percentile of `values`, by nearest rank"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def table(rows: List[Dict[str, Any]]) -> str:
+    """Format result rows as a plain text table"""
+    if not rows:
+        return ''
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+
+    def fmt(value: Any) -> str:
+        return f'{value:.3f}' if isinstance(value, float) else str(value)
+
+    widths = [max(len(c), *(len(fmt(r.get(c, ''))) for r in rows)) for c in columns]
+    lines = ['  '.join(c.ljust(w) for c, w in zip(columns, widths))]
+    lines.append('  '.join('-' * w for w in widths))
+    for row in rows:
+        lines.append(
+            '  '.join(fmt(row.get(c, '')).ljust(w) for c, w in zip(columns, widths))
+        )
+    return '\n'.join(lines)
@@ -0,0 +1,56 @@
+"""Benchmark Sony Ci asset lookups for a batch of media files
+
+    python -m mario.benchmarks.asset_lookups [guids] [latency_ms] [workers]
+
+Compares a new client and lookup per GUID, as the flows did, with the shared
+client in `mario.ci`, with and without prefetching the batch, against a fake
+Sony Ci API that takes `latency_ms` per call. The last row looks up assets
+whose proxyUrls expire too soon to cache.
+"""
+
+from sys import argv
+from time import perf_counter
+from typing import Dict, List
+
+from mario.benchmarks import table
+from mario.benchmarks.fakes import fake_sonyci
+
+
+def lookup(mode: str, asset_ids: List[str], latency: float, workers: int) -> Dict:
+    """Look up every asset, then each again, as a retried step would"""
+    from mario.ci import SonyCiAssets
+
+    expires_in = 60 if mode == 'expiring urls' else 24 * 60 * 60
+    SonyCi = fake_sonyci('http://media', latency, expires_in)  # noqa: N806
+    started = perf_counter()
+    assets = None
+    for _ in range(2):
+        for asset_id in asset_ids:
+            if mode == 'per guid':
+                SonyCi(**SonyCi.from_env()).get(f'assets/{asset_id}')
+                continue
+            if assets is None:
+                assets = SonyCiAssets(SonyCi(**SonyCi.from_env()))
+                if mode != 'shared':
+                    assets.prefetch(asset_ids, workers)
+            assets.get(asset_id)
+    return {
+        'mode': mode,
+        'lookups': 2 * len(asset_ids),
+        'seconds': perf_counter() - started,
+        'auth_calls': SonyCi.calls['auth'],
+        'api_calls': SonyCi.calls['get'],
+        'hit_rate': assets.stats.hit_rate if assets else 0.0,
+    }
+
+
+def run(guids: int = 200, latency_ms: int = 50, workers: int = 8) -> List[Dict]:
+    asset_ids = [f'asset{i}' for i in range(guids)]
+    return [
+        lookup(mode, asset_ids, latency_ms / 1000, workers)
+        for mode in ('per guid', 'shared', 'prefetch', 'expiring urls')
+    ]
+
+
+if __name__ == '__main__':
+    print(table(run(*(int(arg) for arg in argv[1:]))))
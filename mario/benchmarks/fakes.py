@@ -0,0 +1,274 @@
+"""Local stand-ins for the services mario talks to
+
+`Services` is an HTTP server that answers for every host a flow calls: the
+media proxy, fastclam and the CLAMS apps. Flows reach it unchanged through
+`HTTP_PROXY`, so `http://fastclam/source` and `http://app-*` keep their
+real names. Sony Ci is replaced by `FakeSonyCi`, S3 by moto, and the Chowda
+database by SQLite. `environment` sets all of them up at once.
+"""
+
+from contextlib import ExitStack, contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps, loads
+from os import environ, makedirs
+from os.path import join
+from threading import Lock, Thread
+from time import sleep, time
+from typing import ClassVar, Dict, Iterator, List, Optional
+from unittest.mock import patch
+from urllib.parse import urlsplit
+
+from mario.benchmarks import VIDEO_DOCUMENT, synthetic_view
+
+MEDIA_HOST = 'media'
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Routes proxied requests by host"""
+
+    server: 'Services'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status: int, body: bytes, headers: Optional[Dict] = None):
+        self.send_response(status)
+        for key, value in {'Content-Length': len(body), **(headers or {})}.items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def do_GET(self):  # noqa: N802
+        if urlsplit(self.path).hostname != MEDIA_HOST:
+            self.reply(404, b'')
+            return
+        size = self.server.media_size
+        start, end = 0, size - 1
+        if 'Range' not in self.headers:
+            self.reply(200, self.server.media(start, end))
+            return
+        first, _, last = self.headers['Range'][len('bytes=') :].partition('-')
+        start, end = int(first), min(int(last or end), end)
+        headers = {'Content-Range': f'bytes {start}-{end}/{size}'}
+        self.reply(206, self.server.media(start, end), headers)
+
+    def do_POST(self):  # noqa: N802
+        url = urlsplit(self.path)
+        body = loads(self.rfile.read(int(self.headers['Content-Length'])))
+        if url.hostname == 'fastclam':
+            self.reply(200, dumps(self.server.source(body['files'])).encode())
+            return
+        app = self.server.apps.get(url.hostname, self.server.default_app)
+        sleep(app['latency'])
+        views = body.setdefault('views', [])
+        views.append(
+            synthetic_view(f'v_{len(views)}', app['annotations'], url.hostname)
+        )
+        self.reply(200, dumps(body).encode())
+
+
+class Services(ThreadingHTTPServer):
+    """Fake media proxy, fastclam and CLAMS apps on one local port
+
+    Args:
+        media_size: Size of every media file, in bytes
+        latency: Seconds each CLAMS app takes per request
+        annotations: Annotations in the view each app adds
+        apps: Per-host `{latency, annotations}` overrides, e.g. `app-whisper`
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        media_size: int = 64 * 1024 * 1024,
+        latency: float = 0.1,
+        annotations: int = 1000,
+        apps: Optional[Dict[str, Dict]] = None,
+    ):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.media_size = media_size
+        self.default_app = {'latency': latency, 'annotations': annotations}
+        self.apps = {
+            name: {**self.default_app, **app} for name, app in (apps or {}).items()
+        }
+        self.block = bytes(range(256)) * 4096
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def media(self, start: int, end: int) -> bytes:
+        """Deterministic media bytes for the range [start, end]"""
+        offset = start % len(self.block)
+        length = end - start + 1
+        repeats = (offset + length) // len(self.block) + 1
+        return (self.block * repeats)[offset : offset + length]
+
+    def source(self, files: List[str]) -> dict:
+        """A new mmif, as fastclam's /source returns"""
+        documents = []
+        for index, file in enumerate(files):
+            _, _, location = file.partition(':')
+            documents.append(
+                {
+                    '@type': VIDEO_DOCUMENT,
+                    'properties': {
+                        'id': f'd{index + 1}',
+                        'mime': 'video/mp4',
+                        'location': f'file://{location}',
+                    },
+                }
+            )
+        return {
+            'metadata': {'mmif': 'http://mmif.clams.ai/1.0.0'},
+            'documents': documents,
+            'views': [],
+        }
+
+    def __enter__(self) -> 'Services':
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+def fake_sonyci(
+    media_url: str, latency: float = 0, expires_in: Optional[float] = None
+) -> type:
+    """A SonyCi class whose assets all have a proxyUrl of `media_url/<id>`
+
+    Args:
+        media_url: Where proxies are served
+        latency: Seconds each client takes to authenticate, and each lookup
+        expires_in: Sign proxyUrls to expire this many seconds after lookup
+
+    Clients made and lookups are counted in `FakeSonyCi.calls`.
+    """
+
+    class FakeSonyCi:
+        calls: ClassVar[Dict[str, int]] = {'auth': 0, 'get': 0}
+        lock = Lock()
+
+        def __init__(self, **kwargs):
+            with self.lock:
+                self.calls['auth'] += 1
+            sleep(latency)
+
+        @classmethod
+        def from_env(cls) -> dict:
+            return {}
+
+        def get(self, path: str) -> dict:
+            with self.lock:
+                self.calls['get'] += 1
+            sleep(latency)
+            asset_id = path.rstrip('/').split('/')[-1]
+            url = f'{media_url}/{asset_id}.mp4'
+            if expires_in is not None:
+                url += f'?Expires={int(time() + expires_in)}&Signature=fake'
+            return {'id': asset_id, 'proxyUrl': url}
+
+    return FakeSonyCi
+
+
+def chowda_sqlite(path: str, guids: List[str]):
+    """A SQLite Chowda database with one batch of `guids`, each with one asset
+
+    Returns:
+        The engine, and the id of the batch
+    """
+    from chowda.models import Batch, MediaFile, SonyCiAsset
+    from sqlalchemy.ext.compiler import compiles
+    from sqlalchemy.types import ARRAY
+    from sqlmodel import Session, SQLModel, create_engine
+
+    # Chowda uses Postgres arrays, which SQLite can store as JSON
+    compiles(ARRAY, 'sqlite')(lambda element, compiler, **kwargs: 'JSON')
+
+    engine = create_engine(f'sqlite:///{path}')
+    SQLModel.metadata.create_all(engine)
+    asset_type = SonyCiAsset.model_fields['type'].annotation
+    # Optional[AssetType] in newer Chowda models
+    asset_type = next(
+        arg
+        for arg in getattr(asset_type, '__args__', (asset_type,))
+        if arg is not type(None)
+    )
+    video = next(kind for kind in asset_type if str(kind.value).lower() == 'video')
+    with Session(engine) as db:
+        media_files = [
+            MediaFile(
+                guid=guid,
+                assets=[
+                    SonyCiAsset(
+                        id=f'asset-{guid}', name=f'{guid}.mp4', size=0, type=video
+                    )
+                ],
+            )
+            for guid in guids
+        ]
+        batch = Batch(name='benchmark', description='', media_files=media_files)
+        db.add(batch)
+        db.commit()
+        return engine, batch.id
+
+
+@contextmanager
+def environment(
+    root: str, guids: List[str], bucket: str = 'clams-mmif', **services
+) -> Iterator[Dict]:
+    """Run flows against local fakes
+
+    Sets `MEDIA_DIR` to `root/media`, starts `Services`, mocks S3 with moto
+    and patches the Chowda engine and Sony Ci client. Call this before
+    anything imports `mario.config` or `chowda.db`, which connects to
+    `DB_URL` when imported.
+
+    Yields:
+        The running services, the database engine and the batch id
+    """
+    makedirs(join(root, 'media'), exist_ok=True)
+    db_path = join(root, 'chowda.db')
+    with ExitStack() as stack:
+        fakes = stack.enter_context(Services(**services))
+        stack.enter_context(
+            patch.dict(
+                environ,
+                {
+                    'DB_URL': f'sqlite:///{db_path}',
+                    'MEDIA_DIR': join(root, 'media'),
+                    'HTTP_PROXY': fakes.url,
+                    'http_proxy': fakes.url,
+                    'NO_PROXY': '127.0.0.1,localhost',
+                    'no_proxy': '127.0.0.1,localhost',
+                    'AWS_ACCESS_KEY_ID': 'benchmark',
+                    'AWS_SECRET_ACCESS_KEY': 'benchmark',
+                    'AWS_DEFAULT_REGION': 'us-east-1',
+                },
+            )
+        )
+        import chowda.db
+        import sonyci
+        from moto import mock_aws
+
+        from mario.ci import sonyci as ci
+        from mario.s3 import s3
+
+        stack.enter_context(mock_aws())
+        # The shared client must be made inside the mock, and not outlive it
+        s3.cache_clear()
+        stack.callback(s3.cache_clear)
+        s3().create_bucket(Bucket=bucket)
+        engine, batch_id = chowda_sqlite(db_path, guids)
+        stack.enter_context(patch.object(chowda.db, 'engine', engine))
+        media_url = f'http://{MEDIA_HOST}'
+        stack.enter_context(patch.object(sonyci, 'SonyCi', fake_sonyci(media_url)))
+        # Likewise the shared Sony Ci client
+        ci.cache_clear()
+        stack.callback(ci.cache_clear)
+        yield {'services': fakes, 'engine': engine, 'batch_id': batch_id}
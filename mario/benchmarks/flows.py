@@ -0,0 +1,204 @@
+"""End to end throughput of the CLAMS flows against local fakes
+
+Runs `Pipeline`, `AppWhisper` and `AppBarsdetection` for a number of media
+files with every external service replaced by the stand-ins in
+`mario.benchmarks.fakes`, and reports files per hour, p50 and p99 latency per
+file, and peak RSS for each configuration:
+
+    python -m mario.benchmarks.flows [files] [media_mb]
+
+The flows' steps are run in this process by `run_flow`, since their
+`@kubernetes` and `@secrets` decorators cannot run locally. Needs the
+chowda, sonyci, metaflow and moto packages.
+"""
+
+from importlib import import_module
+from os.path import dirname
+from shutil import rmtree
+from sys import argv, path
+from tempfile import mkdtemp
+from time import perf_counter
+from types import SimpleNamespace
+from typing import Dict, List
+from unittest.mock import patch
+
+from mario.benchmarks import isolated, percentile, table
+
+APPS = ['http://app-barsdetection', 'http://app-whisper', 'http://app-spacy']
+
+# dag runs app-barsdetection and app-whisper in parallel, then app-spacy
+CONFIGS = [
+    {'flow': 'Pipeline', 'apps': 1, 'dag': 0, 'latency': 0.1, 'annotations': 1000},
+    {'flow': 'Pipeline', 'apps': 3, 'dag': 0, 'latency': 0.1, 'annotations': 1000},
+    {'flow': 'Pipeline', 'apps': 3, 'dag': 0, 'latency': 0.1, 'annotations': 20000},
+    {'flow': 'Pipeline', 'apps': 3, 'dag': 1, 'latency': 0.1, 'annotations': 1000},
+    {'flow': 'AppWhisper', 'apps': 1, 'dag': 0, 'latency': 0.1, 'annotations': 1000},
+    {
+        'flow': 'AppBarsdetection',
+        'apps': 1,
+        'dag': 0,
+        'latency': 0.1,
+        'annotations': 1000,
+    },
+]
+
+# Flow class: module in mario/pipelines
+MODULES = {
+    'Pipeline': 'pipeline',
+    'AppWhisper': 'app_whisper',
+    'AppBarsdetection': 'app_barsdetection',
+}
+
+
+def load_flow(name: str) -> type:
+    """Import a flow class the way Metaflow does, from mario/pipelines"""
+    import mario.pipelines
+
+    pipelines = dirname(mario.pipelines.__file__)
+    if pipelines not in path:
+        path.insert(0, pipelines)
+    return getattr(import_module(MODULES[name]), name)
+
+
+def default(parameter) -> object:
+    """The default of a Metaflow Parameter
+
+    Newer Metaflow keeps the constructor's arguments apart until the flow's
+    parameters are initialized.
+    """
+    if 'default' in parameter.kwargs:
+        return parameter.kwargs['default']
+    return getattr(parameter, '_override_kwargs', {}).get('default')
+
+
+def run_flow(cls: type, parameters: Dict, run_id: str):
+    """Run a linear flow's steps in this process, without the Metaflow runtime
+
+    Steps are called directly, following `self.next`. Artifacts are plain
+    attributes, and `metaflow.current` is replaced while the flow runs.
+    Returns the flow object, with every artifact set.
+    """
+    import metaflow
+
+    flow = cls.__new__(cls)
+    flow.__dict__.update({'_datastore': None, 'name': cls.__name__})
+    for key in dir(cls):
+        parameter = getattr(cls, key, None)
+        if isinstance(parameter, metaflow.Parameter):
+            flow.__dict__[key] = parameters.get(key, default(parameter))
+
+    steps = ['start']
+    flow.next = lambda step, **kwargs: steps.append(step.__name__)
+    current = SimpleNamespace(
+        flow_name=cls.__name__,
+        run_id=run_id,
+        origin_run_id=None,
+        task_id='1',
+        is_running_flow=True,
+    )
+    with patch.object(metaflow, 'current', current):
+        while steps:
+            current.step_name = steps.pop()
+            getattr(cls, current.step_name)(flow)
+    return flow
+
+
+def parameters(config: Dict, guid: str, batch_id: int) -> Dict:
+    if config['flow'] != 'Pipeline':
+        return {'guid': guid}
+    apps = APPS[: config['apps']]
+    if not config['dag']:
+        return {'guid': guid, 'pipeline': apps, 'batch_id': batch_id}
+    spec = [{'name': app, 'url': app} for app in apps[:2]]
+    spec += [{'name': app, 'url': app, 'after': apps[:2]} for app in apps[2:]]
+    return {'guid': guid, 'spec': spec, 'batch_id': batch_id}
+
+
+def bench(config: Dict, files: int, media_mb: int) -> Dict:
+    """Run `files` media files through one configuration. Runs in a new process"""
+    from mario.benchmarks.fakes import environment
+
+    root = mkdtemp(prefix='mario-bench-')
+    guids = [f'cpb-aacip-bench-{i:04d}' for i in range(files)]
+    latencies = []
+    try:
+        with environment(
+            root,
+            guids,
+            media_size=media_mb * 1024 * 1024,
+            latency=config['latency'],
+            annotations=config['annotations'],
+        ) as env:
+            cls = load_flow(config['flow'])
+            started = perf_counter()
+            for index, guid in enumerate(guids):
+                file_started = perf_counter()
+                run_flow(cls, parameters(config, guid, env['batch_id']), str(index))
+                latencies.append(perf_counter() - file_started)
+            wall = perf_counter() - started
+    finally:
+        rmtree(root, ignore_errors=True)
+    return {
+        **config,
+        'files': files,
+        'files_per_hour': files / wall * 3600,
+        'p50_s': percentile(latencies, 50),
+        'p99_s': percentile(latencies, 99),
+    }
+
+
+def records(flow: str, runs: int = 2) -> Dict:
+    """Run `flow` `runs` times on one media file. Runs in a new process
+
+    Returns the MetaflowRun and MMIF rows the runs wrote, and the number of
+    views in the mmif each run uploaded.
+    """
+    from chowda.models import MMIF, MetaflowRun
+    from sqlmodel import Session, select
+
+    from mario.benchmarks.fakes import environment
+    from mario.db import chowda
+    from mario.mmif import download
+
+    root = mkdtemp(prefix='mario-bench-')
+    guid = 'cpb-aacip-bench-0000'
+    views = []
+    try:
+        with environment(root, [guid], media_size=1024 * 1024) as env:
+            cls = load_flow(flow)
+            for run_id in range(runs):
+                run_flow(cls, {'guid': guid}, str(run_id))
+                location = f'{guid}/{MODULES[flow].replace("_", "-")}/{guid}.mmif'
+                views.append(len(download('clams-mmif', location)['views']))
+                # Each run has its own process, and reads the database afresh
+                chowda().close()
+                chowda.cache_clear()
+            with Session(env['engine']) as db:
+                return {
+                    'runs': [run.model_dump() for run in db.exec(select(MetaflowRun))],
+                    'mmifs': [mmif.model_dump() for mmif in db.exec(select(MMIF))],
+                    'views': views,
+                }
+    finally:
+        rmtree(root, ignore_errors=True)
+
+
+def run(files: int = 5, media_mb: int = 16) -> List[Dict]:
+    """Benchmark every configuration in its own process
+
+    A configuration that fails is reported with its error, and the rest still
+    run.
+    """
+    rows = []
+    for config in CONFIGS:
+        try:
+            result, rss = isolated(bench, config, files, media_mb)
+        except Exception as e:
+            rows.append({**config, 'error': repr(e)})
+            continue
+        rows.append({**result, 'peak_rss_mb': rss / 1024**2})
+    return rows
+
+
+if __name__ == '__main__':
+    print(table(run(*(int(arg) for arg in argv[1:]))))
@@ -0,0 +1,112 @@
+"""Start-up import time of mario entry points
+
+Each module is imported in a fresh interpreter with `python -X importtime`,
+and the time spent on imports that a bare interpreter does not already make
+is compared against a budget. Heavy dependencies that should only be
+imported by the commands and steps that use them are reported too.
+
+    python -m mario.benchmarks.importtime [module ...]
+
+exits non-zero if any module is over budget or imports a heavy dependency.
+"""
+
+from subprocess import run as run_process
+from sys import argv, executable
+from typing import Dict, List, Tuple
+
+from mario.config import IMPORT_BUDGET
+
+# Dependencies that must not be imported just to start mario
+HEAVY = (
+    'boto3',
+    'botocore',
+    'chowda',
+    'metaflow',
+    'redis',
+    'requests',
+    'rq',
+    'sonyci',
+    'sqlalchemy',
+    'sqlmodel',
+    'torch',
+    'whisper',
+)
+
+MODULES = ('mario.__main__',)
+
+
+def importtime(code: str) -> List[Tuple[int, int, str]]:
+    """(self us, cumulative us, module) for each top level import made by `code`
+
+    Imports made by the interpreter itself are included, with their nested
+    imports folded into the cumulative time.
+    """
+    stderr = run_process(
+        [executable, '-X', 'importtime', '-c', code],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or line.endswith('imported package'):
+            continue
+        own, cumulative, name = line[len('import time:') :].split('|')
+        rows.append((int(own), int(cumulative), name.rstrip()))
+    return rows
+
+
+def measure(module: str, repeat: int = 3) -> Dict:
+    """Import time of `module` beyond interpreter start-up, best of `repeat`"""
+    baseline = {name.strip() for _, _, name in importtime('pass')}
+    best = None
+    for _ in range(repeat):
+        rows = importtime(f'import {module}')
+        # Top level imports are not indented past the first space
+        total = sum(
+            cumulative
+            for _, cumulative, name in rows
+            if not name.startswith('  ') and name.strip() not in baseline
+        )
+        if best is None or total < best[0]:
+            best = (total, rows)
+    total, rows = best
+    names = {name.strip() for _, _, name in rows}
+    slowest = sorted(
+        (row for row in rows if row[2].strip() not in baseline),
+        key=lambda row: row[0],
+        reverse=True,
+    )
+    return {
+        'module': module,
+        'seconds': total / 1e6,
+        'imports': len(names - baseline),
+        'heavy': sorted(n for n in names if n.split('.')[0] in HEAVY),
+        'slowest': [(name.strip(), own / 1e6) for own, _, name in slowest[:10]],
+    }
+
+
+def run(*modules: str, budget: float = IMPORT_BUDGET) -> List[Dict]:
+    """Measure each module against the start-up `budget` in seconds"""
+    rows = []
+    for module in modules or MODULES:
+        result = measure(module)
+        rows.append(
+            {
+                'module': module,
+                'seconds': result['seconds'],
+                'budget': budget,
+                'imports': result['imports'],
+                'heavy': ','.join(result['heavy']) or '-',
+                'ok': result['seconds'] <= budget and not result['heavy'],
+            }
+        )
+    return rows
+
+
+if __name__ == '__main__':
+    from mario.benchmarks import table
+
+    results = run(*argv[1:])
+    print(table(results))
+    raise SystemExit(0 if all(row['ok'] for row in results) else 1)
@@ -0,0 +1,111 @@
+"""Benchmark logging overhead per record and log volume
+
+    python -m mario.benchmarks.log_volume [records] [mmifs] [annotations] [write_us]
+
+A step logs `records` short messages and `mmifs` mmifs of `annotations`
+annotations, as flows did by printing them whole, or through `mario.log`
+as JSON records with each mmif summarized, written by the calling thread or
+enqueued to a background thread. Everything is written to a file that
+takes `write_us` microseconds per write, like the pipe Metaflow captures
+step output through. `record_us` is the time a caller spends per short
+message, and `seconds` includes writing every record.
+"""
+
+from contextlib import redirect_stdout
+from os.path import getsize, join
+from shutil import rmtree
+from sys import argv
+from tempfile import mkdtemp
+from time import perf_counter, sleep
+from typing import Dict, List
+
+from mario.benchmarks import synthetic_mmif, table
+
+
+class Step:
+    """Stands in for a flow, for the run context bound to its records"""
+
+    guid = 'cpb-aacip-benchmark'
+    batch_id = 1
+
+
+class Destination:
+    """A file that takes `latency` seconds per write"""
+
+    def __init__(self, f, latency: float):
+        self.f = f
+        self.latency = latency
+
+    def write(self, data: str) -> int:
+        sleep(self.latency)
+        return self.f.write(data)
+
+    def flush(self) -> None:
+        self.f.flush()
+
+
+def timed(emit, dump, flush, records: int, mmif: dict, mmifs: int) -> Dict:
+    """Log `records` messages and `mmifs` mmifs, then flush them"""
+    started = perf_counter()
+    for i in range(records):
+        emit(f'Processed record {i} of {records}')
+    emitted = perf_counter() - started
+    for _ in range(mmifs):
+        dump(mmif)
+    flush()
+    return {'record_us': emitted / records * 1e6, 'seconds': perf_counter() - started}
+
+
+def log_records(
+    mode: str, path: str, records: int, mmif: dict, mmifs: int, write_us: int
+) -> Dict:
+    """Log everything in `mode` to `path`. Returns the timings"""
+    from mario.log import configure, flow_log, log, summarize
+
+    with open(path, 'w') as f:
+        destination = Destination(f, write_us / 1e6)
+        if mode == 'print':
+            with redirect_stdout(destination):
+                return timed(print, print, f.flush, records, mmif, mmifs)
+        configure('json', sink=destination, enqueue=mode == 'json-enqueue')
+        bound = flow_log(Step(), step='benchmark')
+        try:
+            return timed(
+                bound.info,
+                lambda mmif: bound.info('Got mmif {mmif}', mmif=summarize(mmif)),
+                log.remove,
+                records,
+                mmif,
+                mmifs,
+            )
+        finally:
+            configure()
+
+
+def run(
+    records: int = 20_000, mmifs: int = 10, annotations: int = 5000, write_us: int = 50
+) -> List[Dict]:
+    """Compare printing with sync and enqueued JSON logging"""
+    mmif = synthetic_mmif(10, annotations)
+    root = mkdtemp(prefix='mario-bench-')
+    rows = []
+    try:
+        for mode in ('print', 'json-sync', 'json-enqueue'):
+            path = join(root, f'{mode}.log')
+            timings = log_records(mode, path, records, mmif, mmifs, write_us)
+            rows.append(
+                {
+                    'mode': mode,
+                    'records': records,
+                    'mmifs': mmifs,
+                    **timings,
+                    'log_mb': getsize(path) / 1024**2,
+                }
+            )
+    finally:
+        rmtree(root)
+    return rows
+
+
+if __name__ == '__main__':
+    print(table(run(*(int(arg) for arg in argv[1:]))))
@@ -0,0 +1,81 @@
+"""Benchmark downloads of the same assets by many runs, with the media cache
+
+    python -m mario.benchmarks.media_cache [runs] [assets] [media_mb]
+
+Each run fetches the proxy of one of `assets` assets into its own workspace
+and cleans up, several at once, as flows and batches do when one asset goes
+through several of them. Runs either download into their workspace, or go
+through a `MediaCache`. Proxies are served by the fake media host.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from os import environ
+from os.path import join
+from shutil import rmtree
+from sys import argv
+from tempfile import mkdtemp
+from time import perf_counter
+from typing import Dict, List
+from unittest.mock import patch
+
+from mario.benchmarks import table
+
+# Runs in flight at once
+CONCURRENCY = 4
+
+
+def fetch(mode: str, root: str, cache, run: int, asset: int) -> int:
+    """Fetch the proxy of `asset` for `run`. Returns the bytes downloaded"""
+    from mario.download import download
+    from mario.media import ref_of
+    from mario.workspace import Workspace
+
+    url = f'http://media/{asset}'
+    workspace = Workspace(f'guid-{run}', f'Benchmark/{asset}', root)
+    if mode == 'download':
+        result = download(url, workspace.file('media.mp4'))
+    else:
+        media, result = cache.acquire(
+            str(asset), ref_of(workspace), lambda path: download(url, path)
+        )
+        workspace.hand_over(media, 'media.mp4')
+    workspace.cleanup()
+    if cache is not None:
+        cache.release(str(asset), ref_of(workspace))
+    return result.fetched if result else 0
+
+
+def run(runs: int = 24, assets: int = 4, media_mb: int = 64) -> List[Dict]:
+    """Fetch `assets` assets `runs` times, with and without the media cache"""
+    from mario.benchmarks.fakes import Services
+    from mario.media import MediaCache
+
+    rows = []
+    with Services(media_size=media_mb * 1024 * 1024) as services:
+        proxy = {'HTTP_PROXY': services.url, 'http_proxy': services.url}
+        for mode in ('download', 'cache'):
+            root = mkdtemp(prefix='mario-bench-')
+            cache = MediaCache(join(root, '.cache')) if mode == 'cache' else None
+            started = perf_counter()
+            with patch.dict(environ, proxy), ThreadPoolExecutor(CONCURRENCY) as pool:
+                work = partial(fetch, mode, root, cache)
+                assigned = [i % assets for i in range(runs)]
+                fetched = sum(pool.map(work, range(runs), assigned))
+            seconds = perf_counter() - started
+            rmtree(root)
+            rows.append(
+                {
+                    'mode': mode,
+                    'runs': runs,
+                    'assets': assets,
+                    'seconds': seconds,
+                    'fetched_mb': fetched / 1024**2,
+                    'hit_rate': cache.stats.hit_rate if cache else 0.0,
+                }
+            )
+    return rows
+
+
+if __name__ == '__main__':
+    print(table(run(*(int(arg) for arg in argv[1:]))))
@@ -0,0 +1,61 @@
+"""Benchmark MMIF serialization: bytes, time and peak RSS per configuration
+
+    python -m mario.benchmarks.mmif_io [views] [annotations]
+"""
+
+from io import BytesIO
+from sys import argv
+from time import perf_counter
+from typing import Dict, List
+
+from mario.benchmarks import isolated, synthetic_mmif, table
+
+
+def roundtrip(backend: str, encoding: str, views: int, annotations: int) -> Dict:
+    """Write and read back a synthetic mmif in this process"""
+    from mario import mmif as mmif_io
+
+    if backend == 'json':
+        mmif_io.orjson = None
+    mmif = synthetic_mmif(views, annotations)
+
+    buffer = BytesIO()
+    started = perf_counter()
+    mmif_io.write(mmif, buffer, encoding)
+    written = perf_counter() - started
+    size = buffer.tell()
+    del mmif
+
+    buffer.seek(0)
+    started = perf_counter()
+    mmif_io.read(buffer)
+    read = perf_counter() - started
+    return {'bytes': size, 'write_s': written, 'read_s': read}
+
+
+def run(views: int = 20, annotations: int = 5000) -> List[Dict]:
+    """Compare every available JSON backend and encoding"""
+    from mario.mmif import ENCODINGS, orjson
+
+    backends = ['json'] + (['orjson'] if orjson is not None else [])
+    rows = []
+    for backend in backends:
+        for encoding in ENCODINGS:
+            try:
+                result, rss = isolated(roundtrip, backend, encoding, views, annotations)
+            except ImportError as e:
+                print(f'Skipping {backend}/{encoding}: {e}')
+                continue
+            rows.append(
+                {
+                    'backend': backend,
+                    'encoding': encoding,
+                    **result,
+                    'peak_rss_mb': rss / 1024**2,
+                }
+            )
+    return rows
+
+
+if __name__ == '__main__':
+    print(table(run(*(int(arg) for arg in argv[1:]))))
@@ -0,0 +1,79 @@
+"""Benchmark sending each app only the views it consumes
+
+    python -m mario.benchmarks.projection [apps] [views] [annotations]
+
+An mmif that already holds `views` views goes through a chain of `apps`
+stub apps, each adding a view of `annotations` TimeFrames. Every app is
+sent the full accumulated mmif, then only what it `consumes`: the media
+documents, like an app that reads the video, and for the last app every
+TimeFrame view. App latency is the time from sending a request to parsing
+its response.
+"""
+
+from os import environ
+from sys import argv
+from time import perf_counter
+from typing import Dict, List
+from unittest.mock import patch
+
+from mario.benchmarks import percentile, synthetic_mmif, table
+
+
+def chain_spec(apps: int, consumes: bool) -> List[Dict]:
+    """A linear spec of stub apps, only the last consuming earlier views"""
+    spec = []
+    for i in range(apps):
+        app = {'name': f'app{i}', 'url': f'http://app-{i}'}
+        if i:
+            app['after'] = [f'app{i - 1}']
+        if consumes:
+            app['consumes'] = ['TimeFrame'] if i == apps - 1 else []
+        spec.append(app)
+    return spec
+
+
+def run_chain(apps: int, source: dict, consumes: bool) -> Dict:
+    """Run the chain, recording request bytes and latency per app"""
+    from mario.client import client
+    from mario.dag import DAGRun, parse
+    from mario.mmif import project, splice
+
+    sent_bytes, latencies = [], []
+
+    def run_app(index: int, app, mmif: dict) -> dict:
+        sent = project(mmif, app.consumes)
+        started = perf_counter()
+        response = client().post(app.url, json=sent)
+        response.raise_for_status()
+        output = response.json()
+        latencies.append(perf_counter() - started)
+        sent_bytes.append(len(response.request.body))
+        return splice(mmif, sent, output) if sent is not mmif else output
+
+    started = perf_counter()
+    output = DAGRun(parse(chain_spec(apps, consumes)), source, run_app).run()
+    return {
+        'mode': 'projected' if consumes else 'full',
+        'apps': apps,
+        'seconds': perf_counter() - started,
+        'sent_mb': sum(sent_bytes) / 1024**2,
+        'last_sent_mb': sent_bytes[-1] / 1024**2,
+        'latency_p50_s': percentile(latencies, 50),
+        'latency_max_s': max(latencies),
+        'views': len(output['views']),
+    }
+
+
+def run(apps: int = 6, views: int = 20, annotations: int = 5000) -> List[Dict]:
+    """Compare full and projected requests through the same chain"""
+    from mario.benchmarks.fakes import Services
+
+    source = synthetic_mmif(views, annotations)
+    with Services(latency=0, annotations=annotations) as services:
+        proxy = {'HTTP_PROXY': services.url, 'http_proxy': services.url}
+        with patch.dict(environ, proxy):
+            return [run_chain(apps, source, consumes) for consumes in (False, True)]
+
+
+if __name__ == '__main__':
+    print(table(run(*(int(arg) for arg in argv[1:]))))
@@ -0,0 +1,162 @@
+"""Load test the priority job queues: throughput and latency per class
+
+    python -m mario.benchmarks.queues [bulk] [urgent] [workers]
+
+A bulk batch is submitted as `low` while urgent jobs arrive as `high` and
+single reprocesses as `default`, with every queue bounded so the batch
+producer backs off. rq workers in their own processes run jobs that sleep
+for a fixed time, against an in-process fakeredis server. The same load is
+then run with every job on one FIFO queue for comparison.
+"""
+
+from sys import argv
+from threading import Thread
+from time import monotonic, sleep
+from typing import Dict, List
+
+from mario.benchmarks import percentile, table
+
+# Seconds each job takes
+JOB_SECONDS = 0.05
+
+
+def work(guid: str, seconds: float = JOB_SECONDS) -> str:
+    """A job that takes `seconds`. Runs in a worker"""
+    sleep(seconds)
+    return guid
+
+
+def worker(port: int) -> None:
+    """Run an rq worker on every priority queue until terminated"""
+    from redis import Redis
+    from rq import SimpleWorker
+
+    from mario.jobs import PRIORITIES, queue
+
+    class PollingWorker(SimpleWorker):
+        """Polls instead of blocking in BLPOP
+
+        fakeredis can lose a job popped for one of several blocked workers.
+        """
+
+        def dequeue_job_and_maintain_ttl(self, timeout, max_idle_time=None):
+            while True:
+                result = super().dequeue_job_and_maintain_ttl(None, max_idle_time)
+                if result is not None:
+                    return result
+                sleep(0.01)
+
+    connection = Redis(port=port)
+    queues = [queue(priority, connection) for priority in PRIORITIES]
+    PollingWorker(queues, connection=connection).work(logging_level='WARNING')
+
+
+def load(connection, bulk: int, urgent: int, fifo: bool, max_depth: int) -> Dict:
+    """Submit the test load. Returns {class: job ids}, and backpressure"""
+    # Importable by workers, even when this module runs as __main__
+    from mario.benchmarks.queues import work
+    from mario.jobs import submit
+
+    submitted: Dict[str, List[str]] = {'high': [], 'default': [], 'low': []}
+    backpressure = []
+
+    def send(guid: str, priority: str):
+        job = submit(
+            guid,
+            'default' if fifo else priority,
+            connection,
+            max_depth=max_depth,
+            func=work,
+        )
+        submitted[priority].append(job.id)
+        backpressure.append(job.meta['backpressure'])
+
+    def batch():
+        for i in range(bulk):
+            send(f'bulk-{i}', 'low')
+
+    producer = Thread(target=batch)
+    producer.start()
+    # Urgent and single jobs arrive while the batch is being worked through
+    for i in range(urgent):
+        sleep(JOB_SECONDS * 3)
+        send(f'urgent-{i}', 'high')
+        send(f'single-{i}', 'default')
+    producer.join()
+    return {'submitted': submitted, 'backpressure': sum(backpressure)}
+
+
+def measure(connection, submitted: Dict[str, List[str]], fifo: bool) -> List[Dict]:
+    """Wait for every job, then summarize each class"""
+    from rq.job import Job
+
+    ids = [job_id for job_ids in submitted.values() for job_id in job_ids]
+    deadline = monotonic() + 600
+    while monotonic() < deadline:
+        jobs = Job.fetch_many(ids, connection=connection)
+        if all(job and job.get_status() == 'finished' for job in jobs):
+            break
+        sleep(0.2)
+    rows = []
+    for priority, job_ids in submitted.items():
+        jobs = Job.fetch_many(job_ids, connection=connection)
+        waits = [(j.started_at - j.enqueued_at).total_seconds() for j in jobs]
+        latencies = [(j.ended_at - j.enqueued_at).total_seconds() for j in jobs]
+        first = min(j.enqueued_at for j in jobs)
+        last = max(j.ended_at for j in jobs)
+        rows.append(
+            {
+                'queues': 'fifo' if fifo else 'priority',
+                'class': priority,
+                'jobs': len(jobs),
+                'jobs_per_s': len(jobs) / (last - first).total_seconds(),
+                'wait_p50_s': percentile(waits, 50),
+                'wait_p99_s': percentile(waits, 99),
+                'latency_p50_s': percentile(latencies, 50),
+                'latency_p99_s': percentile(latencies, 99),
+            }
+        )
+    return rows
+
+
+def run(bulk: int = 100, urgent: int = 10, workers: int = 4) -> List[Dict]:
+    """Run the load with priority queues, then with one FIFO queue"""
+    from multiprocessing import get_context
+
+    from fakeredis import TcpFakeServer
+    from redis import Redis
+
+    server = TcpFakeServer(('127.0.0.1', 0))
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+    connection = Redis(port=port)
+    rows = []
+    try:
+        for fifo in (False, True):
+            connection.flushall()
+            context = get_context('spawn')
+            processes = [
+                context.Process(target=worker, args=(port,), daemon=True)
+                for _ in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            try:
+                result = load(connection, bulk, urgent, fifo, max_depth=bulk // 4)
+                summary = measure(connection, result['submitted'], fifo)
+            finally:
+                for process in processes:
+                    process.terminate()
+                    process.join()
+            for row in summary:
+                row['backpressure_s'] = result['backpressure']
+            rows.extend(summary)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return rows
+
+
+if __name__ == '__main__':
+    print(table(run(*(int(arg) for arg in argv[1:]))))
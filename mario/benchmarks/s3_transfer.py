@@ -0,0 +1,109 @@
+"""Benchmark S3 upload throughput against transfer settings
+
+    python -m mario.benchmarks.s3_transfer [size_mb] [objects]
+
+Uploads go to moto, with a simulated round trip and bandwidth per request,
+so part size, threads and concurrent uploads have the effect they would
+against real S3.
+"""
+
+from sys import argv
+from time import perf_counter, sleep
+from typing import Dict, List
+from unittest.mock import patch
+
+from mario.benchmarks import synthetic_mmif, table
+
+BUCKET = 'benchmark'
+# Per request, and per connection, roughly as seen from a pod
+RTT = 0.03
+BANDWIDTH = 50 * 1024 * 1024
+
+
+def simulate_network(request, **kwargs):
+    """Delay each request as if it crossed a network"""
+    from botocore.utils import determine_content_length
+
+    # Bodies sent with checksums are streamed, and only declare their size
+    size = request.headers.get('X-Amz-Decoded-Content-Length')
+    size = int(size) if size else determine_content_length(request.body) or 0
+    sleep(RTT + size / BANDWIDTH)
+
+
+def upload_large(client, size_mb: int, chunk_mb: int, concurrency: int) -> Dict:
+    """Upload one object of `size_mb` in `chunk_mb` parts"""
+    from mario.s3 import transfer_config, upload_bytes
+
+    data = bytes(size_mb * 1024 * 1024)
+    config = transfer_config(
+        threshold=chunk_mb * 1024 * 1024,
+        chunksize=chunk_mb * 1024 * 1024,
+        concurrency=concurrency,
+    )
+    started = perf_counter()
+    upload_bytes(data, BUCKET, 'large', client=client, config=config)
+    seconds = perf_counter() - started
+    return {
+        'upload': f'1 x {size_mb}MB',
+        'chunk_mb': chunk_mb,
+        'threads': concurrency,
+        'workers': 1,
+        'seconds': seconds,
+        'mb_per_s': size_mb / seconds,
+    }
+
+
+def upload_mmifs(client, objects: int, workers: int) -> Dict:
+    """Upload `objects` small mmifs with `workers` at once"""
+    from io import BytesIO
+
+    from mario.mmif import write
+    from mario.s3 import Upload, upload_many
+
+    buffer = BytesIO()
+    write(synthetic_mmif(views=5, annotations=500), buffer, 'gzip')
+    data = buffer.getvalue()
+    uploads = [Upload(BUCKET, f'mmif/{i}.mmif', data=data) for i in range(objects)]
+    started = perf_counter()
+    upload_many(uploads, workers=workers, client=client)
+    seconds = perf_counter() - started
+    size_mb = len(data) * objects / 1024**2
+    return {
+        'upload': f'{objects} x {len(data) // 1024}KB',
+        'chunk_mb': '',
+        'threads': '',
+        'workers': workers,
+        'seconds': seconds,
+        'mb_per_s': size_mb / seconds,
+    }
+
+
+def run(size_mb: int = 64, objects: int = 64) -> List[Dict]:
+    """Compare part sizes, threads per upload and concurrent uploads"""
+    from os import environ
+
+    from moto import mock_aws
+
+    from mario.s3 import s3
+
+    credentials = {
+        'AWS_ACCESS_KEY_ID': 'benchmark',
+        'AWS_SECRET_ACCESS_KEY': 'benchmark',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+    }
+    rows = []
+    with patch.dict(environ, credentials), mock_aws():
+        s3.cache_clear()
+        client = s3()
+        client.create_bucket(Bucket=BUCKET)
+        client.meta.events.register('before-sign.s3', simulate_network)
+        for chunk_mb, concurrency in [(64, 1), (8, 1), (8, 4), (8, 10), (16, 10)]:
+            rows.append(upload_large(client, size_mb, chunk_mb, concurrency))
+        for workers in (1, 4, 8, 16):
+            rows.append(upload_mmifs(client, objects, workers))
+        s3.cache_clear()
+    return rows
+
+
+if __name__ == '__main__':
+    print(table(run(*(int(arg) for arg in argv[1:]))))
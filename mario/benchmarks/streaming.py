@@ -0,0 +1,105 @@
+"""Benchmark peak memory of sending a large mmif through a CLAMS app
+
+    python -m mario.benchmarks.streaming [views] [annotations]
+
+Compares parsing the mmif in memory, as `PipelineUtils.app` does by default,
+with streaming it from a file and spooling the response to disk, as with
+`MMIF_STREAM`. Each mode runs in its own process against a local stub app,
+and pickles what a flow would store as artifacts.
+"""
+
+from os import remove
+from os.path import getsize, join
+from pickle import dumps
+from sys import argv
+from tempfile import mkdtemp
+from time import perf_counter
+from typing import Dict, List
+
+from mario.benchmarks import isolated, peak_rss, synthetic_mmif, table
+
+
+def call(mode: str, url: str, path: str) -> Dict:
+    """Send the mmif at `path` to the app at `url`. Runs in a new process"""
+    from mario.client import client
+    from mario.mmif import MMIFRef, read, send
+
+    baseline = peak_rss()
+    started = perf_counter()
+    if mode == 'stream':
+        response, output = send(
+            url, MMIFRef(path, getsize(path), 'identity'), mkdtemp()
+        )
+        received = output.size
+        artifacts = len(dumps(output))
+        remove(output.location)
+    else:
+        with open(path, 'rb') as f:
+            mmif = read(f)
+        response = client().post(url, json=mmif)
+        output = response.json()
+        received = len(response.content)
+        artifacts = len(dumps(mmif)) + len(dumps(output))
+    response.raise_for_status()
+    return {
+        'seconds': perf_counter() - started,
+        'received_mb': received / 1024**2,
+        'artifact_mb': artifacts / 1024**2,
+        'baseline_mb': baseline / 1024**2,
+    }
+
+
+def write_input(path: str, views: int, annotations: int) -> None:
+    from mario.mmif import write
+
+    with open(path, 'wb') as f:
+        write(synthetic_mmif(views, annotations), f, 'identity')
+
+
+def serve(urls, annotations: int) -> None:
+    """Run a stub app until terminated, and put its url on `urls`"""
+    from threading import Event
+
+    from mario.benchmarks.fakes import Services
+
+    with Services(latency=0, annotations=annotations) as app:
+        urls.put(app.url)
+        Event().wait()
+
+
+def run(views: int = 20, annotations: int = 10000) -> List[Dict]:
+    """Compare in-memory and streaming requests for one synthetic mmif
+
+    A new process starts with the peak RSS of its parent, so the input is
+    written and the stub app is run in processes of their own, to keep this
+    one small.
+    """
+    from multiprocessing import get_context
+
+    path = join(mkdtemp(prefix='mario-bench-'), 'input.json')
+    isolated(write_input, path, views, annotations)
+    context = get_context('spawn')
+    urls = context.Queue()
+    app = context.Process(target=serve, args=(urls, annotations), daemon=True)
+    app.start()
+    rows = []
+    try:
+        url = urls.get(timeout=60)
+        for mode in ('memory', 'stream'):
+            result, rss = isolated(call, mode, url, path)
+            rows.append(
+                {
+                    'mode': mode,
+                    'sent_mb': getsize(path) / 1024**2,
+                    **result,
+                    'peak_rss_mb': rss / 1024**2,
+                }
+            )
+    finally:
+        app.terminate()
+        remove(path)
+    return rows
+
+
+if __name__ == '__main__':
+    print(table(run(*(int(arg) for arg in argv[1:]))))
@@ -0,0 +1,96 @@
+"""Benchmark converting Whisper transcripts to mmif and caption formats
+
+    python -m mario.benchmarks.transcripts [segments]
+
+A synthetic Whisper JSON transcript of `segments` segments is converted to
+an mmif and every caption format either once per output, parsing the JSON
+each time as separate writers do, or in the single pass of `postprocess`.
+"""
+
+from json import dump
+from os.path import getsize, join
+from random import Random
+from shutil import rmtree
+from sys import argv
+from tempfile import mkdtemp
+from time import perf_counter
+from typing import Dict, List
+
+from mario.benchmarks import isolated, table
+
+WORDS = 'the a public broadcast archive of news and interviews with people'.split()
+
+
+def synthetic_transcript(segments: int, seed: int = 0) -> dict:
+    """A Whisper result of `segments` segments of a few seconds each"""
+    rng = Random(seed)
+    result, start = [], 0.0
+    for i in range(segments):
+        end = start + rng.uniform(1, 6)
+        text = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(4, 16)))
+        result.append(
+            {
+                'id': i,
+                'seek': int(start * 100),
+                'start': round(start, 2),
+                'end': round(end, 2),
+                'text': f' {text}.',
+                'tokens': [rng.randrange(50000) for _ in range(12)],
+                'temperature': 0.0,
+                'avg_logprob': -0.25,
+                'compression_ratio': 1.5,
+                'no_speech_prob': 0.01,
+            }
+        )
+        start = end
+    return {'text': ''.join(s['text'] for s in result), 'segments': result}
+
+
+def convert(mode: str, json_path: str, output_dir: str) -> Dict[str, int]:
+    """Convert the transcript at `json_path`. Returns {ext: bytes}"""
+    from mario.transcripts import FORMATS, convert, load_transcript, postprocess
+
+    if mode == 'single-pass':
+        outputs = postprocess(json_path)
+    else:
+        outputs = {'json': json_path}
+        for ext in FORMATS:
+            result = load_transcript(json_path)
+            outputs.update(convert(result, output_dir, ext, None, [ext], mmif=False))
+        result = load_transcript(json_path)
+        outputs.update(convert(result, output_dir, 'transcript', None, []))
+    return {ext: getsize(path) for ext, path in outputs.items()}
+
+
+def run(segments: int = 100_000) -> List[Dict]:
+    """Compare one pass per output with a single pass for every output"""
+    root = mkdtemp(prefix='mario-bench-')
+    json_path = join(root, 'transcript.json')
+    with open(json_path, 'w') as f:
+        dump(synthetic_transcript(segments), f)
+    size = getsize(json_path)
+    rows = []
+    try:
+        for mode in ('per-format', 'single-pass'):
+            started = perf_counter()
+            sizes, rss = isolated(convert, mode, json_path, root)
+            seconds = perf_counter() - started
+            rows.append(
+                {
+                    'mode': mode,
+                    'segments': segments,
+                    'json_mb': size / 1024**2,
+                    'written_mb': (sum(sizes.values()) - size) / 1024**2,
+                    'seconds': seconds,
+                    'segments_per_s': segments / seconds,
+                    'json_mb_per_s': size / 1024**2 / seconds,
+                    'peak_rss_mb': rss / 1024**2,
+                }
+            )
+    finally:
+        rmtree(root)
+    return rows
+
+
+if __name__ == '__main__':
+    print(table(run(*(int(arg) for arg in argv[1:]))))
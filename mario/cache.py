@@ -0,0 +1,424 @@
+"""Content-addressed cache of CLAMS app results
+
+An app's output MMIF is stored under a hash of the app, its version and its
+canonicalized input MMIF, so re-running an app on the same input is a lookup
+instead of a request, and a redeployed app is run again. Entries live in a
+local directory or under an S3 prefix, and are evicted by age and total size.
+
+`MMIFRef`s are never parsed: their key hashes the stored bytes as they are
+streamed, and their outputs are streamed to and from the cache. Since the
+bytes are not canonicalized, a ref only hits entries stored from a ref with
+the same serialization, not ones stored from the parsed mmif.
+
+Media documents live in each run's own workspace, so the workspace directory
+is replaced with `WORKSPACE` in keys and stored entries, and back with the
+current run's directory when an entry is read. Runs of the same input in
+different workspaces share entries.
+"""
+
+from abc import ABC, abstractmethod
+from contextlib import suppress
+from dataclasses import dataclass
+from functools import lru_cache
+from hashlib import sha256
+from io import BufferedReader, BytesIO, RawIOBase
+from json import dumps, loads
+from os import listdir, makedirs, remove, replace, stat, utime
+from os.path import join
+from shutil import copyfileobj
+from threading import Lock
+from time import time
+from typing import IO, Callable, Iterable, Optional, Tuple
+
+from mario.config import MMIF_CACHE, MMIF_CACHE_MAX_AGE, MMIF_CACHE_MAX_BYTES
+from mario.log import log
+
+# Stands in for the run's workspace directory in cache keys and entries
+WORKSPACE = '{workspace}/'
+
+
+class _Replaced(RawIOBase):
+    """A stream of `stream` with every `old` replaced by `new`
+
+    Up to `len(old) - 1` bytes are held back between reads, so occurrences
+    split across reads are still replaced.
+    """
+
+    def __init__(self, stream, old: bytes, new: bytes):
+        self.stream = stream
+        self.old = old
+        self.new = new
+        self.pending = b''
+        self.out = b''
+        self.eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def fill(self) -> None:
+        from mario.mmif import COPY_SIZE
+
+        while not self.out and not self.eof:
+            chunk = self.stream.read(COPY_SIZE)
+            data = self.pending + chunk
+            if not chunk:
+                self.eof = True
+                cut = len(data)
+            else:
+                cut = max(0, len(data) - len(self.old) + 1)
+                # Hold back an occurrence that spans the cut
+                found = data.find(self.old, max(0, cut - len(self.old) + 1))
+                if -1 < found < cut:
+                    cut = found
+            self.out = data[:cut].replace(self.old, self.new)
+            self.pending = data[cut:]
+
+    def readinto(self, buffer) -> int:
+        self.fill()
+        n = min(len(buffer), len(self.out))
+        buffer[:n] = self.out[:n]
+        self.out = self.out[n:]
+        return n
+
+
+def replaced(stream, old: Optional[str], new: Optional[str]):
+    """`stream`, with `old` replaced by `new` if both are given"""
+    if not old or not new:
+        return stream
+    return BufferedReader(_Replaced(stream, old.encode('utf-8'), new.encode('utf-8')))
+
+
+def local(workspace: Optional[str]) -> Optional[str]:
+    """The prefix of paths in `workspace`, as it appears in mmifs"""
+    return workspace.rstrip('/') + '/' if workspace else None
+
+
+def relative(data: bytes, workspace: Optional[str]) -> bytes:
+    """`data` with paths in `workspace` made relative to `WORKSPACE`"""
+    if not workspace:
+        return data
+    return data.replace(local(workspace).encode('utf-8'), WORKSPACE.encode('utf-8'))
+
+
+def absolute(data: bytes, workspace: Optional[str]) -> bytes:
+    """`data` with paths relative to `WORKSPACE` moved to `workspace`"""
+    if not workspace:
+        return data
+    return data.replace(WORKSPACE.encode('utf-8'), local(workspace).encode('utf-8'))
+
+
+def canonical(mmif: dict) -> bytes:
+    """Serialize an mmif with sorted keys and no whitespace"""
+    return dumps(mmif, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+
+def cache_key(
+    app: str, mmif, version: Optional[str] = None, workspace: Optional[str] = None
+) -> str:
+    """Key for the output of `app` (at `version`, if known) run on `mmif`
+
+    An `MMIFRef` is hashed as it is read, without parsing it. Paths in
+    `workspace` are hashed relative to it.
+    """
+    from mario.mmif import COPY_SIZE, MMIFRef
+
+    digest = sha256(app.encode('utf-8'))
+    digest.update(b'\0' + (version or '').encode('utf-8') + b'\0')
+    if isinstance(mmif, MMIFRef):
+        with mmif.open() as stored:
+            f = replaced(stored, local(workspace), WORKSPACE)
+            for chunk in iter(lambda: f.read(COPY_SIZE), b''):
+                digest.update(chunk)
+    else:
+        digest.update(relative(canonical(mmif), workspace))
+    return digest.hexdigest()
+
+
+@dataclass
+class CacheStats:
+    """Hit and miss counters for one cache"""
+
+    hits: int = 0
+    misses: int = 0
+    stores: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class MMIFCache(ABC):
+    """Base class for cache backends
+
+    Subclasses implement `fetch`, `write`, `entries` and `delete`.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = MMIF_CACHE_MAX_BYTES,
+        max_age: float = MMIF_CACHE_MAX_AGE,
+    ):
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.stats = CacheStats()
+        # Apps in a DAG look up and store results from parallel threads
+        self.lock = Lock()
+
+    @abstractmethod
+    def fetch(self, key: str, f: IO[bytes]) -> bool:
+        """Copy the stored bytes of `key` to `f`. False if there are none"""
+
+    @abstractmethod
+    def write(self, key: str, f: IO[bytes]) -> None:
+        """Store the bytes read from `f` under `key`"""
+
+    @abstractmethod
+    def entries(self) -> Iterable[Tuple[str, int, float]]:
+        """(key, size, last used timestamp) for every entry"""
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """Remove `key`, if it exists"""
+
+    def get(
+        self,
+        key: str,
+        directory: Optional[str] = None,
+        workspace: Optional[str] = None,
+    ):
+        """The cached mmif for `key`, or None
+
+        With a `directory`, the mmif is copied to a file there and an
+        `MMIFRef` to it is returned, instead of parsing it. Paths stored
+        relative to a workspace are moved to `workspace`.
+        """
+        from mario.mmif import COPY_SIZE, MMIFRef
+
+        if directory is None:
+            buffer = BytesIO()
+            found = self.fetch(key, buffer)
+        else:
+            path = join(directory, f'{key}.cached.json')
+            with open(path + '.tmp', 'wb') as f:
+                found = self.fetch(key, f)
+            if found:
+                with open(path + '.tmp', 'rb') as fetched, open(path, 'wb') as out:
+                    copyfileobj(
+                        replaced(fetched, WORKSPACE, local(workspace)), out, COPY_SIZE
+                    )
+                    size = out.tell()
+            remove(path + '.tmp')
+        with self.lock:
+            if found:
+                self.stats.hits += 1
+            else:
+                self.stats.misses += 1
+        if not found:
+            return None
+        if directory is None:
+            return loads(absolute(buffer.getvalue(), workspace))
+        return MMIFRef(path, size, 'identity')
+
+    def put(self, key: str, mmif, workspace: Optional[str] = None) -> None:
+        """Store an mmif, streaming it if it is an `MMIFRef`
+
+        Paths in `workspace` are stored relative to it.
+        """
+        from mario.mmif import MMIFRef
+
+        if isinstance(mmif, MMIFRef):
+            with mmif.open() as f:
+                self.write(key, replaced(f, local(workspace), WORKSPACE))
+        else:
+            self.write(key, BytesIO(relative(canonical(mmif), workspace)))
+        with self.lock:
+            self.stats.stores += 1
+
+    def evict(self) -> int:
+        """Delete entries older than `max_age`, then least recently used
+        entries until the cache fits in `max_bytes`. Returns the number deleted.
+        """
+        now = time()
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        evicted = 0
+        for key, size, used in entries:
+            if now - used <= self.max_age and total <= self.max_bytes:
+                break
+            self.delete(key)
+            total -= size
+            evicted += 1
+        with self.lock:
+            self.stats.evictions += evicted
+        if evicted:
+            log.info(f'Evicted {evicted} mmifs from the cache')
+        return evicted
+
+
+class LocalCache(MMIFCache):
+    """Cache backed by a local directory"""
+
+    def __init__(self, directory: str, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return join(self.directory, key + '.mmif')
+
+    def fetch(self, key: str, f: IO[bytes]) -> bool:
+        try:
+            with open(self.path(key), 'rb') as stored:
+                copyfileobj(stored, f)
+        except FileNotFoundError:
+            return False
+        # Record the use for LRU eviction
+        utime(self.path(key))
+        return True
+
+    def write(self, key: str, f: IO[bytes]) -> None:
+        tmp = self.path(key) + '.tmp'
+        with open(tmp, 'wb') as out:
+            copyfileobj(f, out)
+        replace(tmp, self.path(key))
+
+    def entries(self) -> Iterable[Tuple[str, int, float]]:
+        for name in listdir(self.directory):
+            if not name.endswith('.mmif'):
+                continue
+            try:
+                info = stat(join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            yield name[: -len('.mmif')], info.st_size, info.st_mtime
+
+    def delete(self, key: str) -> None:
+        with suppress(FileNotFoundError):
+            remove(self.path(key))
+
+
+class S3Cache(MMIFCache):
+    """Cache backed by an S3 prefix
+
+    S3 has no access time, so entries are aged by when they were written.
+    """
+
+    def __init__(self, bucket: str, prefix: str = '', **kwargs):
+        from mario.s3 import s3
+
+        super().__init__(**kwargs)
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client = s3()
+
+    def path(self, key: str) -> str:
+        return f'{self.prefix}/{key}.mmif' if self.prefix else f'{key}.mmif'
+
+    def fetch(self, key: str, f: IO[bytes]) -> bool:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.path(key))
+        except self.client.exceptions.NoSuchKey:
+            return False
+        with response['Body'] as body:
+            copyfileobj(body, f)
+        return True
+
+    def write(self, key: str, f: IO[bytes]) -> None:
+        from mario.s3 import upload_fileobj
+
+        upload_fileobj(f, self.bucket, self.path(key), client=self.client)
+
+    def entries(self) -> Iterable[Tuple[str, int, float]]:
+        paginator = self.client.get_paginator('list_objects_v2')
+        prefix = self.prefix + '/' if self.prefix else ''
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get('Contents', []):
+                name = item['Key'][len(prefix) :]
+                if not name.endswith('.mmif'):
+                    continue
+                modified = item['LastModified'].timestamp()
+                yield name[: -len('.mmif')], item['Size'], modified
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.path(key))
+
+
+def from_url(url: str, **kwargs) -> MMIFCache:
+    """A cache for a local directory or an `s3://bucket/prefix` url"""
+    if url.startswith('s3://'):
+        bucket, _, prefix = url[len('s3://') :].partition('/')
+        return S3Cache(bucket, prefix, **kwargs)
+    return LocalCache(url, **kwargs)
+
+
+@lru_cache(maxsize=None)
+def mmif_cache() -> Optional[MMIFCache]:
+    """The cache configured by `MMIF_CACHE`, or None if caching is disabled"""
+    return from_url(MMIF_CACHE) if MMIF_CACHE else None
+
+
+@lru_cache(maxsize=None)
+def _app_version(app: str) -> str:
+    from mario.client import client
+
+    response = client().get(app)
+    response.raise_for_status()
+    metadata = response.json()
+    version = metadata.get('app_version') or metadata.get('identifier')
+    if not version:
+        raise ValueError(f'{app} metadata has no app_version or identifier')
+    return str(version)
+
+
+def app_version(app: str) -> Optional[str]:
+    """The version of the CLAMS app at `app`, from its metadata, or None
+
+    CLAMS apps serve their metadata at their root url. Versions are looked up
+    once per process, and failed lookups are tried again next time.
+    """
+    try:
+        return _app_version(app)
+    except Exception as e:
+        log.warning(f'Could not read the version of {app}: {e}')
+        return None
+
+
+def run_cached(
+    app: str,
+    mmif,
+    run_app: Callable,
+    cache: MMIFCache,
+    version: Optional[str] = None,
+    directory: Optional[str] = None,
+    workspace: Optional[str] = None,
+):
+    """Run `mmif` through `app`, or reuse its cached output
+
+    Applied to each app of a pipeline in turn, cached outputs are followed
+    for the longest prefix that has already been run on this input, so if
+    A,B were run before, a run of A,B,C only calls C.
+
+    Outputs are keyed by the app's `version`, looked up from its metadata if
+    not given. If it is not known, the app is run without the cache, so a
+    redeployed app never serves the results of the one before.
+
+    If `mmif` is an `MMIFRef`, a cached output is copied to `directory` and
+    returned as a ref, see `MMIFCache.get`. Media paths in the run's
+    `workspace` are cached relative to it, so other runs can reuse the output.
+    """
+    from mario.mmif import MMIFRef
+
+    version = version or app_version(app)
+    if version is None:
+        return run_app(app, mmif)
+    key = cache_key(app, mmif, version, workspace)
+    directory = directory if isinstance(mmif, MMIFRef) else None
+    output = cache.get(key, directory, workspace)
+    if output is not None:
+        log.info(f'Reused cached result for {app}')
+        return output
+    output = run_app(app, mmif)
+    cache.put(key, output, workspace)
+    return output
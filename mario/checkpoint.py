@@ -0,0 +1,121 @@
+"""Checkpoint each CLAMS app's output MMIF during a pipeline run
+
+Checkpoints are keyed by run and app index, so a retried or resumed run can
+load the output of every app that completed instead of running it again.
+They are stored in a local directory or under an S3 prefix, and `clear`ed
+when the run succeeds. Checkpoints of runs that never succeed are left
+behind; use a lifecycle rule on the prefix to expire them.
+"""
+
+from os import listdir, makedirs, replace
+from os.path import dirname, exists, join
+from re import sub
+from shutil import rmtree
+from typing import Dict, List, Optional
+
+from mario.log import log
+
+
+def slug(app: str) -> str:
+    """A filesystem and S3 safe name for an app url"""
+    return sub(r'[^A-Za-z0-9._-]+', '_', app.split('://')[-1]).strip('_')
+
+
+class Checkpoints:
+    """Output mmifs of the apps in one run
+
+    Args:
+        location: A local directory or `s3://bucket/prefix`
+        run: Key for the run, e.g. `<flow>/<run id>/<guid>`
+    """
+
+    def __init__(self, location: str, run: str):
+        self.location = location.rstrip('/')
+        self.run = run
+        self.s3 = location.startswith('s3://')
+        if self.s3:
+            from mario.s3 import parse_url, s3
+
+            self.bucket, prefix = parse_url(self.location)
+            self.prefix = f'{prefix}/{run}' if prefix else run
+            self.client = s3()
+        self.saved: List[Dict] = []
+
+    def path(self, index: int, app: str) -> str:
+        """Where the output of app number `index` is stored"""
+        name = f'{index:02d}-{slug(app)}.mmif'
+        if self.s3:
+            return f'{self.prefix}/{name}'
+        return join(self.location, self.run, name)
+
+    def url(self, index: int, app: str) -> str:
+        if self.s3:
+            return f's3://{self.bucket}/{self.path(index, app)}'
+        return self.path(index, app)
+
+    def exists(self, index: int, app: str) -> bool:
+        if not self.s3:
+            return exists(self.path(index, app))
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.path(index, app))
+        except self.client.exceptions.ClientError:
+            return False
+        return True
+
+    def save(self, index: int, app: str, mmif: dict) -> str:
+        """Checkpoint the output of app number `index`. Returns its url"""
+        from mario.mmif import upload, write
+
+        if self.s3:
+            upload(mmif, self.bucket, self.path(index, app), client=self.client)
+        else:
+            path = self.path(index, app)
+            makedirs(dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                write(mmif, f)
+            replace(path + '.tmp', path)
+        url = self.url(index, app)
+        self.saved.append({'index': index, 'app': app, 'location': url})
+        log.debug(f'Checkpointed {app} to {url}')
+        return url
+
+    def load(self, index: int, app: str) -> dict:
+        from mario.mmif import download, read
+
+        if self.s3:
+            return download(self.bucket, self.path(index, app), client=self.client)
+        with open(self.path(index, app), 'rb') as f:
+            return read(f)
+
+    def clear(self) -> int:
+        """Delete every checkpoint of the run. Returns the number deleted"""
+        if not self.s3:
+            root = join(self.location, self.run)
+            if not exists(root):
+                return 0
+            deleted = len(listdir(root))
+            rmtree(root)
+            return deleted
+        deleted = 0
+        pages = self.client.get_paginator('list_objects_v2').paginate(
+            Bucket=self.bucket, Prefix=f'{self.prefix}/'
+        )
+        for page in pages:
+            keys = [{'Key': item['Key']} for item in page.get('Contents', [])]
+            if keys:
+                self.client.delete_objects(
+                    Bucket=self.bucket, Delete={'Objects': keys, 'Quiet': True}
+                )
+                deleted += len(keys)
+        log.debug(f'Deleted {deleted} checkpoints of {self.run}')
+        return deleted
+
+
+def checkpoints_for(flow: str, run_id: str, guid: str) -> Optional[Checkpoints]:
+    """Checkpoints of `guid` in a run of `flow`, or None if `CHECKPOINTS` is
+    not set"""
+    from mario.config import CHECKPOINTS
+
+    if not CHECKPOINTS:
+        return None
+    return Checkpoints(CHECKPOINTS, f'{flow}/{run_id}/{guid}')
@@ -0,0 +1,171 @@
+"""Sony Ci asset lookups through one shared client, with a TTL cache
+
+One authenticated Sony Ci client is shared by every lookup in a process.
+Asset records are cached until `SONYCI_CACHE_TTL`, or until shortly before
+their signed `proxyUrl` expires if that is sooner, and the assets of a
+whole chunk of GUIDs can be prefetched at once with bounded concurrency.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from threading import Lock
+from time import time
+from typing import Dict, Iterable, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from mario.cache import CacheStats
+from mario.config import SONYCI_CACHE_TTL, SONYCI_URL_MARGIN, SONYCI_WORKERS
+from mario.log import log
+
+
+def url_expiry(url: Optional[str]) -> Optional[float]:
+    """When a signed url expires, in epoch seconds, or None if it is not known
+
+    Understands CloudFront and S3 v2 `Expires`, and S3 v4 `X-Amz-Date` plus
+    `X-Amz-Expires`.
+    """
+    if not url:
+        return None
+    query = {key: values[0] for key, values in parse_qs(urlsplit(url).query).items()}
+    try:
+        if 'Expires' in query:
+            return float(query['Expires'])
+        if 'X-Amz-Date' in query and 'X-Amz-Expires' in query:
+            signed = datetime.strptime(query['X-Amz-Date'], '%Y%m%dT%H%M%SZ')
+            signed = signed.replace(tzinfo=timezone.utc).timestamp()
+            return signed + float(query['X-Amz-Expires'])
+    except ValueError:
+        log.warning(f'Could not read the expiry of {url}')
+    return None
+
+
+def proxy_checksum(asset: dict) -> Optional[str]:
+    """`md5:<hexdigest>` of the proxy at the asset's `proxyUrl`, if Sony Ci has one
+
+    The checksum of the asset itself is of the original file, which never
+    matches its proxy, so only one of the asset's `proxies` served from the
+    same location as `proxyUrl` is used.
+    """
+    url = urlsplit(asset.get('proxyUrl') or '')
+    for proxy in asset.get('proxies') or []:
+        location = urlsplit(proxy.get('location') or '')
+        md5 = proxy.get('md5Checksum') or proxy.get('md5')
+        if md5 and url.path and location[:3] == url[:3]:
+            return f'md5:{md5}'
+    return None
+
+
+class SonyCiAssets:
+    """Cached Sony Ci asset records
+
+    Args:
+        client: A Sony Ci client. Defaults to one made from the environment
+        ttl: Seconds an asset record is cached
+        margin: Seconds before its `proxyUrl` expires that a record is dropped
+    """
+
+    def __init__(
+        self,
+        client=None,
+        ttl: float = SONYCI_CACHE_TTL,
+        margin: float = SONYCI_URL_MARGIN,
+    ):
+        if client is None:
+            from sonyci import SonyCi
+
+            client = SonyCi(**SonyCi.from_env())
+        self.client = client
+        self.ttl = ttl
+        self.margin = margin
+        # asset id -> (asset, expires at)
+        self.assets: Dict[str, Tuple[dict, float]] = {}
+        self.lock = Lock()
+        self.stats = CacheStats()
+
+    def expires_at(self, asset: dict) -> float:
+        """When the cached copy of `asset` should be dropped"""
+        expires = time() + self.ttl
+        url_expires = url_expiry(asset.get('proxyUrl'))
+        if url_expires is not None:
+            expires = min(expires, url_expires - self.margin)
+        return expires
+
+    def cached(self, asset_id: str) -> Optional[dict]:
+        """The cached asset record, or None if missing or expired"""
+        with self.lock:
+            asset, expires = self.assets.get(str(asset_id), (None, 0.0))
+            if asset is not None and expires > time():
+                self.stats.hits += 1
+                return asset
+            self.stats.misses += 1
+            return None
+
+    def fetch(self, asset_id: str) -> dict:
+        """Look up an asset from Sony Ci, and cache it"""
+        asset = self.client.get(f'assets/{asset_id}')
+        with self.lock:
+            self.assets[str(asset_id)] = (asset, self.expires_at(asset))
+            self.stats.stores += 1
+        return asset
+
+    def get(self, asset_id: str) -> dict:
+        """The asset record for `asset_id`, from the cache if still fresh"""
+        return self.cached(asset_id) or self.fetch(asset_id)
+
+    def proxy_url(self, asset_id: str) -> str:
+        return self.get(asset_id)['proxyUrl']
+
+    def prefetch(self, asset_ids: Iterable[str], workers: int = SONYCI_WORKERS) -> int:
+        """Look up every asset not already cached, `workers` at a time
+
+        Failed lookups are logged and left to be retried by `get`. Returns the
+        number of assets fetched.
+        """
+        now = time()
+        with self.lock:
+            missing = sorted(
+                {
+                    str(asset_id)
+                    for asset_id in asset_ids
+                    if self.assets.get(str(asset_id), (None, 0.0))[1] <= now
+                }
+            )
+        if not missing:
+            return 0
+
+        def fetch(asset_id: str) -> bool:
+            try:
+                self.fetch(asset_id)
+                return True
+            except Exception as e:
+                log.warning(f'Could not prefetch Sony Ci asset {asset_id}: {e}')
+                return False
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            fetched = sum(pool.map(fetch, missing))
+        log.debug(f'Prefetched {fetched} of {len(missing)} Sony Ci assets')
+        return fetched
+
+    def prefetch_guids(
+        self, guids: Iterable[str], workers: int = SONYCI_WORKERS
+    ) -> int:
+        """Prefetch the first asset of each media file, as flows use"""
+        from mario.db import chowda
+
+        db = chowda()
+        guids = list(guids)
+        db.prefetch(guids)
+        asset_ids = []
+        for guid in guids:
+            with db.lock:
+                assets = db.media_files[guid].assets if guid in db.media_files else []
+            if assets:
+                asset_ids.append(assets[0].id)
+        return self.prefetch(asset_ids, workers)
+
+
+@lru_cache(maxsize=None)
+def sonyci() -> SonyCiAssets:
+    """The shared Sony Ci asset cache for this process"""
+    return SonyCiAssets()
@@ -0,0 +1,264 @@
+"""Shared HTTP client for CLAMS apps, fastclam and Chowda
+
+One pooled, keep-alive `requests.Session` is shared by every call in a
+process. Requests have connect and read timeouts. Connection errors, timeouts
+and 5xx responses are retried with exponential backoff, and a circuit breaker
+per URL stops hammering an app that keeps failing. Requests that are not
+idempotent are only retried if they failed to connect, so the app never saw
+them. After a read timeout or a broken response an app may still be working
+on them, so they are not sent again.
+"""
+
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from random import uniform
+from threading import Lock
+from time import monotonic, sleep
+from typing import Dict, Optional, Tuple
+
+from mario.config import (
+    CIRCUIT_RESET,
+    CIRCUIT_THRESHOLD,
+    HTTP_BACKOFF,
+    HTTP_CONNECT_TIMEOUT,
+    HTTP_POOL_SIZE,
+    HTTP_READ_TIMEOUT,
+    HTTP_RETRIES,
+)
+from mario.log import log
+from mario.utils import CircuitOpenError
+
+# Response codes that are worth retrying. CLAMS apps are pure functions of
+# their input MMIF, so retrying a POST to them is safe.
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# Methods that are retried after a read timeout or a broken response
+IDEMPOTENT = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+
+def connect_failed(error: Exception) -> bool:
+    """Whether a request failed before it was sent: refused, unresolved, or a
+    connect timeout"""
+    from requests.exceptions import ConnectionError, ConnectTimeout
+    from urllib3.exceptions import NewConnectionError
+
+    if isinstance(error, ConnectTimeout):
+        return True
+    if not isinstance(error, ConnectionError) or not error.args:
+        return False
+    # requests wraps urllib3's MaxRetryError, whose reason is the cause
+    reason = getattr(error.args[0], 'reason', error.args[0])
+    return isinstance(reason, NewConnectionError)
+
+
+@dataclass
+class Stats:
+    """Counters for calls to one URL"""
+
+    attempts: int = 0
+    retries: int = 0
+    failures: int = 0
+    rejected: int = 0
+    latency: float = 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        """Mean seconds per attempt"""
+        return self.latency / self.attempts if self.attempts else 0.0
+
+
+class CircuitBreaker:
+    """Refuse calls after `threshold` consecutive failures
+
+    After `reset` seconds, a single trial call is let through (half-open). If
+    it succeeds the circuit closes, otherwise it opens again.
+    """
+
+    def __init__(
+        self, threshold: int = CIRCUIT_THRESHOLD, reset: float = CIRCUIT_RESET
+    ):
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.lock = Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if monotonic() - self.opened_at >= self.reset:
+            return 'half-open'
+        return 'open'
+
+    def allow(self) -> bool:
+        """Whether a call may be made now"""
+        with self.lock:
+            state = self.state
+            if state == 'half-open':
+                # Let one trial through, and hold the others until it reports
+                self.opened_at = monotonic()
+                return True
+            return state == 'closed'
+
+    def success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = monotonic()
+
+
+class Client:
+    """Pooled HTTP client with timeouts, retries and per-URL circuit breakers"""
+
+    def __init__(
+        self,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = HTTP_READ_TIMEOUT,
+        retries: int = HTTP_RETRIES,
+        backoff: float = HTTP_BACKOFF,
+        pool_size: int = HTTP_POOL_SIZE,
+        circuit_threshold: int = CIRCUIT_THRESHOLD,
+        circuit_reset: float = CIRCUIT_RESET,
+    ):
+        from requests import Session
+        from requests.adapters import HTTPAdapter
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.breakers: Dict[str, CircuitBreaker] = defaultdict(
+            lambda: CircuitBreaker(circuit_threshold, circuit_reset)
+        )
+        self.stats: Dict[str, Stats] = defaultdict(Stats)
+        self.lock = Lock()
+
+    def wait(self, attempt: int) -> float:
+        """Exponential backoff with full jitter"""
+        return uniform(0, self.backoff * 2**attempt)
+
+    def _attempt(self, method: str, url: str, **kwargs):
+        """Send one attempt, counting it. Returns (response, error)"""
+        from requests.exceptions import RequestException
+
+        started = monotonic()
+        error = response = None
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except RequestException as e:
+            error = e
+        with self.lock:
+            stats = self.stats[url]
+            stats.attempts += 1
+            stats.latency += monotonic() - started
+        return response, error
+
+    @staticmethod
+    def _should_retry(method: str, error: Optional[Exception]) -> bool:
+        """Whether a failed attempt may be sent again
+
+        Error statuses are always retried. Requests that are not idempotent
+        are only retried if they never reached the app.
+        """
+        from requests.exceptions import ChunkedEncodingError, ConnectionError, Timeout
+
+        if error is None:
+            return True
+        if method.upper() in IDEMPOTENT:
+            return isinstance(error, (ConnectionError, ChunkedEncodingError, Timeout))
+        return connect_failed(error)
+
+    def request(
+        self,
+        method: str,
+        url: str,
+        retry_on: Tuple[int, ...] = RETRY_STATUSES,
+        **kwargs,
+    ):
+        """Make a request, retrying connection errors and `retry_on` statuses
+
+        Read timeouts and broken responses are only retried for `IDEMPOTENT`
+        methods. Every failed attempt is counted, and reported to the
+        circuit breaker, whether it is retried or not.
+
+        Returns the last response, which may still be an error response once
+        retries are exhausted.
+
+        Raises:
+            CircuitOpenError: if the circuit for `url` is open
+            requests.RequestException: if the last attempt failed
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        # File bodies are rewound before each retry
+        body = kwargs.get('data')
+        position = body.tell() if hasattr(body, 'seek') else None
+        breaker = self.breakers[url]
+        stats = self.stats[url]
+        if not breaker.allow():
+            with self.lock:
+                stats.rejected += 1
+            raise CircuitOpenError(f'Circuit open for {url}')
+        for attempt in range(self.retries + 1):
+            if attempt:
+                # Stop retrying if the failures so far have opened the circuit
+                if not breaker.allow():
+                    break
+                with self.lock:
+                    stats.retries += 1
+                if position is not None:
+                    body.seek(position)
+            response, error = self._attempt(method, url, **kwargs)
+            if error is None and response.status_code not in retry_on:
+                breaker.success()
+                return response
+            breaker.failure()
+            if not self._should_retry(method, error):
+                break
+            # Give up now, rather than after a backoff, if this opened the circuit
+            if attempt < self.retries and breaker.state != 'open':
+                reason = error or f'status {response.status_code}'
+                wait = self.wait(attempt)
+                log.warning(
+                    f'{method} {url} failed ({reason}). Retrying in {wait:.1f}s'
+                )
+                sleep(wait)
+
+        with self.lock:
+            stats.failures += 1
+        if error is not None:
+            raise error
+        return response
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def metrics(self) -> Dict[str, dict]:
+        """Counters and circuit state for every URL called so far"""
+        with self.lock:
+            return {
+                url: {
+                    **asdict(stats),
+                    'mean_latency': stats.mean_latency,
+                    'circuit': self.breakers[url].state,
+                }
+                for url, stats in self.stats.items()
+            }
+
+
+@lru_cache(maxsize=None)
+def client() -> Client:
+    """The shared client for this process"""
+    return Client()
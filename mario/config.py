@@ -1,3 +1,141 @@
 from os import environ
 
 MEDIA_DIR = environ.get('MEDIA_DIR', '/m')
+
+# Media downloads
+DOWNLOAD_CHUNK_SIZE = int(environ.get('DOWNLOAD_CHUNK_SIZE', 64 * 1024 * 1024))
+DOWNLOAD_WORKERS = int(environ.get('DOWNLOAD_WORKERS', 8))
+DOWNLOAD_RETRIES = int(environ.get('DOWNLOAD_RETRIES', 3))
+# Seconds to wait for each read of a download before retrying the chunk
+DOWNLOAD_READ_TIMEOUT = float(environ.get('DOWNLOAD_READ_TIMEOUT', 60))
+
+# HTTP calls to CLAMS apps, fastclam and Chowda
+HTTP_CONNECT_TIMEOUT = float(environ.get('HTTP_CONNECT_TIMEOUT', 10))
+HTTP_READ_TIMEOUT = float(environ.get('HTTP_READ_TIMEOUT', 4 * 60 * 60))
+HTTP_RETRIES = int(environ.get('HTTP_RETRIES', 3))
+HTTP_BACKOFF = float(environ.get('HTTP_BACKOFF', 1))
+HTTP_POOL_SIZE = int(environ.get('HTTP_POOL_SIZE', 10))
+CIRCUIT_THRESHOLD = int(environ.get('CIRCUIT_THRESHOLD', 5))
+CIRCUIT_RESET = float(environ.get('CIRCUIT_RESET', 60))
+
+# CLAMS app result cache. A local directory or s3://bucket/prefix. Unset disables
+MMIF_CACHE = environ.get('MMIF_CACHE')
+MMIF_CACHE_MAX_BYTES = int(environ.get('MMIF_CACHE_MAX_BYTES', 50 * 1024**3))
+MMIF_CACHE_MAX_AGE = float(environ.get('MMIF_CACHE_MAX_AGE', 30 * 24 * 60 * 60))
+
+# Logging. LOG_FORMAT is "rich" for the console, or "json" for one JSON
+# record per line on stderr, written by a background thread
+LOG_FORMAT = environ.get('LOG_FORMAT', 'rich')
+LOG_LEVEL = environ.get('LOG_LEVEL', 'INFO')
+# Messages and bound values longer than this many characters are summarized
+LOG_MAX_CHARS = int(environ.get('LOG_MAX_CHARS', 1000))
+
+# MMIF serialization. One of gzip, zstd or identity. Compression is opt-in,
+# because readers such as Chowda parse the raw object body as JSON
+MMIF_ENCODING = environ.get('MMIF_ENCODING', 'identity')
+MMIF_SPOOL_SIZE = int(environ.get('MMIF_SPOOL_SIZE', 64 * 1024 * 1024))
+# Send mmifs to apps from files and spool responses to disk, instead of
+# parsing them in memory. Set MMIF_STREAM=1 to enable
+MMIF_STREAM = environ.get('MMIF_STREAM', '0') not in ('0', 'false', '')
+# Mmifs larger than this are stored in S3 and kept as refs between steps
+MMIF_REF_SIZE = int(environ.get('MMIF_REF_SIZE', 64 * 1024 * 1024))
+
+# Where run_pipeline checkpoints each app's output, e.g. a local directory or
+# s3://bucket/prefix. Unset disables checkpoints. A run's checkpoints are
+# deleted once it succeeds
+CHECKPOINTS = environ.get('CHECKPOINTS')
+
+# Per-run media workspaces on the shared volume
+WORKSPACE_DIR = environ.get('WORKSPACE_DIR', 'work')
+# Disk budget for MEDIA_DIR in bytes. 0 disables eviction
+MEDIA_BUDGET = int(environ.get('MEDIA_BUDGET', 0))
+# Workspaces untouched for this many seconds may be evicted
+MEDIA_STALE_AGE = float(environ.get('MEDIA_STALE_AGE', 24 * 60 * 60))
+# Set MEDIA_CACHE=1 to share media proxies between runs, in
+# MEDIA_DIR/MEDIA_CACHE_DIR keyed by Sony Ci asset id. Off by default, so each
+# run downloads into its own workspace
+MEDIA_CACHE = environ.get('MEDIA_CACHE', '0') not in ('0', 'false', '')
+MEDIA_CACHE_DIR = environ.get('MEDIA_CACHE_DIR', '.cache')
+# Size budget of the media cache in bytes. 0 disables size eviction. Unset,
+# the cache may use half of the volume space it could grow into: its own
+# size plus the free space
+MEDIA_CACHE_MAX_BYTES = (
+    int(environ['MEDIA_CACHE_MAX_BYTES'])
+    if environ.get('MEDIA_CACHE_MAX_BYTES')
+    else None
+)
+# Unused proxies are evicted after this many seconds
+MEDIA_CACHE_MAX_AGE = float(environ.get('MEDIA_CACHE_MAX_AGE', 3 * 24 * 60 * 60))
+
+# rq / Redis
+REDIS_URL = environ.get('REDIS_URL', 'redis://redis/0')
+
+# Per-GUID pipeline jobs. Producers wait while a queue holds JOB_MAX_DEPTH
+# jobs, and give up after JOB_SUBMIT_TIMEOUT seconds
+JOB_MAX_DEPTH = int(environ.get('JOB_MAX_DEPTH', 1000))
+JOB_SUBMIT_TIMEOUT = float(environ.get('JOB_SUBMIT_TIMEOUT', 60 * 60))
+JOB_TIMEOUT = int(environ.get('JOB_TIMEOUT', 6 * 60 * 60))
+# Retries of failed or abandoned jobs
+JOB_RETRIES = int(environ.get('JOB_RETRIES', 3))
+
+# Persistent Whisper worker
+WHISPER_QUEUE = environ.get('WHISPER_QUEUE', 'whisper')
+# "whisper" for openai-whisper, or "stub" for a model-free stand-in
+WHISPER_BACKEND = environ.get('WHISPER_BACKEND', 'whisper')
+WHISPER_DEVICE = environ.get('WHISPER_DEVICE')
+WHISPER_JOB_TIMEOUT = int(environ.get('WHISPER_JOB_TIMEOUT', 6 * 60 * 60))
+
+# Start-up import time budget for the mario CLI, in seconds
+IMPORT_BUDGET = float(environ.get('IMPORT_BUDGET', 0.5))
+
+# Run metrics in OpenMetrics text format. Unset disables each export
+METRICS_FILE = environ.get('METRICS_FILE')
+PUSHGATEWAY = environ.get('PUSHGATEWAY')
+# Each run pushes its own Pushgateway group. Groups pushed more than this many
+# seconds ago are deleted, so keep it well above the scrape interval
+PUSHGATEWAY_RETENTION = float(environ.get('PUSHGATEWAY_RETENTION', 60 * 60))
+
+# Adaptive concurrency per CLAMS app, shared by every worker through Redis.
+# Set APP_SCHEDULER=1 to enable
+APP_SCHEDULER = environ.get('APP_SCHEDULER', '0') not in ('0', 'false', '')
+APP_CONCURRENCY_START = float(environ.get('APP_CONCURRENCY_START', 2))
+APP_CONCURRENCY_MIN = float(environ.get('APP_CONCURRENCY_MIN', 1))
+APP_CONCURRENCY_MAX = float(environ.get('APP_CONCURRENCY_MAX', 16))
+# Responses slower than this many seconds count as overload. 0 disables
+APP_LATENCY_TARGET = float(environ.get('APP_LATENCY_TARGET', 10 * 60))
+# Seconds between multiplicative decreases, so one burst only backs off once
+APP_DECREASE_COOLDOWN = float(environ.get('APP_DECREASE_COOLDOWN', 10))
+APP_ADMISSION_TIMEOUT = float(environ.get('APP_ADMISSION_TIMEOUT', 60 * 60))
+# Leases of crashed workers expire after this many seconds without renewal
+APP_LEASE_TTL = float(environ.get('APP_LEASE_TTL', 60))
+
+# Frame rate of the reduced video proxy made for apps that need `frames`
+PREPROCESS_FPS = float(environ.get('PREPROCESS_FPS', 2))
+
+# Auth0 client credentials for the Chowda API token. AUTH0_DOMAIN may be a
+# domain or the full token endpoint url
+AUTH0_DOMAIN = environ.get('AUTH0_DOMAIN')
+CLIENT_ID = environ.get('CLIENT_ID')
+CLIENT_SECRET = environ.get('CLIENT_SECRET')
+API_AUDIENCE = environ.get('API_AUDIENCE')
+# Refresh tokens this many seconds before they expire, plus up to the jitter
+TOKEN_REFRESH_MARGIN = float(environ.get('TOKEN_REFRESH_MARGIN', 5 * 60))
+TOKEN_REFRESH_JITTER = float(environ.get('TOKEN_REFRESH_JITTER', 60))
+# Kubernetes secret the token is written to
+TOKEN_SECRET_NAMESPACE = environ.get('TOKEN_SECRET_NAMESPACE', 'argo-events')
+TOKEN_SECRET_NAME = environ.get('TOKEN_SECRET_NAME', 'argo-events-chowda-api-token')
+
+# S3 transfers. Sizes in bytes
+S3_MULTIPART_THRESHOLD = int(environ.get('S3_MULTIPART_THRESHOLD', 16 * 1024 * 1024))
+S3_MULTIPART_CHUNKSIZE = int(environ.get('S3_MULTIPART_CHUNKSIZE', 16 * 1024 * 1024))
+# Threads per transfer, and transfers run at once by upload_many
+S3_MAX_CONCURRENCY = int(environ.get('S3_MAX_CONCURRENCY', 10))
+S3_UPLOAD_WORKERS = int(environ.get('S3_UPLOAD_WORKERS', 8))
+S3_MAX_POOL = int(environ.get('S3_MAX_POOL', 64))
+
+# Sony Ci asset lookups. Assets are cached for SONYCI_CACHE_TTL seconds, and
+# never past SONYCI_URL_MARGIN seconds before their proxyUrl expires
+SONYCI_CACHE_TTL = float(environ.get('SONYCI_CACHE_TTL', 60 * 60))
+SONYCI_URL_MARGIN = float(environ.get('SONYCI_URL_MARGIN', 5 * 60))
+# Concurrent lookups when prefetching the assets of a batch
+SONYCI_WORKERS = int(environ.get('SONYCI_WORKERS', 4))
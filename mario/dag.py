@@ -0,0 +1,238 @@
+"""CLAMS pipelines as a DAG of apps
+
+A pipeline spec names each app and the apps it runs after. Apps whose
+dependencies are done run concurrently, and the new views each app adds are
+merged back together in spec order, so the output does not depend on which
+branch finished first. A plain list of app urls is a linear chain.
+
+Spec format, as JSON or the equivalent Python objects:
+
+    [
+        {"name": "bars", "url": "http://app-barsdetection"},
+        {"name": "whisper", "url": "http://app-whisper", "needs": ["audio"]},
+        {"name": "ner", "url": "http://app-spacy", "after": ["whisper"],
+         "consumes": ["TextDocument"]}
+    ]
+
+`needs` declares the media an app reads, see `mario.preprocess`. `consumes`
+declares the annotation types an app reads from earlier views. The app is
+sent only the views that contain them, see `mario.mmif.project`, and every
+view if `consumes` is not given.
+"""
+
+from dataclasses import dataclass
+from functools import partial
+from json import loads
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
+
+from mario.mmif import MMIF, MMIFRef, fresh_view_id, load, rewrite_refs, view_ids
+from mario.phases import Phase, run_phases
+
+
+@dataclass
+class App:
+    """A CLAMS app in a pipeline"""
+
+    name: str
+    url: str
+    after: Tuple[str, ...] = ()
+    needs: Tuple[str, ...] = ()
+    consumes: Optional[Tuple[str, ...]] = None
+
+
+def as_tuple(value: Union[None, str, List[str]]) -> Tuple[str, ...]:
+    """A spec field of one name or a list of them, as a tuple"""
+    if value is None:
+        return ()
+    return (value,) if isinstance(value, str) else tuple(value)
+
+
+def chain(urls: List[str]) -> List[App]:
+    """A linear pipeline, each app running after the one before it"""
+    apps = []
+    for url in urls:
+        name = url if url not in {app.name for app in apps} else f'{url}#{len(apps)}'
+        apps.append(App(name, url, (apps[-1].name,) if apps else ()))
+    return apps
+
+
+def parse(spec: Union[str, list, dict]) -> List[App]:
+    """Parse a pipeline spec into apps, in a stable topological order
+
+    Args:
+        spec: A list of app urls, a list of `{name, url, after, needs,
+            consumes}` objects, a mapping of name to `{url, after, needs,
+            consumes}`, or any of these as JSON
+
+    Raises:
+        ValueError: if names repeat, a dependency is unknown, or there is a cycle
+    """
+    if isinstance(spec, str):
+        spec = loads(spec)
+    if isinstance(spec, dict):
+        spec = [{'name': name, **app} for name, app in spec.items()]
+    if all(isinstance(app, str) for app in spec):
+        return chain(spec)
+
+    apps = [
+        App(
+            app['name'],
+            app['url'],
+            as_tuple(app.get('after')),
+            as_tuple(app.get('needs')),
+            None if app.get('consumes') is None else as_tuple(app['consumes']),
+        )
+        for app in spec
+    ]
+    names = [app.name for app in apps]
+    if len(set(names)) != len(names):
+        raise ValueError(f'App names must be unique: {names}')
+    for app in apps:
+        unknown = set(app.after) - set(names)
+        if unknown:
+            raise ValueError(f'{app.name} runs after unknown apps {unknown}')
+
+    ordered, done = [], set()
+    while len(ordered) < len(apps):
+        ready = [a for a in apps if a.name not in done and set(a.after) <= done]
+        if not ready:
+            raise ValueError(f'Pipeline has a cycle: {set(names) - done}')
+        ordered.extend(ready)
+        done.update(app.name for app in ready)
+    return ordered
+
+
+class DAGRun:
+    """One run of an mmif through a DAG of apps
+
+    Inputs and outputs may be `MMIFRef`s. They are only parsed when several
+    branches have to be merged.
+
+    Args:
+        apps: The apps, in topological order
+        source: The input mmif
+        run_app: Called as `run_app(index, app, mmif)` to get an app's output
+    """
+
+    def __init__(
+        self,
+        apps: List[App],
+        source: MMIF,
+        run_app: Callable[[int, App, MMIF], MMIF],
+    ):
+        self.apps = apps
+        self.source = source
+        self.run_app = run_app
+        self.order = {app.name: index for index, app in enumerate(apps)}
+        self.by_name = {app.name: app for app in apps}
+        self.outputs: Dict[str, MMIF] = {}
+        # View ids in each app's input, or the input itself if it is a ref
+        self.inputs: Dict[str, Union[Set[str], MMIFRef]] = {}
+        # Views each app added, with the ids the app gave them
+        self.added: Dict[str, List[dict]] = {}
+        # For each app, view id in its input -> (app that added it, original
+        # id). None until needed if the app runs after a single app
+        self.context: Dict[str, Optional[Dict[str, Tuple[str, str]]]] = {}
+        self.timings: Dict = {}
+
+    def ancestors(self, name: str) -> Set[str]:
+        found = set()
+        todo = list(self.by_name[name].after)
+        while todo:
+            parent = todo.pop()
+            if parent not in found:
+                found.add(parent)
+                todo.extend(self.by_name[parent].after)
+        return found
+
+    def added_by(self, name: str) -> List[dict]:
+        """Views app `name` added, with the ids the app gave them"""
+        if name not in self.added:
+            before = self.inputs[name]
+            if isinstance(before, MMIFRef):
+                before = view_ids(before.load())
+            self.added[name] = [
+                view
+                for view in load(self.outputs[name]).get('views', [])
+                if view['id'] not in before
+            ]
+        return self.added[name]
+
+    def context_of(self, name: str) -> Dict[str, Tuple[str, str]]:
+        """View id in the input of `name` -> (app that added it, original id)"""
+        context = self.context[name]
+        if context is None:
+            # The parent's output holds every ancestor's views
+            parent = self.by_name[name].after[0]
+            context = dict(self.context_of(parent))
+            context.update({v['id']: (parent, v['id']) for v in self.added_by(parent)})
+            self.context[name] = context
+        return context
+
+    def build(self, names: Set[str]) -> Tuple[dict, Dict[str, Tuple[str, str]]]:
+        """Merge the views added by `names` onto the source mmif
+
+        Views are merged in spec order. A view whose id is already taken gets
+        the next free id, and references to it are rewritten to match.
+        `names` must include all of their own ancestors.
+
+        Returns:
+            The merged mmif, and its view id -> (app, original id) mapping
+        """
+        source = load(self.source)
+        mmif = {**source, 'views': list(source.get('views', []))}
+        used = view_ids(source)
+        ids: Dict[Tuple[str, str], str] = {}
+        for name in sorted(names, key=self.order.get):
+            translate = {
+                local: ids[origin] for local, origin in self.context_of(name).items()
+            }
+            for view in self.added_by(name):
+                assigned = view['id']
+                if assigned in used:
+                    assigned = fresh_view_id(used)
+                used.add(assigned)
+                ids[name, view['id']] = assigned
+                translate[view['id']] = assigned
+            changes = {old: new for old, new in translate.items() if old != new}
+            for view in self.added_by(name):
+                if changes:
+                    renamed = rewrite_refs(view, changes)
+                    renamed['id'] = ids[name, view['id']]
+                    mmif['views'].append(renamed)
+                else:
+                    mmif['views'].append(view)
+        return mmif, {assigned: origin for origin, assigned in ids.items()}
+
+    def input_for(self, app: App) -> Tuple[MMIF, Optional[Dict[str, Tuple[str, str]]]]:
+        """The input mmif for `app`, and its view id mapping if known yet"""
+        if not app.after:
+            return self.source, {}
+        if len(app.after) == 1:
+            # The dependency's output already holds every ancestor's views
+            return self.outputs[app.after[0]], None
+        names = set(app.after)
+        for parent in app.after:
+            names |= self.ancestors(parent)
+        return self.build(names)
+
+    def node(self, app: App) -> None:
+        mmif, context = self.input_for(app)
+        output = self.run_app(self.order[app.name], app, mmif)
+        self.context[app.name] = context
+        self.inputs[app.name] = mmif if isinstance(mmif, MMIFRef) else view_ids(mmif)
+        self.outputs[app.name] = output
+
+    def run(self, max_workers: int = 8) -> MMIF:
+        """Run every app and return the merged output mmif"""
+        self.timings = run_phases(
+            [Phase(app.name, partial(self.node, app), app.after) for app in self.apps],
+            max_workers=max_workers,
+        )
+        names = set(self.by_name)
+        parents = {parent for app in self.apps for parent in app.after}
+        sinks = [app.name for app in self.apps if app.name not in parents]
+        if len(sinks) == 1 and self.ancestors(sinks[0]) | {sinks[0]} == names:
+            # A single final app already holds every view, e.g. a linear chain
+            return self.outputs[sinks[0]]
+        return self.build(names)[0]
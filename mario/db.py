@@ -0,0 +1,240 @@
+"""Chowda database access with per-run caching and bulk writes
+
+One session is shared by every lookup in a process. Batches and media files
+are cached for the whole run, a media file is loaded with its assets in a
+single query, and new rows can be queued and written together in one commit.
+Rows are inserted in bulk from plain column values, with foreign key ids, so
+writing never touches the cached objects in the session.
+"""
+
+from functools import lru_cache
+from threading import RLock
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from mario.log import log
+
+
+class ChowdaDB:
+    """Cached reads and bulk writes against the Chowda database
+
+    Args:
+        engine: SQLAlchemy engine. Defaults to `chowda.db.engine`
+    """
+
+    def __init__(self, engine=None):
+        from sqlmodel import Session
+
+        if engine is None:
+            from chowda.db import engine
+        self.engine = engine
+        # Keep cached objects usable after commits
+        self.session = Session(engine, expire_on_commit=False)
+        self.batches: Dict[int, object] = {}
+        self.media_files: Dict[str, object] = {}
+        self.runs: Dict[str, object] = {}
+        # (model, column values) of rows to insert
+        self.pending: List[Tuple[type, dict]] = []
+        # Rows that could not be written, even on their own
+        self.failed: List[Tuple[type, dict]] = []
+        # Sessions are not thread safe, and batch mode looks up from threads
+        self.lock = RLock()
+
+    def _media_file_query(self):
+        from chowda.models import MediaFile
+        from sqlalchemy.orm import joinedload
+        from sqlmodel import select
+
+        return select(MediaFile).options(joinedload(MediaFile.assets))
+
+    def batch(self, batch_id: Optional[int]):
+        """The Batch with `batch_id`, or None"""
+        from chowda.models import Batch
+
+        if batch_id is None:
+            return None
+        with self.lock:
+            if batch_id not in self.batches:
+                self.batches[batch_id] = self.session.get(Batch, batch_id)
+            return self.batches[batch_id]
+
+    def media_file(self, guid: str):
+        """The MediaFile for `guid`, with its assets loaded"""
+        from chowda.models import MediaFile
+
+        with self.lock:
+            if guid not in self.media_files:
+                self.media_files[guid] = (
+                    self.session.exec(
+                        self._media_file_query().where(MediaFile.guid == guid)
+                    )
+                    .unique()
+                    .one()
+                )
+            return self.media_files[guid]
+
+    def asset(self, guid: str) -> Tuple[str, str, str]:
+        """(id, name, type) of the media asset of `guid`
+
+        Read under the lock, since batch mode looks assets up from threads.
+        """
+        with self.lock:
+            assets = self.media_file(guid).assets
+            assert assets, f'No media assets found for {guid}'
+            # Get the first asset. This is ok, because we are now filtering
+            # SonyCiAssets on ingest, so they should all be media.
+            asset = assets[0]
+            return asset.id, asset.name, asset.type.value.lower()
+
+    def prefetch(self, guids: Iterable[str]) -> None:
+        """Load the MediaFiles for many `guids`, and their assets, in one query"""
+        from chowda.models import MediaFile
+
+        with self.lock:
+            missing = [guid for guid in guids if guid not in self.media_files]
+            if not missing:
+                return
+            for media_file in self.session.exec(
+                self._media_file_query().where(MediaFile.guid.in_(missing))
+            ).unique():
+                self.media_files[media_file.guid] = media_file
+        log.debug(f'Prefetched {len(missing)} media files')
+
+    def batch_guids(self, batch_id: int) -> List[str]:
+        """The guids of every media file in a batch"""
+        from chowda.models import Batch, MediaFile
+        from sqlmodel import select
+
+        with self.lock:
+            return list(
+                self.session.exec(
+                    select(MediaFile.guid)
+                    .join(MediaFile.batches)
+                    .where(Batch.id == batch_id)
+                    .order_by(MediaFile.guid)
+                ).all()
+            )
+
+    def metaflow_run(self, run_id: str):
+        """The written MetaflowRun with `run_id`, or None"""
+        from chowda.models import MetaflowRun
+
+        with self.lock:
+            if self.runs.get(run_id) is None:
+                self.runs[run_id] = self.session.get(MetaflowRun, run_id)
+            return self.runs[run_id]
+
+    def add_run(
+        self,
+        run_id: str,
+        guid: str,
+        batch_id: Optional[int],
+        defer: bool = False,
+        **fields,
+    ) -> dict:
+        """Add a MetaflowRun of `guid` in `batch_id`. See `add`"""
+        from chowda.models import MetaflowRun
+
+        run = {'id': run_id, 'batch_id': batch_id, 'media_file_id': guid, **fields}
+        self.add(MetaflowRun, run, defer)
+        return run
+
+    def add_mmif(
+        self,
+        guid: str,
+        run_id: str,
+        batch_id: Optional[int],
+        location: str,
+        defer: bool = False,
+    ) -> dict:
+        """Add the output MMIF of a run. See `add`"""
+        from chowda.models import MMIF
+
+        mmif = {
+            'media_file_id': guid,
+            'metaflow_run_id': run_id,
+            'batch_output_id': batch_id,
+            'mmif_location': location,
+        }
+        self.add(MMIF, mmif, defer)
+        return mmif
+
+    def add(self, model: type, row: dict, defer: bool = False) -> None:
+        """Add a `model` row, committing at once unless `defer`red until `flush`
+
+        Raises:
+            Exception: if the row is not deferred, and could not be written
+        """
+        with self.lock:
+            self.pending.append((model, row))
+            if not defer:
+                self.flush(strict=True)
+
+    def insert(self, rows: List[Tuple[type, dict]]) -> None:
+        """Insert `rows` in one statement per model, in the order first added
+
+        Runs are added before the MMIFs that refer to them, so rows are
+        inserted after the rows their foreign keys point to.
+        """
+        from sqlalchemy import insert
+
+        grouped: Dict[type, List[dict]] = {}
+        for model, row in rows:
+            grouped.setdefault(model, []).append(row)
+        for model, values in grouped.items():
+            self.session.execute(insert(model), values)
+
+    def flush(self, strict: bool = False) -> int:
+        """Write all pending rows in one commit. Returns the number written
+
+        If the commit fails, it is rolled back and the rows are written one at
+        a time, so a bad row does not lose the others. Rows that still fail
+        are logged and kept in `failed`, and if `strict`, the first of their
+        errors is raised once the other rows are written.
+        """
+        with self.lock:
+            if not self.pending:
+                return 0
+            rows, self.pending = self.pending, []
+            try:
+                self.insert(rows)
+                self.session.commit()
+                written = len(rows)
+            except Exception as e:
+                self.session.rollback()
+                log.warning(f'Writing {len(rows)} rows failed, writing each: {e}')
+                written = self.write_each(rows, strict)
+        log.debug(f'Wrote {written} of {len(rows)} rows')
+        return written
+
+    def write_each(self, rows: List[Tuple[type, dict]], strict: bool = False) -> int:
+        """Commit `rows` one at a time. Returns the number written
+
+        Raises:
+            Exception: the first failure, after every row is tried, if `strict`
+        """
+        written = 0
+        error = None
+        with self.lock:
+            for row in rows:
+                try:
+                    self.insert([row])
+                    self.session.commit()
+                    written += 1
+                except Exception as e:
+                    self.session.rollback()
+                    log.exception(f'Could not write {row[0].__name__} {row[1]!r}')
+                    self.failed.append(row)
+                    error = error or e
+        if strict and error is not None:
+            raise error
+        return written
+
+    def close(self) -> None:
+        self.flush()
+        self.session.close()
+
+
+@lru_cache(maxsize=None)
+def chowda() -> ChowdaDB:
+    """The shared database access layer for this process"""
+    return ChowdaDB()
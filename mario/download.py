@@ -0,0 +1,312 @@
+"""Chunked, resumable media downloads
+
+Files are fetched as parallel byte-range chunks through a pooled HTTP session
+and written in place into a `<filename>.part` file, preallocated with
+`posix_fallocate` where the platform and file system support it. Completed
+chunks are recorded in a `<filename>.parts` manifest, so a retried step only
+fetches the chunks that are still missing. A file that fails its size or
+checksum check is discarded with its manifest, so the retry starts over.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from dataclasses import dataclass
+from functools import lru_cache
+from hashlib import new as new_hash
+from json import dump, load
+from os import O_CREAT, O_WRONLY, close, ftruncate, pwrite, remove, replace
+from os import open as os_open
+from os.path import exists, getsize
+from threading import Lock
+from time import monotonic, sleep
+from typing import Any, Callable, List, Optional, Tuple
+
+from mario.config import (
+    DOWNLOAD_CHUNK_SIZE,
+    DOWNLOAD_READ_TIMEOUT,
+    DOWNLOAD_RETRIES,
+    DOWNLOAD_WORKERS,
+    HTTP_CONNECT_TIMEOUT,
+)
+from mario.log import log
+from mario.utils import DownloadError
+
+# Size of the blocks read from each response and written to disk
+BLOCK_SIZE = 1024 * 1024
+
+# (connect, read) timeouts of every request, so a stalled connection is retried
+TIMEOUT = (HTTP_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)
+
+
+@dataclass
+class DownloadResult:
+    """Summary of a finished download"""
+
+    filename: str
+    size: int
+    fetched: int
+    resumed: int
+    seconds: float
+    chunks: int
+    checksum: Optional[str] = None
+
+    @property
+    def throughput(self) -> float:
+        """Bytes per second fetched over the network"""
+        return self.fetched / self.seconds if self.seconds else 0.0
+
+
+@lru_cache(maxsize=None)
+def session(pool_size: int = DOWNLOAD_WORKERS):
+    """A shared requests Session with a connection pool of `pool_size`"""
+    from requests import Session
+    from requests.adapters import HTTPAdapter
+
+    s = Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    return s
+
+
+def probe(url: str, http=None) -> Tuple[Optional[int], bool, Optional[str]]:
+    """Return the (size, accepts_ranges, etag) of a remote file
+
+    Uses a one byte ranged GET instead of HEAD, because presigned URLs are
+    usually only signed for GET.
+    """
+    http = http or session()
+    with http.get(
+        url, headers={'Range': 'bytes=0-0'}, stream=True, timeout=TIMEOUT
+    ) as response:
+        response.raise_for_status()
+        etag = response.headers.get('ETag')
+        if response.status_code == 206:
+            content_range = response.headers.get('Content-Range', '')
+            total = content_range.rpartition('/')[2]
+            if total.isdigit():
+                return int(total), True, etag
+        length = response.headers.get('Content-Length')
+        return (int(length) if length else None), False, etag
+
+
+def chunk_ranges(size: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """Split `size` bytes into inclusive (start, end) byte ranges"""
+    return [
+        (start, min(start + chunk_size, size) - 1)
+        for start in range(0, size, chunk_size)
+    ]
+
+
+class Manifest:
+    """Record of the chunks of a partial file that are already on disk"""
+
+    def __init__(self, path: str, size: int, chunk_size: int, etag: Optional[str]):
+        self.path = path
+        self.key = {'size': size, 'chunk_size': chunk_size, 'etag': etag}
+        self.done = set()
+        self.lock = Lock()
+
+    def load(self) -> None:
+        """Load completed chunks, if the manifest matches this download"""
+        if not exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                saved = load(f)
+        except ValueError:
+            log.warning(f'Ignoring unreadable manifest {self.path}')
+            return
+        if saved.get('key') != self.key:
+            log.info(f'Manifest {self.path} is for a different file. Starting over')
+            return
+        self.done = set(saved.get('done', []))
+
+    def mark(self, index: int) -> None:
+        """Mark a chunk as complete and persist the manifest"""
+        with self.lock:
+            self.done.add(index)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                dump({'key': self.key, 'done': sorted(self.done)}, f)
+            replace(tmp, self.path)
+
+
+def fetch_range(
+    url: str, fd: int, start: int, end: int, http=None, retries: int = DOWNLOAD_RETRIES
+) -> int:
+    """Fetch bytes `start`-`end` of `url` and write them at the same offset in `fd`"""
+    http = http or session()
+    for attempt in range(retries + 1):
+        offset = start
+        try:
+            with http.get(
+                url,
+                headers={'Range': f'bytes={offset}-{end}'},
+                stream=True,
+                timeout=TIMEOUT,
+            ) as response:
+                if response.status_code != 206:
+                    raise DownloadError(
+                        f'Expected 206 for bytes {start}-{end}, '
+                        f'got {response.status_code}'
+                    )
+                for block in response.iter_content(BLOCK_SIZE):
+                    # Never write past the chunk, into the next one
+                    if len(block) > end + 1 - offset:
+                        raise DownloadError(
+                            f'Long read for bytes {start}-{end}: got more than '
+                            f'{end + 1 - start} bytes'
+                        )
+                    pwrite(fd, block, offset)
+                    offset += len(block)
+            if offset != end + 1:
+                raise DownloadError(
+                    f'Short read for bytes {start}-{end}: got {offset - start} bytes'
+                )
+            return end + 1 - start
+        except Exception as e:
+            if attempt == retries:
+                raise DownloadError(f'Failed to fetch bytes {start}-{end}: {e}') from e
+            wait = 2**attempt
+            log.warning(f'Retrying bytes {start}-{end} in {wait}s: {e}')
+            sleep(wait)
+    return 0
+
+
+def fetch_stream(url: str, fd: int, http=None) -> int:
+    """Fetch the whole of `url` sequentially, for servers without Range support"""
+    http = http or session()
+    offset = 0
+    with http.get(url, stream=True, timeout=TIMEOUT) as response:
+        response.raise_for_status()
+        for block in response.iter_content(BLOCK_SIZE):
+            pwrite(fd, block, offset)
+            offset += len(block)
+    return offset
+
+
+def preallocate(fd: int, size: int) -> None:
+    """Size the file to `size` bytes, reserving its blocks on disk if possible
+
+    Without `posix_fallocate`, or on file systems that do not support it, the
+    file is only truncated to size, leaving it sparse.
+    """
+    ftruncate(fd, size)
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError as e:
+            log.debug(f'Could not preallocate {size} bytes: {e}')
+
+
+def discard(*paths: str) -> None:
+    """Remove files if they exist"""
+    for path in paths:
+        with suppress(FileNotFoundError):
+            remove(path)
+
+
+def file_digest(filename: str, algorithm: str) -> str:
+    """Hex digest of a file on disk"""
+    digest = new_hash(algorithm)
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def download(
+    url: str,
+    filename: str,
+    checksum: Optional[str] = None,
+    chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+    workers: int = DOWNLOAD_WORKERS,
+    reserve: Optional[Callable[[int], Any]] = None,
+) -> DownloadResult:
+    """Download `url` to `filename` in parallel byte-range chunks
+
+    Args:
+        url: The URL to download
+        filename: Path to save the file to
+        checksum: Optional `<algorithm>:<hexdigest>` to verify, e.g. `md5:0cc1...`
+        chunk_size: Size of each byte-range request
+        workers: Number of chunks to fetch concurrently
+        reserve: Called with the probed size, if known, before anything is
+            written, e.g. to make room on the volume
+
+    Raises:
+        DownloadError: if a chunk cannot be fetched, or the file does not verify
+    """
+    http = session(workers)
+    started = monotonic()
+    size, ranged, etag = probe(url, http)
+    if reserve is not None and size:
+        reserve(size)
+    part = filename + '.part'
+    manifest = Manifest(filename + '.parts', size, chunk_size, etag)
+
+    fd = os_open(part, O_WRONLY | O_CREAT, 0o644)
+    try:
+        if size and ranged:
+            manifest.load()
+            if getsize(part) != size:
+                manifest.done = set()
+                preallocate(fd, size)
+            ranges = chunk_ranges(size, chunk_size)
+            todo = [i for i in range(len(ranges)) if i not in manifest.done]
+            resumed = sum(ranges[i][1] + 1 - ranges[i][0] for i in manifest.done)
+            if resumed:
+                log.info(f'Resuming {filename}: {resumed} of {size} bytes on disk')
+
+            def fetch(index: int) -> int:
+                start, end = ranges[index]
+                fetched = fetch_range(url, fd, start, end, http)
+                manifest.mark(index)
+                return fetched
+
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                fetched = sum(pool.map(fetch, todo))
+            chunks = len(ranges)
+        else:
+            log.info(f'Server does not accept ranges. Streaming {filename}')
+            ftruncate(fd, 0)
+            fetched, resumed, chunks = fetch_stream(url, fd, http), 0, 1
+    finally:
+        close(fd)
+
+    # A file that does not verify is discarded, or the retry would resume it
+    # with every chunk marked done and fail the same way
+    on_disk = getsize(part)
+    if size is not None and on_disk != size:
+        discard(part, manifest.path)
+        raise DownloadError(f'{filename} is {on_disk} bytes, expected {size}')
+
+    digest = None
+    if checksum:
+        algorithm, _, expected = checksum.partition(':')
+        digest = file_digest(part, algorithm)
+        if digest.lower() != expected.lower():
+            discard(part, manifest.path)
+            raise DownloadError(
+                f'{filename} {algorithm} is {digest}, expected {expected}'
+            )
+
+    replace(part, filename)
+    discard(manifest.path)
+
+    result = DownloadResult(
+        filename=filename,
+        size=on_disk,
+        fetched=fetched,
+        resumed=resumed,
+        seconds=monotonic() - started,
+        chunks=chunks,
+        checksum=digest,
+    )
+    log.success(
+        f'Downloaded {filename}: {result.size} bytes in {result.seconds:.1f}s '
+        f'({result.throughput / 1e6:.1f} MB/s)'
+    )
+    return result
@@ -0,0 +1,190 @@
+"""Priority queues of per-GUID pipeline jobs
+
+Each job runs one media file through the Pipeline flow. Jobs go to one of
+three rq queues, and workers take from them in priority order:
+
+    rq worker -u redis://redis/0 --with-scheduler high default low
+
+so an urgent reprocess is picked up by the next free worker, even behind a
+batch of thousands. Batches are submitted as `low` by default.
+
+Each queue holds at most `JOB_MAX_DEPTH` waiting jobs. Producers wait, with
+backoff, for room instead of piling more work onto Redis. A running job is
+leased to its worker through rq's heartbeats. If the worker crashes, the
+lease expires, and `requeue_abandoned` (or any worker's periodic cleanup)
+puts the job back on its queue while it has retries left, which needs rq 2.
+Retries wait in the scheduled registry, so workers run with
+`--with-scheduler`.
+"""
+
+from os.path import dirname, join
+from random import uniform
+from time import monotonic, sleep
+from typing import Dict, List, Optional
+
+from mario.config import (
+    JOB_MAX_DEPTH,
+    JOB_RETRIES,
+    JOB_SUBMIT_TIMEOUT,
+    JOB_TIMEOUT,
+    REDIS_URL,
+)
+from mario.log import log
+from mario.utils import QueueFullError
+
+# Most urgent first, the order workers listen in
+PRIORITIES = ('high', 'default', 'low')
+
+PIPELINE_FLOW = join(dirname(__file__), 'pipelines', 'pipeline.py')
+
+
+def redis():
+    """A connection to `REDIS_URL`"""
+    from redis import Redis
+
+    return Redis.from_url(REDIS_URL)
+
+
+def queue(priority: str = 'default', connection=None):
+    """The rq queue for `priority`"""
+    from rq import Queue
+
+    if priority not in PRIORITIES:
+        raise ValueError(f'Unknown priority {priority}. Use one of {PRIORITIES}')
+    return Queue(priority, connection=connection or redis())
+
+
+def depths(connection=None) -> Dict[str, int]:
+    """Waiting jobs in each queue"""
+    connection = connection or redis()
+    return {priority: queue(priority, connection).count for priority in PRIORITIES}
+
+
+def wait_for_room(
+    q, max_depth: int = JOB_MAX_DEPTH, timeout: float = JOB_SUBMIT_TIMEOUT
+) -> float:
+    """Wait until `q` holds fewer than `max_depth` jobs
+
+    Returns:
+        The seconds waited
+
+    Raises:
+        QueueFullError: if the queue is still full after `timeout` seconds
+    """
+    started = monotonic()
+    waited = 0.0
+    delay = 0.1
+    while q.count >= max_depth:
+        if waited >= timeout:
+            raise QueueFullError(f'Queue {q.name} still full after {timeout}s')
+        sleep(uniform(delay / 2, delay))
+        delay = min(delay * 2, 10.0)
+        waited = monotonic() - started
+    return waited
+
+
+def process(
+    guid: str,
+    pipeline: Optional[List[str]] = None,
+    spec: Optional[str] = None,
+    bucket: Optional[str] = None,
+    batch_id: Optional[int] = None,
+    mmif_location: Optional[str] = None,
+) -> Dict:
+    """Run one media file through the Pipeline flow. Runs in the worker
+
+    Raises:
+        RuntimeError: if the flow does not succeed
+    """
+    from metaflow import Runner
+
+    parameters = {
+        'guid': guid,
+        'pipeline': ','.join(pipeline) if pipeline else None,
+        'spec': spec,
+        'bucket': bucket,
+        'batch_id': batch_id,
+        'mmif_location': mmif_location,
+    }
+    parameters = {key: value for key, value in parameters.items() if value}
+    started = monotonic()
+    with Runner(PIPELINE_FLOW, show_output=False).run(**parameters) as running:
+        pathspec = running.run.pathspec
+        if running.status != 'successful':
+            raise RuntimeError(f'{pathspec} for {guid} {running.status}')
+    seconds = monotonic() - started
+    log.info(f'Processed {guid} in {pathspec} in {seconds:.0f}s')
+    return {'guid': guid, 'run': pathspec, 'seconds': seconds}
+
+
+def submit(
+    guid: str,
+    priority: str = 'default',
+    connection=None,
+    max_depth: int = JOB_MAX_DEPTH,
+    timeout: float = JOB_SUBMIT_TIMEOUT,
+    func=process,
+    **parameters,
+):
+    """Queue a pipeline job for `guid`, waiting while the queue is full
+
+    `parameters` are passed to `func`. Returns the rq Job, with the seconds
+    spent waiting for room in `job.meta['backpressure']`.
+    """
+    from rq import Retry
+
+    q = queue(priority, connection)
+    waited = wait_for_room(q, max_depth, timeout)
+    job = q.enqueue(
+        func,
+        guid,
+        **parameters,
+        job_timeout=JOB_TIMEOUT,
+        retry=Retry(max=JOB_RETRIES, interval=[60, 5 * 60, 15 * 60]),
+        result_ttl=7 * 24 * 60 * 60,
+        failure_ttl=30 * 24 * 60 * 60,
+        meta={'backpressure': waited},
+        description=f'{func.__name__} {guid}',
+    )
+    if waited:
+        log.debug(f'Waited {waited:.1f}s for room in {priority} for {guid}')
+    return job
+
+
+def submit_batch(
+    batch_id: int,
+    priority: str = 'low',
+    connection=None,
+    **parameters,
+) -> List:
+    """Queue a job for every media file in a Chowda batch. Returns the Jobs"""
+    from mario.db import chowda
+
+    guids = chowda().batch_guids(batch_id)
+    connection = connection or redis()
+    jobs = [
+        submit(guid, priority, connection, batch_id=batch_id, **parameters)
+        for guid in guids
+    ]
+    log.info(f'Queued {len(jobs)} jobs from batch {batch_id} as {priority}')
+    return jobs
+
+
+def requeue_abandoned(connection=None) -> int:
+    """Requeue jobs whose worker stopped renewing their lease
+
+    Jobs without retries left are moved to the failed registry. Returns the
+    number of abandoned jobs found.
+    """
+    from rq.registry import StartedJobRegistry
+
+    connection = connection or redis()
+    abandoned = 0
+    for priority in PRIORITIES:
+        registry = StartedJobRegistry(queue=queue(priority, connection))
+        expired = registry.get_expired_job_ids()
+        if expired:
+            registry.cleanup()
+            abandoned += len(expired)
+            log.warning(f'Found {len(expired)} abandoned jobs in {priority}')
+    return abandoned
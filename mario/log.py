@@ -1,15 +1,202 @@
+"""Logging through loguru
+
+Records go to a rich console handler on stderr, or with `LOG_FORMAT=json` to
+one JSON object per line on stderr, written by a background thread so steps
+do not block on log I/O. Messages and bound values larger than
+`LOG_MAX_CHARS` are replaced by a `summarize`d form, so an mmif is logged as
+its size, counts and hash rather than its contents. `flow_log` binds the run
+context of a flow, such as its guid, batch_id and step, to every record it logs.
+"""
+
+from contextlib import contextmanager
+from hashlib import sha1
+from queue import SimpleQueue
+from sys import stderr
+from threading import Thread
+from time import perf_counter, time
+from typing import Any, Dict, Iterator, List
+
 from loguru import logger as log
 
-try:
-    from rich.logging import RichHandler
+from mario.config import LOG_FORMAT, LOG_LEVEL, LOG_MAX_CHARS
+
+# Flow attributes bound by `flow_log` to every record
+CONTEXT = ('guid', 'batch_id')
+
+
+def digest(data: bytes) -> str:
+    return sha1(data).hexdigest()[:12]
+
+
+def summarize(value: Any, limit: int = LOG_MAX_CHARS) -> Any:
+    """`value`, or a short description of it if it is too large to log
+
+    Mmifs are summarized by their size, documents, views, annotations and
+    hash, refs to mmifs by their location, and other values by their length,
+    hash and first `limit` characters.
+    """
+    from mario.mmif import MMIFRef, dumps
+
+    if isinstance(value, MMIFRef):
+        return {'location': value.location, 'bytes': value.size}
+    if isinstance(value, dict) and 'views' in value and 'documents' in value:
+        data = dumps(value)
+        if len(data) <= limit:
+            return value
+        views = value['views']
+        return {
+            'bytes': len(data),
+            'documents': len(value['documents']),
+            'views': len(views),
+            'annotations': sum(len(view.get('annotations', [])) for view in views),
+            'sha1': digest(data),
+        }
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    text = value if isinstance(value, str) else repr(value)
+    if len(text) <= limit:
+        return value
+    return {
+        'chars': len(text),
+        'sha1': digest(text.encode('utf-8', 'replace')),
+        'head': text[:limit],
+    }
+
+
+def truncate(record: Dict) -> None:
+    """Summarize a record's large message and bound values, before any sink"""
+    message = record['message']
+    if len(message) > LOG_MAX_CHARS:
+        record['message'] = (
+            f'{message[:LOG_MAX_CHARS]}... [{len(message)} chars, '
+            f'sha1 {digest(message.encode("utf-8", "replace"))}]'
+        )
+    extra = record['extra']
+    for key, value in extra.items():
+        if not isinstance(value, (str, int, float, bool)) or (
+            isinstance(value, str) and len(value) > LOG_MAX_CHARS
+        ):
+            extra[key] = summarize(value)
+
+
+def json_format(record: Dict) -> str:
+    """Format a record as one line of JSON"""
+    from mario.mmif import dumps
+
+    line = {
+        'time': record['time'].isoformat(),
+        'level': record['level'].name,
+        'message': record['message'],
+        'logger': f'{record["name"]}:{record["function"]}:{record["line"]}',
+        **{key: value for key, value in record['extra'].items() if key != 'json'},
+    }
+    if record['exception'] is not None:
+        from traceback import format_exception
+
+        line['exception'] = ''.join(format_exception(*record['exception']))
+    record['extra']['json'] = dumps(line).decode('utf-8')
+    return '{extra[json]}\n'
+
 
-    log.configure(
-        handlers=[
-            {
-                'sink': RichHandler(),
+class BackgroundWriter:
+    """A sink that writes to a stream from a background thread
+
+    Callers only queue their formatted records. The thread writes everything
+    queued at once and flushes, so a burst of records costs one write.
+    Loguru stops the sink, after writing every queued record, when it is
+    removed or at exit.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.queue: SimpleQueue = SimpleQueue()
+        self.thread = Thread(target=self.run, name='log-writer', daemon=True)
+        self.thread.start()
+
+    def write(self, message: str) -> None:
+        self.queue.put(message)
+
+    def run(self) -> None:
+        while True:
+            batch = [self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get())
+            self.stream.write(''.join(line for line in batch if line is not None))
+            self.stream.flush()
+            if None in batch:
+                return
+
+    def stop(self) -> None:
+        self.queue.put(None)
+        self.thread.join()
+
+
+def configure(
+    format: str = LOG_FORMAT, level: str = LOG_LEVEL, sink=None, enqueue: bool = True
+) -> None:
+    """Send logs to the console or as JSON, replacing any other handlers
+
+    JSON records are written by a background thread unless `enqueue` is False.
+    """
+    if format == 'json':
+        sink = sink or stderr
+        handler = {
+            'sink': BackgroundWriter(sink) if enqueue else sink,
+            'format': json_format,
+            'level': level,
+        }
+    else:
+        try:
+            from rich.console import Console
+            from rich.logging import RichHandler
+
+            # stdout is left for command output, such as `mario run`'s mmif
+            handler = {
+                'sink': sink or RichHandler(console=Console(stderr=True)),
+                'format': '{message}',
             }
-        ]
-    )
+        except ImportError:
+            handler = {'sink': sink or stderr}
+        handler['level'] = level
+    log.configure(handlers=[handler], patcher=truncate)
+
+
+def flow_log(flow, **context):
+    """A logger bound to the guid, batch_id, flow, run and step of `flow`"""
+    for key in CONTEXT:
+        value = getattr(flow, key, None)
+        if key not in context and value not in (None, 'null', ''):
+            context[key] = value
+    try:
+        from metaflow import current
+
+        if current.is_running_flow:
+            context.setdefault('flow', current.flow_name)
+            context.setdefault('run_id', current.run_id)
+            context.setdefault('step', current.step_name)
+    except ImportError:
+        pass
+    return log.bind(**context)
+
+
+configure()
+
+
+@contextmanager
+def span(spans: List[Dict], name: str, **attrs) -> Iterator[Dict]:
+    """Time a phase of work and record it in `spans`
 
-except ImportError:
-    pass
+    Yields the span record, so values only known at the end, such as the
+    number of bytes moved, can be added to it. Failed spans record the error.
+    """
+    record = {'name': name, 'start': time(), **attrs}
+    started = perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = repr(e)
+        raise
+    finally:
+        record['seconds'] = perf_counter() - started
+        spans.append(record)
+        log.debug(f'{name} took {record["seconds"]:.3f}s {attrs}')
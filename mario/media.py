@@ -0,0 +1,248 @@
+"""Shared cache of media proxies on the media volume
+
+With `MEDIA_CACHE=1`, every flow that needs the proxy of a Sony Ci asset
+gets it from `MEDIA_DIR/.cache/<asset id>`, so an asset that goes through several flows
+or batches is only downloaded once. Each entry holds:
+
+    media       the downloaded proxy
+    .lock       held while the proxy is downloaded or evicted
+    refs/       one file per workspace using the proxy
+
+A run takes the entry's lock to download the proxy, so concurrent runs of
+the same asset wait for one download instead of starting their own. The
+proxy is then handed to the run's workspace with a reflink or hardlink,
+and a ref is recorded until the workspace is cleaned up. Entries without
+live refs are evicted by age, then least recently used first until the
+cache fits its size budget: `MEDIA_CACHE_MAX_BYTES`, or by default half of
+the cache's size plus the volume's free space.
+"""
+
+from contextlib import contextmanager, suppress
+from fcntl import LOCK_EX, LOCK_NB, LOCK_UN, flock
+from functools import lru_cache
+from os import listdir, makedirs, remove, scandir, stat, utime
+from os.path import exists, isdir, join
+from shutil import disk_usage
+from threading import Lock
+from time import time
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+from mario.cache import CacheStats
+from mario.config import (
+    MEDIA_CACHE,
+    MEDIA_CACHE_DIR,
+    MEDIA_CACHE_MAX_AGE,
+    MEDIA_CACHE_MAX_BYTES,
+    MEDIA_DIR,
+)
+from mario.log import log
+
+
+class MediaCache:
+    """Media proxies shared by every run on the volume, keyed by asset id
+
+    Args:
+        root: Directory of the cache
+        max_bytes: Size budget of the cache. 0 disables size eviction, and
+            None sizes it from the volume, see `budget`
+        max_age: Entries unused for this many seconds are evicted, and refs
+            this old are treated as left behind by crashed runs
+    """
+
+    def __init__(
+        self,
+        root: str = join(MEDIA_DIR, MEDIA_CACHE_DIR),
+        max_bytes: Optional[int] = MEDIA_CACHE_MAX_BYTES,
+        max_age: float = MEDIA_CACHE_MAX_AGE,
+    ):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.stats = CacheStats()
+        self.stats_lock = Lock()
+
+    def path(self, asset_id: str, name: str = 'media') -> str:
+        return join(self.root, str(asset_id), name)
+
+    @contextmanager
+    def lock(self, asset_id: str, blocking: bool = True) -> Iterator[bool]:
+        """Hold the entry's lock. Yields False if not `blocking` and it is held
+
+        Lock files are never removed, so every process locks the same file.
+        """
+        makedirs(join(self.root, str(asset_id), 'refs'), exist_ok=True)
+        with open(self.path(asset_id, '.lock'), 'a') as f:
+            try:
+                flock(f, LOCK_EX if blocking else LOCK_EX | LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                flock(f, LOCK_UN)
+
+    def acquire(
+        self, asset_id: str, ref: str, fetch: Callable[[str], Any]
+    ) -> Tuple[str, Optional[Any]]:
+        """The cached proxy of `asset_id`, downloading it with `fetch` if missing
+
+        `fetch` is called with the path to download to, while the entry is
+        locked. A ref is recorded for `ref` until it is `release`d.
+
+        Returns:
+            The path of the proxy, and the result of `fetch`, or None on a hit
+        """
+        media = self.path(asset_id)
+        with self.lock(asset_id):
+            hit = exists(media)
+            result = None
+            if not hit:
+                self.evict()
+                log.info(f'Downloading asset {asset_id} into the media cache')
+                result = fetch(media)
+            with open(self.ref_path(asset_id, ref), 'w'):
+                pass
+            utime(media)
+        with self.stats_lock:
+            if hit:
+                self.stats.hits += 1
+            else:
+                self.stats.misses += 1
+                self.stats.stores += 1
+        log.debug(f'Media cache {"hit" if hit else "miss"} for asset {asset_id}')
+        return media, result
+
+    def ref_path(self, asset_id: str, ref: str) -> str:
+        return self.path(asset_id, join('refs', ref.replace('/', '-')))
+
+    def release(self, asset_id: str, ref: str) -> None:
+        """Drop the ref of `ref`, so the entry may be evicted"""
+        with suppress(FileNotFoundError):
+            remove(self.ref_path(asset_id, ref))
+
+    def refs(self, asset_id: str) -> List[str]:
+        """Refs to the entry that are not stale"""
+        directory = self.path(asset_id, 'refs')
+        if not isdir(directory):
+            return []
+        now = time()
+        return [
+            entry.name
+            for entry in scandir(directory)
+            if now - entry.stat().st_mtime <= self.max_age
+        ]
+
+    def entries(self) -> List[Tuple[str, int, float]]:
+        """(asset id, size, last used) of every cached proxy"""
+        if not isdir(self.root):
+            return []
+        entries = []
+        for asset_id in listdir(self.root):
+            with suppress(FileNotFoundError):
+                info = stat(self.path(asset_id))
+                entries.append((asset_id, info.st_size, info.st_mtime))
+        return entries
+
+    def delete(self, asset_id: str) -> bool:
+        """Delete the proxy if it is unused. Returns whether it was deleted"""
+        with self.lock(asset_id, blocking=False) as locked:
+            if not locked or self.refs(asset_id):
+                return False
+            for name in ('media', 'media.part', 'media.parts'):
+                with suppress(FileNotFoundError):
+                    remove(self.path(asset_id, name))
+            for ref in listdir(self.path(asset_id, 'refs')):
+                remove(self.path(asset_id, join('refs', ref)))
+        return True
+
+    def budget(self, total: int) -> int:
+        """Bytes the cache may use when it holds `total`. 0 is unlimited
+
+        Without `max_bytes`, half of what the cache could grow into on its
+        volume, so at least as much free space is left to the workspaces.
+        """
+        if self.max_bytes is not None:
+            return self.max_bytes
+        makedirs(self.root, exist_ok=True)
+        return (total + disk_usage(self.root).free) // 2
+
+    def evict(self) -> int:
+        """Delete unused entries older than `max_age`, then least recently used
+        entries until the cache fits its `budget`. Returns the number deleted.
+        """
+        now = time()
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        max_bytes = self.budget(total)
+        evicted = 0
+        for asset_id, size, used in entries:
+            expired = now - used > self.max_age
+            if not expired and (not max_bytes or total <= max_bytes):
+                continue
+            if self.delete(asset_id):
+                log.info(f'Evicted asset {asset_id} from the media cache')
+                total -= size
+                evicted += 1
+        with self.stats_lock:
+            self.stats.evictions += evicted
+        if max_bytes and total > max_bytes:
+            log.warning(f'Media cache is over budget: {total} > {max_bytes} bytes')
+        return evicted
+
+
+@lru_cache(maxsize=None)
+def media_cache() -> Optional[MediaCache]:
+    """The shared media cache, or None unless `MEDIA_CACHE` is enabled"""
+    return MediaCache() if MEDIA_CACHE else None
+
+
+def ref_of(workspace) -> str:
+    """The ref a workspace holds on the proxies handed to it"""
+    return f'{workspace.guid}@{workspace.run}'
+
+
+def fetch_media(
+    asset_id: str,
+    url: str,
+    workspace,
+    name: str,
+    checksum: Optional[str] = None,
+    reserve: Optional[Callable[[int], Any]] = None,
+) -> Tuple[str, Optional[Any]]:
+    """Bring the proxy of `asset_id` at `url` into `workspace` as `name`
+
+    The proxy comes from the shared cache when enabled, and is downloaded
+    straight into the workspace otherwise. Downloads are verified against
+    `checksum`, see `mario.ci.proxy_checksum`, and `reserve` is called with
+    the size of the proxy before it is downloaded, see `mario.download`.
+
+    Returns:
+        The path in the workspace, and the `DownloadResult`, or None on a hit
+    """
+    from mario.download import download
+
+    cache = media_cache()
+    if cache is None:
+        filename = workspace.file(name)
+        return filename, download(url, filename, checksum, reserve=reserve)
+    media, result = cache.acquire(
+        asset_id,
+        ref_of(workspace),
+        lambda path: download(url, path, checksum, reserve=reserve),
+    )
+    return workspace.hand_over(media, name), result
+
+
+def release_media(asset_id: Optional[str], workspace) -> None:
+    """Release the workspace's ref on the proxy of `asset_id`, then evict"""
+    cache = media_cache()
+    if cache is None or asset_id is None:
+        return
+    cache.release(asset_id, ref_of(workspace))
+    cache.evict()
+    stats = cache.stats
+    log.info(
+        f'Media cache: {stats.hits} hits, {stats.misses} misses '
+        f'({stats.hit_rate:.0%}), {stats.evictions} evictions'
+    )
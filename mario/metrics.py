@@ -0,0 +1,212 @@
+"""Export run spans as Prometheus metrics
+
+Spans recorded with `mario.log.span` are summed by phase and app into
+gauges of the run's time, calls, errors and bytes moved, plus the largest
+MMIF seen. App spans that say whether the app was sent a reduced media
+`proxy` are also split by it, so the app time proxies save can be compared.
+The result is written in OpenMetrics text format to a file for a node
+exporter's textfile collector, or pushed to a Prometheus Pushgateway.
+
+Each run pushes to its own group, keyed by flow, run and guid, so runs and
+concurrent batches never replace each other's metrics. Sum them across runs
+in queries, e.g. `sum by (phase, app) (mario_phase_seconds)`. Groups older
+than `PUSHGATEWAY_RETENTION` are deleted by the next export, once they have
+been scraped.
+"""
+
+from base64 import urlsafe_b64encode
+from os import makedirs, replace
+from os.path import dirname
+from time import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from mario.config import METRICS_FILE, PUSHGATEWAY, PUSHGATEWAY_RETENTION
+from mario.log import log
+
+# name: (type, unit, help, aggregated field). Every value is a total for one
+# run, so they are gauges: each run's series is set once, and never counts up
+FAMILIES = {
+    'mario_phase_seconds': ('gauge', 'seconds', 'Time spent in phase', 'seconds'),
+    'mario_phase_calls': ('gauge', '', 'Times the phase ran', 'calls'),
+    'mario_phase_errors': ('gauge', '', 'Times the phase failed', 'errors'),
+    'mario_phase_bytes': ('gauge', 'bytes', 'Bytes moved by phase', 'bytes'),
+    'mario_phase_cache_hits': ('gauge', '', 'Times the phase hit a cache', 'hits'),
+    'mario_mmif_bytes': ('gauge', 'bytes', 'Largest MMIF seen by phase', 'mmif_bytes'),
+}
+
+# Labels that key each run's Pushgateway group
+GROUPING = ('flow', 'run_id', 'guid')
+
+
+Key = Tuple[str, str, str]
+
+
+def aggregate(spans: Iterable[Dict]) -> Dict[Key, Dict[str, float]]:
+    """Sum spans by (phase, app, proxy)
+
+    proxy is "true" or "false" for spans with a `proxy` attribute, else ""
+    """
+    totals: Dict[Key, Dict[str, float]] = {}
+    for span in spans:
+        proxy = span.get('proxy')
+        proxy = '' if proxy is None else str(bool(proxy)).lower()
+        key = (span['name'], span.get('app', ''), proxy)
+        total = totals.setdefault(
+            key,
+            {
+                'seconds': 0.0,
+                'calls': 0,
+                'errors': 0,
+                'bytes': 0,
+                'hits': 0,
+                'mmif_bytes': 0,
+            },
+        )
+        total['seconds'] += span.get('seconds', 0.0)
+        total['calls'] += 1
+        total['errors'] += 'error' in span
+        total['bytes'] += span.get('bytes', 0)
+        total['hits'] += span.get('cache') == 'hit'
+        total['mmif_bytes'] = max(total['mmif_bytes'], span.get('mmif_bytes', 0))
+    return totals
+
+
+def escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def exposition(
+    spans: Iterable[Dict],
+    labels: Optional[Dict[str, str]] = None,
+    openmetrics: bool = True,
+) -> str:
+    """Spans as metrics text
+
+    Args:
+        spans: Span records
+        labels: Labels added to every sample, e.g. flow and run
+        openmetrics: OpenMetrics format, or the Prometheus text format the
+            Pushgateway accepts
+    """
+    totals = aggregate(spans)
+    lines = []
+    for name, (kind, unit, description, field) in FAMILIES.items():
+        lines.append(f'# TYPE {name} {kind}')
+        if unit and openmetrics:
+            lines.append(f'# UNIT {name} {unit}')
+        lines.append(f'# HELP {name} {description}')
+        sample = f'{name}_total' if kind == 'counter' else name
+        for (phase, app, proxy), total in sorted(totals.items()):
+            if field == 'mmif_bytes' and not total[field]:
+                continue
+            sample_labels = {**(labels or {}), 'phase': phase}
+            if app:
+                sample_labels['app'] = app
+            if proxy:
+                sample_labels['proxy'] = proxy
+            label_text = ','.join(
+                f'{k}="{escape(v)}"' for k, v in sample_labels.items()
+            )
+            lines.append(f'{sample}{{{label_text}}} {total[field]}')
+    if openmetrics:
+        lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def write(text: str, path: str) -> None:
+    """Atomically write metrics text to `path`"""
+    if dirname(path):
+        makedirs(dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        f.write(text)
+    replace(path + '.tmp', path)
+
+
+def group_url(gateway: str, job: str, grouping: Dict[str, str]) -> str:
+    """The Pushgateway URL of a group. Values with a / are base64 encoded"""
+    url = f'{gateway.rstrip("/")}/metrics/job/{job}'
+    for key, value in grouping.items():
+        if '/' in value or not value:
+            encoded = urlsafe_b64encode(value.encode()).decode() or '='
+            url += f'/{key}@base64/{encoded}'
+        else:
+            url += f'/{key}/{value}'
+    return url
+
+
+def push(text: str, gateway: str, job: str, grouping: Dict[str, str]) -> None:
+    """Replace this group's metrics on a Pushgateway"""
+    from mario.client import client
+
+    response = client().request(
+        'PUT',
+        group_url(gateway, job, grouping),
+        data=text.encode(),
+        headers={'Content-Type': 'text/plain; version=0.0.4'},
+    )
+    response.raise_for_status()
+
+
+def groups(gateway: str, job: str) -> List[Tuple[Dict[str, str], float]]:
+    """(grouping labels, last push time) of the job's groups on a Pushgateway"""
+    from mario.client import client
+
+    response = client().request('GET', f'{gateway.rstrip("/")}/api/v1/metrics')
+    response.raise_for_status()
+    found = []
+    for group in response.json().get('data', []):
+        labels = dict(group.get('labels', {}))
+        if labels.pop('job', None) != job:
+            continue
+        series = group.get('push_time_seconds', {}).get('time_series', [])
+        pushed = float(series[0]['value']) if series else 0.0
+        found.append((labels, pushed))
+    return found
+
+
+def prune(gateway: str, job: str, retention: float = PUSHGATEWAY_RETENTION) -> int:
+    """Delete the job's groups last pushed over `retention` seconds ago
+
+    Returns the number deleted.
+    """
+    from mario.client import client
+
+    deleted = 0
+    for grouping, pushed in groups(gateway, job):
+        if time() - pushed > retention:
+            response = client().request('DELETE', group_url(gateway, job, grouping))
+            response.raise_for_status()
+            deleted += 1
+    return deleted
+
+
+def export(
+    spans: Iterable[Dict],
+    labels: Dict[str, str],
+    job: str = 'mario',
+    path: Optional[str] = METRICS_FILE,
+    gateway: Optional[str] = PUSHGATEWAY,
+    grouping: Iterable[str] = GROUPING,
+) -> str:
+    """Write spans to `path` and push them to `gateway`, if set
+
+    The run is pushed to a Pushgateway group keyed by its `grouping` labels,
+    and any other labels are added to each sample. Groups older than
+    `PUSHGATEWAY_RETENTION` are then deleted.
+
+    Failing to export is logged, not raised, so metrics never fail a run.
+    Returns the OpenMetrics text.
+    """
+    spans = list(spans)
+    text = exposition(spans, labels)
+    try:
+        if path:
+            write(text, path)
+        if gateway:
+            group = {k: v for k, v in labels.items() if k in grouping}
+            rest = {k: v for k, v in labels.items() if k not in grouping}
+            push(exposition(spans, rest, openmetrics=False), gateway, job, group)
+            prune(gateway, job)
+    except Exception:
+        log.exception('Failed to export metrics')
+    return text
@@ -0,0 +1,516 @@
+"""MMIF serialization, S3 I/O and view helpers
+
+MMIFs are written to S3 as plain JSON, or compressed (gzip or zstd) with a
+matching Content-Encoding if `MMIF_ENCODING` opts in, and read back from the
+response stream without a temp file. Plain and compressed objects are both
+detected and read. orjson is used for (de)serialization when it is installed.
+
+Large mmifs can be handled as an `MMIFRef` to a file or S3 object instead of
+a parsed dict. Refs are sent to apps and uploaded as streams, and only parsed
+when something needs the mmif's contents. Apps can be sent a `project`ion of
+an mmif, and the views they add `splice`d back into the full one.
+"""
+
+import gzip
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from io import BufferedReader, RawIOBase
+from shutil import copyfileobj
+from tempfile import SpooledTemporaryFile
+from typing import (
+    IO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from mario.config import MMIF_ENCODING, MMIF_SPOOL_SIZE
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENCODINGS = ('gzip', 'zstd', 'identity')
+
+# Leading bytes of each compressed format
+MAGIC = {b'\x1f\x8b': 'gzip', b'\x28\xb5\x2f\xfd': 'zstd'}
+
+# Buffer size when streaming mmifs between files, S3 and apps
+COPY_SIZE = 1024 * 1024
+
+# Properties whose values are `<view id>:<annotation id>` references, or lists
+# of them. Other strings, such as text, are never treated as references.
+REF_PROPERTIES = frozenset(
+    ('alignedTo', 'document', 'representatives', 'source', 'target', 'targets')
+)
+
+
+@dataclass(frozen=True)
+class MMIFRef:
+    """A serialized mmif in a local file or S3, parsed only when loaded
+
+    Pickles as its location, so it can be stored as a Metaflow artifact in
+    place of the mmif itself.
+
+    Args:
+        location: A local path or `s3://bucket/key`
+        size: Size of the stored mmif, in bytes
+        encoding: Encoding of the stored mmif, or None to detect it
+    """
+
+    location: str
+    size: int = 0
+    encoding: Optional[str] = None
+
+    @property
+    def s3(self) -> bool:
+        return self.location.startswith('s3://')
+
+    @contextmanager
+    def open(self) -> Iterator[IO[bytes]]:
+        """The mmif's JSON bytes, decompressed, as a stream"""
+        if self.s3:
+            from mario.s3 import parse_url, s3
+
+            bucket, key = parse_url(self.location)
+            response = s3().get_object(Bucket=bucket, Key=key)
+            encoding = response.get('ContentEncoding')
+            with response['Body'] as body:
+                yield decoded(body, encoding if encoding in ENCODINGS else None)
+        else:
+            with open(self.location, 'rb') as f:
+                yield decoded(f, self.encoding)
+
+    def load(self) -> dict:
+        """Parse the mmif"""
+        with self.open() as f:
+            return loads(f.read())
+
+
+MMIF = Union[dict, MMIFRef]
+
+
+def dumps(mmif: dict) -> bytes:
+    """Serialize an mmif to UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(mmif)
+    from json import dumps as json_dumps
+
+    return json_dumps(mmif, ensure_ascii=False).encode('utf-8')
+
+
+def loads(data: bytes) -> dict:
+    """Parse UTF-8 JSON bytes into an mmif"""
+    if orjson is not None:
+        return orjson.loads(data)
+    from json import loads as json_loads
+
+    return json_loads(data)
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(
+            'zstd MMIFs need the zstandard package: pip install mario[mmif]'
+        ) from e
+    return zstandard
+
+
+def detect(head: bytes) -> str:
+    """The encoding of a stream, from its first 4 bytes"""
+    for magic, encoding in MAGIC.items():
+        if head.startswith(magic):
+            return encoding
+    return 'identity'
+
+
+def write(mmif: MMIF, f: IO[bytes], encoding: str = MMIF_ENCODING) -> None:
+    """Write an mmif to a binary file object with `encoding`
+
+    An `MMIFRef` is streamed through without being parsed.
+    """
+    if encoding not in ENCODINGS:
+        raise ValueError(f'Unknown mmif encoding {encoding}. Use one of {ENCODINGS}')
+    if encoding == 'gzip':
+        sink = gzip.GzipFile(fileobj=f, mode='wb', compresslevel=6, mtime=0)
+    elif encoding == 'zstd':
+        sink = _zstd().ZstdCompressor(level=3).stream_writer(f, closefd=False)
+    else:
+        sink = nullcontext(f)
+    with sink as out:
+        if isinstance(mmif, MMIFRef):
+            with mmif.open() as source:
+                copyfileobj(source, out, COPY_SIZE)
+        else:
+            out.write(dumps(mmif))
+
+
+class _Prefixed(RawIOBase):
+    """A stream that replays `head` before reading the rest of `stream`"""
+
+    def __init__(self, head: bytes, stream):
+        self.head = head
+        self.stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.head:
+            n = min(len(buffer), len(self.head))
+            buffer[:n] = self.head[:n]
+            self.head = self.head[n:]
+            return n
+        data = self.stream.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+def decoded(f, encoding: Optional[str] = None):
+    """A stream of the JSON bytes of an mmif stored with `encoding`
+
+    If `encoding` is not given, it is detected from the first bytes, so
+    legacy uncompressed objects are read transparently.
+    """
+    if encoding in (None, ''):
+        head = f.read(4)
+        encoding = detect(head)
+        f = BufferedReader(_Prefixed(head, f))
+    if encoding == 'gzip':
+        return gzip.GzipFile(fileobj=f, mode='rb')
+    if encoding == 'zstd':
+        return _zstd().ZstdDecompressor().stream_reader(f)
+    return f
+
+
+def read(f, encoding: Optional[str] = None) -> dict:
+    """Read an mmif from a binary stream, detecting its encoding if not given"""
+    return loads(decoded(f, encoding).read())
+
+
+def upload(
+    mmif: MMIF,
+    bucket: str,
+    key: str,
+    encoding: str = MMIF_ENCODING,
+    client=None,
+) -> int:
+    """Upload an mmif to S3, compressed with `encoding`
+
+    The mmif is serialized into a spooled buffer, which only spills to disk
+    past `MMIF_SPOOL_SIZE`, and streamed to S3 from there with the shared
+    client, in parallel parts if it is large.
+
+    Returns:
+        The number of bytes uploaded
+    """
+    from mario.s3 import upload_fileobj
+
+    extra = {'ContentType': 'application/json'}
+    if encoding != 'identity':
+        extra['ContentEncoding'] = encoding
+    with SpooledTemporaryFile(max_size=MMIF_SPOOL_SIZE) as spool:
+        write(mmif, spool, encoding)
+        size = spool.tell()
+        spool.seek(0)
+        upload_fileobj(spool, bucket, key, extra, client=client)
+    return size
+
+
+def download(bucket: str, key: str, client=None) -> dict:
+    """Download an mmif from S3, in any encoding `upload` writes"""
+    if client is None:
+        from mario.s3 import s3
+
+        client = s3()
+    response = client.get_object(Bucket=bucket, Key=key)
+    encoding = response.get('ContentEncoding')
+    if encoding not in ENCODINGS:
+        # Legacy objects have no ContentEncoding, so sniff them
+        encoding = None
+    return read(response['Body'], encoding)
+
+
+def load(mmif: MMIF) -> dict:
+    """The parsed mmif, loading it if it is a ref"""
+    return mmif.load() if isinstance(mmif, MMIFRef) else mmif
+
+
+def relocate(mmif: dict, directory: str, names: Iterable[str]) -> dict:
+    """The mmif with its local documents named in `names` moved to `directory`
+
+    Points an mmif made by an earlier run at the media in this run's
+    workspace. Locations keep their `file://` scheme, if they had one. The
+    mmif itself is returned if no document moved.
+    """
+    from os.path import basename, join
+
+    names = set(names)
+    documents = []
+    moved = False
+    for document in mmif.get('documents', []):
+        location = document.get('properties', {}).get('location') or ''
+        scheme = 'file://' if location.startswith('file://') else ''
+        path = location[len(scheme) :]
+        moved_to = join(directory, basename(path))
+        if path.startswith('/') and basename(path) in names and path != moved_to:
+            properties = {**document['properties'], 'location': scheme + moved_to}
+            documents.append({**document, 'properties': properties})
+            moved = True
+        else:
+            documents.append(document)
+    return {**mmif, 'documents': documents} if moved else mmif
+
+
+def dump(mmif: MMIF, path: str) -> MMIFRef:
+    """The mmif as plain JSON in a local file, ready to send to an app
+
+    Local plain JSON refs are returned as they are.
+    """
+    if isinstance(mmif, MMIFRef) and not mmif.s3 and mmif.encoding == 'identity':
+        return mmif
+    with open(path, 'wb') as f:
+        write(mmif, f, 'identity')
+        size = f.tell()
+    return MMIFRef(path, size, 'identity')
+
+
+def store(mmif: MMIF, bucket: str, key: str, **kwargs) -> MMIFRef:
+    """Upload an mmif to S3, and return a ref to it"""
+    size = upload(mmif, bucket, key, **kwargs)
+    return MMIFRef(f's3://{bucket}/{key}', size)
+
+
+def send(url: str, mmif: MMIF, directory: str) -> Tuple[object, Optional[MMIFRef]]:
+    """POST an mmif to a CLAMS app from a file, spooling the response to one
+
+    Neither the request nor the response is held in memory. Files are written
+    to `directory`, and the request file is removed afterwards unless `mmif`
+    already was one.
+
+    Returns:
+        The response, and a ref to the output mmif if the app succeeded
+    """
+    from os import remove
+    from os.path import join
+    from uuid import uuid4
+
+    from mario.checkpoint import slug
+    from mario.client import client
+
+    name = f'{slug(url)}-{uuid4().hex[:8]}'
+    body = dump(mmif, join(directory, f'{name}.in.json'))
+    try:
+        with open(body.location, 'rb') as f:
+            response = client().post(
+                url,
+                data=f,
+                headers={'Content-Type': 'application/json'},
+                stream=True,
+            )
+    finally:
+        if body is not mmif:
+            remove(body.location)
+    if response.status_code != 200:
+        # Read the error body now, so the connection is released
+        response.content  # noqa: B018
+        return response, None
+    path = join(directory, f'{name}.out.json')
+    size = 0
+    with open(path, 'wb') as f:
+        for chunk in response.iter_content(COPY_SIZE):
+            size += f.write(chunk)
+    response.close()
+    return response, MMIFRef(path, size, 'identity')
+
+
+def post(
+    url: str, mmif: MMIF, directory: Optional[str] = None
+) -> Tuple[object, Optional[MMIF], int, int]:
+    """POST an mmif to a CLAMS app, through files in `directory` if given
+
+    Without a `directory`, the mmif is sent from memory and the output is
+    parsed. With one, see `send`.
+
+    Returns:
+        The response, the output mmif if the app succeeded, and the bytes
+        sent and received
+    """
+    from mario.client import client
+
+    if directory is not None:
+        response, output = send(url, mmif, directory)
+        sent = int(response.request.headers.get('Content-Length', 0))
+        return response, output, sent, output.size if output else len(response.content)
+    response = client().post(url, json=mmif)
+    output = response.json() if response.status_code == 200 else None
+    sent = len(response.request.body or b'')
+    return response, output, sent, len(response.content)
+
+
+def view_ids(mmif: dict) -> Set[str]:
+    """Ids of every view in an mmif"""
+    return {view['id'] for view in mmif.get('views', [])}
+
+
+def new_views(before: dict, after: dict) -> List[dict]:
+    """Views in `after` that are not in `before`, by id"""
+    existing = view_ids(before)
+    return [view for view in after.get('views', []) if view['id'] not in existing]
+
+
+def fresh_view_id(used: Set[str]) -> str:
+    """The next `v_<n>` id that is not in `used`"""
+    n = len(used)
+    while f'v_{n}' in used:
+        n += 1
+    return f'v_{n}'
+
+
+def rewrite_refs(value, mapping: Dict[str, str], ref: bool = True):
+    """Copy of `value` with `<view id>:<annotation id>` references rewritten
+
+    Only values of `REF_PROPERTIES` are rewritten inside dicts.
+
+    Args:
+        value: A view, annotation, or any JSON value inside one
+        mapping: Old view id to new view id
+        ref: Whether a string `value` is a reference
+    """
+    if isinstance(value, str):
+        view, sep, rest = value.partition(':')
+        if ref and sep and view in mapping:
+            return f'{mapping[view]}:{rest}'
+        return value
+    if isinstance(value, list):
+        return [rewrite_refs(item, mapping, ref) for item in value]
+    if isinstance(value, dict):
+        return {
+            key: rewrite_refs(item, mapping, key in REF_PROPERTIES)
+            for key, item in value.items()
+        }
+    return value
+
+
+def type_name(at_type: str) -> str:
+    """Short name of an annotation type, e.g. `TimeFrame` for its vocabulary url"""
+    parts = at_type.rstrip('/').split('/')
+    if len(parts) > 1 and parts[-1][:1] == 'v' and parts[-1][1:].isdigit():
+        return parts[-2]
+    return parts[-1]
+
+
+def view_refs(value, views: Set[str], ref: bool = True) -> Set[str]:
+    """Ids in `views` referenced from `value` as `<view id>:<annotation id>`
+
+    Like `rewrite_refs`, only values of `REF_PROPERTIES` are read inside dicts.
+    """
+    if isinstance(value, str):
+        view, sep, _ = value.partition(':')
+        return {view} if ref and sep and view in views else set()
+    if isinstance(value, list):
+        return set().union(*(view_refs(item, views, ref) for item in value))
+    if isinstance(value, dict):
+        return set().union(
+            *(
+                view_refs(item, views, key in REF_PROPERTIES)
+                for key, item in value.items()
+            )
+        )
+    return set()
+
+
+def project(mmif: dict, consumes: Optional[Iterable[str]]) -> dict:
+    """The mmif with only the views that contain a type in `consumes`
+
+    Types are vocabulary urls or their short names. Views referenced by kept
+    views are kept too, and view ids are unchanged, so references stay valid.
+    `consumes` of None keeps every view, and an empty one keeps none.
+    """
+    if consumes is None:
+        return mmif
+    wanted = set(consumes)
+    views = mmif.get('views', [])
+    by_id = {view['id']: view for view in views}
+    keep = {
+        view['id']
+        for view in views
+        if any(
+            at_type in wanted or type_name(at_type) in wanted
+            for at_type in view.get('metadata', {}).get('contains', {})
+        )
+    }
+    todo = list(keep)
+    while todo:
+        for referenced in view_refs(by_id[todo.pop()], set(by_id)) - keep:
+            keep.add(referenced)
+            todo.append(referenced)
+    if len(keep) == len(views):
+        return mmif
+    return {**mmif, 'views': [view for view in views if view['id'] in keep]}
+
+
+def splice(full: dict, sent: dict, output: dict) -> dict:
+    """`full` with the views an app added to the `sent` projection of it
+
+    New views whose ids are taken in `full` get the next free id, and
+    references to them are rewritten to match.
+    """
+    added = new_views(sent, output)
+    used = view_ids(full)
+    renamed = {}
+    for view in added:
+        if view['id'] in used:
+            renamed[view['id']] = fresh_view_id(used)
+        used.add(renamed.get(view['id'], view['id']))
+    if renamed:
+        added = [
+            {**rewrite_refs(view, renamed), 'id': renamed.get(view['id'], view['id'])}
+            for view in added
+        ]
+    return {**full, 'views': list(full.get('views', [])) + added}
+
+
+def run_projected(
+    mmif: MMIF,
+    run: Callable[[MMIF], MMIF],
+    consumes: Optional[Iterable[str]] = None,
+    needs: Iterable[str] = (),
+    proxies: Optional[Dict[str, str]] = None,
+) -> MMIF:
+    """Run an app on only the documents and views of `mmif` it reads
+
+    Proxy documents the app does not `need` are hidden, see
+    `mario.preprocess.documents_for`, and only the views it `consumes` are
+    sent, see `project`. The views it adds are spliced back into the full
+    mmif. An mmif that is sent whole is passed to `run` as it is, so refs are
+    not parsed.
+
+    Args:
+        mmif: The full mmif
+        run: Sends an mmif to the app, and returns its output
+        consumes: Types of the views the app reads, or None for every view
+        needs: What the app needs
+        proxies: {need: document id} of the proxy documents
+    """
+    from mario.preprocess import documents_for
+
+    if proxies or consumes is not None:
+        mmif = load(mmif)
+    sent = documents_for(mmif, needs, proxies or {})
+    projected = project(sent, consumes)
+    output = run(projected)
+    if projected is not sent:
+        output = splice(sent, projected, load(output))
+    if sent is not mmif:
+        output = {**load(output), 'documents': mmif['documents']}
+    return output
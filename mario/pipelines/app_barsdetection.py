@@ -18,80 +18,96 @@ class AppBarsdetection(FlowSpec):
 
     @secrets(sources=['CLAMS-SonyCi-API', 'CLAMS-chowda-secret'])
     @kubernetes(
-        image='ghcr.io/wgbh-mla/chowda:main',
+        image='ghcr.io/wgbh-mla/mario:main',
         persistent_volume_claims={'media-pvc': '/m'},
     )
     @step
     def start(self):
         """Download the media file"""
-        from os.path import join
-        from subprocess import run
-        from urllib.request import urlretrieve
+        from metaflow import current
 
-        from chowda.db import engine
-        from chowda.models import MediaFile
-        from requests import post
-        from sonyci import SonyCi
-        from sqlmodel import Session, select
+        from mario.ci import proxy_checksum, sonyci
+        from mario.client import client
+        from mario.db import chowda
+        from mario.log import flow_log, summarize
+        from mario.media import fetch_media
+        from mario.workspace import Workspace
+
+        log = flow_log(self)
 
         # get SonyCi Asset ID
-        with Session(engine) as db:
-            media_file = db.exec(
-                select(MediaFile).where(MediaFile.guid == self.guid)
-            ).one()
+        db = chowda()
+        with db.lock:
+            media_file = db.media_file(self.guid)
             self.asset_id = media_file.assets[0].id
             self.filename = media_file.assets[0].name
 
         assert self.asset_id, f'No asset found for {self.guid}'
-        print(f'Found asset {self.asset_id}')
-        filename = join('/m', self.filename)
+        log.info(f'Found asset {self.asset_id}')
+        workspace = Workspace(self.guid, f'{current.flow_name}/{current.run_id}')
+        filename = workspace.file(self.filename)
 
         # get mmif
         self.input_mmif = self.mmif
         if not self.mmif or self.mmif == 'null':
-            print('No mmif provided, downloading from clams')
-            self.input_mmif = post(
+            log.info('No mmif provided, downloading from clams')
+            response = client().post(
                 'http://fastclam/source',
                 json={'files': ['video:' + filename]},
-            ).json()
-        print('Got mmif')
-        print(self.input_mmif)
+            )
+            response.raise_for_status()
+            self.input_mmif = response.json()
+        log.info('Got mmif {mmif}', mmif=summarize(self.input_mmif))
         # Download the media file
-        ci = SonyCi(**SonyCi.from_env())
-        self.asset = ci.get(f'assets/{self.asset_id}')
+        self.asset = sonyci().get(self.asset_id)
 
         url = self.asset['proxyUrl']
-        print('Downloading file')
-        urlretrieve(url, filename)
+        log.info('Downloading file')
+        fetch_media(
+            self.asset_id, url, workspace, self.filename, proxy_checksum(self.asset)
+        )
 
-        print('Downloaded file')
-        run(['ls', '-al', '/m'])
+        log.info('Downloaded file')
 
         self.next(self.barsdetection)
 
     @kubernetes(image='ghcr.io/wgbh-mla/mario:main')
     @step
     def barsdetection(self):
-        """Run the mmif through app-barsdetection"""
-        from requests import post
-
-        self.response = post('http://app-barsdetection/', json=self.input_mmif)
+        """Run the mmif through app-barsdetection
+
+        Waits for a slot from the cluster-wide app scheduler, see
+        `mario.scheduler`.
+        """
+        from mario.client import client
+        from mario.log import flow_log, summarize
+        from mario.scheduler import scheduler
+
+        log = flow_log(self)
+        app = 'http://app-barsdetection/'
+        with scheduler().slot(app) as lease:
+            self.response = client().post(app, json=self.input_mmif)
+            if self.response.status_code != 200:
+                lease.failed()
         if self.response.status_code != 200:
-            print(self.response.content)
+            log.error(self.response.text)
             from mario.utils import CLAMSAppError
 
             raise CLAMSAppError(
-                f'app-barsdetection failed: {self.response.status_code} - {self.response.content}'
+                'app-barsdetection failed: '
+                f'{self.response.status_code} - {self.response.content}'
             )
         self.output_mmif = self.response.json()
-        print('Response from app-barsdetection:')
-        print(self.output_mmif)
+        log.info(
+            'Response from app-barsdetection {mmif}',
+            mmif=summarize(self.output_mmif),
+        )
 
         self.next(self.end)
 
     @secrets(sources=['CLAMS-chowda-secret'])
     @kubernetes(
-        image='ghcr.io/wgbh-mla/chowda:main',
+        image='ghcr.io/wgbh-mla/mario:main',
         persistent_volume_claims={
             'media-pvc': '/m',
         },
@@ -99,52 +115,42 @@ class AppBarsdetection(FlowSpec):
     @step
     def end(self):
         """Report results and cleanup"""
-        from glob import glob
-        from json import dumps
-        from os import remove
-        from os.path import join
-        from subprocess import run
-
-        from boto3 import client
-        from chowda.db import engine
-        from chowda.models import MediaFile
-        from sqlmodel import Session, select
-
-        # Update the database
-        with Session(engine) as db:
-            media_file = db.exec(
-                select(MediaFile).where(MediaFile.guid == self.guid)
-            ).one()
-            media_file.mmif_json = self.output_mmif
-            db.add(media_file)
-            db.commit()
+        from metaflow import current
 
-        # Upload to S3
-        mmif_filename = join('/m', self.guid + '.mmif')
-        s3_path = f'{self.guid}/app-barsdetection/{self.guid}.mmif'
+        from mario.db import chowda
+        from mario.log import flow_log
+        from mario.media import release_media
+        from mario.mmif import upload
+        from mario.workspace import Workspace
 
-        with open(mmif_filename, 'w') as f:
-            f.write(dumps(self.output_mmif))
+        log = flow_log(self)
 
-        run(['ls', '-al', '/m'])
+        # Upload to S3
+        s3_path = f'{self.guid}/app-barsdetection/{self.guid}.mmif'
 
         # Upload transcript to aws
         bucket = self.bucket if self.bucket != 'null' else 'clams-mmif'
-        print(f'Uploading {mmif_filename} to {bucket} {s3_path}')
-        client = client('s3')
-        client.upload_file(
-            mmif_filename,
-            bucket,
-            s3_path,
+        log.info(f'Uploading mmif to {bucket} {s3_path}')
+        upload(self.output_mmif, bucket, s3_path)
+
+        # Record the run and its output mmif in the database
+        db = chowda()
+        db.add_run(
+            current.run_id,
+            self.guid,
+            None,
+            pathspec=f'{current.flow_name}/{current.run_id}',
+            current_step=current.step_name,
+            current_task=current.task_id,
         )
-        print(f'Successfully processed {self.guid}')
+        db.add_mmif(self.guid, current.run_id, None, s3_path)
+        log.info(f'Successfully processed {self.guid}')
 
         # delete media file and transcripts
-        cleaned = 0
-        for f in glob(f'/m/{self.guid}*'):
-            remove(f)
-            cleaned += 1
-        print(f'Cleaned up {cleaned} files')
+        workspace = Workspace(self.guid, f'{current.flow_name}/{current.run_id}')
+        cleaned = workspace.cleanup()
+        release_media(self.asset_id, workspace)
+        log.info(f'Cleaned up {cleaned} files')
 
 
 if __name__ == '__main__':
@@ -10,70 +10,90 @@ class AppWhisper(FlowSpec):
 
     @secrets(sources=['CLAMS-SonyCi-API', 'CLAMS-chowda-secret'])
     @kubernetes(
-        image='ghcr.io/wgbh-mla/chowda:main',
+        image='ghcr.io/wgbh-mla/mario:main',
         persistent_volume_claims={'media-pvc': '/m'},
     )
     @step
     def start(self):
         """Download the media file"""
-        from os.path import join
-        from subprocess import run
-        from urllib.request import urlretrieve
-
-        from chowda.db import engine
-        from chowda.models import MediaFile
-        from requests import post
-        from sonyci import SonyCi
-        from sqlmodel import Session, select
-
-        # get SonyCi Asset ID
-        with Session(engine) as db:
-            media_file = db.exec(
-                select(MediaFile).where(MediaFile.guid == self.guid)
-            ).one()
+        from metaflow import current
+
+        from mario.ci import proxy_checksum, sonyci
+        from mario.client import client
+        from mario.db import chowda
+        from mario.log import flow_log
+        from mario.media import fetch_media
+        from mario.mmif import download, relocate
+        from mario.workspace import Workspace
+
+        log = flow_log(self)
+
+        # get SonyCi Asset ID, and the location of the latest mmif
+        db = chowda()
+        with db.lock:
+            media_file = db.media_file(self.guid)
             self.asset_id = media_file.assets[0].id
             self.filename = media_file.assets[0].name
-            self.mmif = media_file.mmif_json
+            locations = [mmif.mmif_location for mmif in media_file.mmifs]
+        locations = [location for location in locations if location]
 
         assert self.asset_id, f'No asset found for {self.guid}'
-        print(f'Found asset {self.asset_id}')
-        # run(f'ci download {self.asset_id} -o {join("/m", self.guid)}')
-        ci = SonyCi(**SonyCi.from_env())
-        self.asset = ci.get(f'assets/{self.asset_id}')
+        log.info(f'Found asset {self.asset_id}')
+        self.asset = sonyci().get(self.asset_id)
 
         url = self.asset['proxyUrl']
-        filename = join('/m', self.filename)
-        print(f'Downloading file to {filename}')
-        urlretrieve(url, filename)
+        workspace = Workspace(self.guid, f'{current.flow_name}/{current.run_id}')
+        log.info(f'Downloading file to {workspace.path}')
+        filename, _ = fetch_media(
+            self.asset_id, url, workspace, self.filename, proxy_checksum(self.asset)
+        )
 
-        print('Downloaded file!')
-        run(['ls', '-al', '/m'])
+        log.info('Downloaded file!')
 
         # get mmif
+        self.mmif = None
+        if locations:
+            log.info(f'Downloading mmif from {locations[-1]}')
+            self.mmif = download('clams-mmif', locations[-1])
+            self.mmif = relocate(self.mmif, workspace.path, [self.filename])
         if not self.mmif:
-            print('No mmif provided, downloading from clams')
-            self.mmif = post(
+            log.info('No mmif provided, downloading from clams')
+            response = client().post(
                 'http://fastclam/source',
                 json={'files': ['video:' + filename]},
-            ).json()
+            )
+            response.raise_for_status()
+            self.mmif = response.json()
 
         self.next(self.whisper)
 
-    @kubernetes()
+    @kubernetes(image='ghcr.io/wgbh-mla/mario:main')
     @step
     def whisper(self):
-        """Run the transcript through Whisper"""
+        """Run the transcript through Whisper
+
+        Waits for a slot from the cluster-wide app scheduler, see
+        `mario.scheduler`.
+        """
+        from mario.client import client
+        from mario.log import flow_log
+        from mario.scheduler import scheduler
 
-        from requests import post
+        log = flow_log(self)
 
-        print('Sending mmif to app-whisper')
-        self.output_mmif = post('http://app-whisper', json=self.mmif).json()
+        log.info('Sending mmif to app-whisper')
+        with scheduler().slot('http://app-whisper') as lease:
+            response = client().post('http://app-whisper', json=self.mmif)
+            if response.status_code != 200:
+                lease.failed()
+        response.raise_for_status()
+        self.output_mmif = response.json()
 
         self.next(self.end)
 
     @secrets(sources=['CLAMS-chowda-secret'])
     @kubernetes(
-        image='ghcr.io/wgbh-mla/chowda:main',
+        image='ghcr.io/wgbh-mla/mario:main',
         persistent_volume_claims={
             'media-pvc': '/m',
         },
@@ -81,49 +101,40 @@ class AppWhisper(FlowSpec):
     @step
     def end(self):
         """Report results and cleanup"""
-        from glob import glob
-        from json import dumps
-        from os import remove
-        from os.path import join
-        from subprocess import run
-
-        from boto3 import client
-        from chowda.db import engine
-        from chowda.models import MediaFile
-        from sqlmodel import Session, select
-
-        # Update the database
-        with Session(engine) as db:
-            media_file = db.exec(
-                select(MediaFile).where(MediaFile.guid == self.guid)
-            ).one()
-            media_file.mmif_json = self.output_mmif
-            db.add(media_file)
-            db.commit()
-
-        run(['ls', '-al', '/m'])
-        mmif_filename = join('/m', self.guid + '.mmif')
-        s3_path = f'{self.guid}/app-whisper/{self.guid}.mmif'
+        from metaflow import current
 
-        with open(mmif_filename, 'w') as f:
-            f.write(dumps(self.output_mmif))
+        from mario.db import chowda
+        from mario.log import flow_log
+        from mario.media import release_media
+        from mario.mmif import upload
+        from mario.workspace import Workspace
+
+        log = flow_log(self)
+
+        s3_path = f'{self.guid}/app-whisper/{self.guid}.mmif'
 
         # Upload transcript to aws
-        print(f'Uploading {mmif_filename} to {s3_path}')
-        client = client('s3')
-        client.upload_file(
-            mmif_filename,
-            'clams-mmif',
-            s3_path,
+        log.info(f'Uploading mmif to {s3_path}')
+        upload(self.output_mmif, 'clams-mmif', s3_path)
+
+        # Record the run and its output mmif in the database
+        db = chowda()
+        db.add_run(
+            current.run_id,
+            self.guid,
+            None,
+            pathspec=f'{current.flow_name}/{current.run_id}',
+            current_step=current.step_name,
+            current_task=current.task_id,
         )
-        print(f'Successfully processed {self.guid}')
+        db.add_mmif(self.guid, current.run_id, None, s3_path)
+        log.info(f'Successfully processed {self.guid}')
 
         # delete media file and transcripts
-        cleaned = 0
-        for f in glob(f'/m/{self.guid}*'):
-            remove(f)
-            cleaned += 1
-        print(f'Cleaned up {cleaned} files')
+        workspace = Workspace(self.guid, f'{current.flow_name}/{current.run_id}')
+        cleaned = workspace.cleanup()
+        release_media(self.asset_id, workspace)
+        log.info(f'Cleaned up {cleaned} files')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,89 @@
+from metaflow import FlowSpec, Parameter, kubernetes, secrets, step, trigger
+from utils import PipelineUtils
+
+
+@trigger(event='batch')
+class BatchPipeline(FlowSpec, PipelineUtils):
+    """Run every MediaFile in a Batch through a CLAMS pipeline
+
+    GUIDs are split into chunks, and each chunk is processed by one foreach
+    task. Use `--max-workers` to limit how many chunks run at once.
+    """
+
+    batch_id = Parameter('batch_id', help='Batch ID to process', type=int)
+    pipeline = Parameter(
+        'pipeline', help='List of CLAMS apps to run media through', separator=','
+    )
+    spec = Parameter(
+        'spec',
+        help='JSON pipeline spec of named apps and the apps they run after. '
+        'Used instead of pipeline',
+        default=None,
+    )
+    bucket = Parameter(
+        'bucket', help='S3 bucket to store results in', default='clams-mmif'
+    )
+    chunk_size = Parameter(
+        'chunk_size', help='Number of GUIDs per foreach task', default=25, type=int
+    )
+    workers = Parameter(
+        'workers', help='GUIDs processed at once in each task', default=4, type=int
+    )
+    app_concurrency = Parameter(
+        'app_concurrency',
+        help='Max in-flight requests to each CLAMS app from each task',
+        default=2,
+        type=int,
+    )
+
+    @secrets(sources=['CLAMS-chowda-secret'])
+    @kubernetes(image='ghcr.io/wgbh-mla/mario:main')
+    @step
+    def start(self):
+        """Load the GUIDs in the batch and split them into chunks"""
+        guids = self.get_batch_guids()
+        assert guids, f'No media files found in batch {self.batch_id}'
+        self.chunks = [
+            guids[i : i + self.chunk_size]
+            for i in range(0, len(guids), self.chunk_size)
+        ]
+        self.log.info(f'Processing {len(guids)} GUIDs in {len(self.chunks)} chunks')
+        self.next(self.run_chunk, foreach='chunks')
+
+    @secrets(sources=['CLAMS-SonyCi-API', 'CLAMS-chowda-secret'])
+    @kubernetes(
+        image='ghcr.io/wgbh-mla/mario:main',
+        persistent_volume_claims={'media-pvc': '/m'},
+    )
+    @step
+    def run_chunk(self):
+        """Run each GUID in the chunk through the pipeline"""
+        self.results = self.process_chunk(
+            self.input, self.workers, self.app_concurrency
+        )
+        failed = sum(not result['ok'] for result in self.results)
+        self.log.info(f'Processed {len(self.results)} GUIDs, {failed} failed')
+        self.next(self.join)
+
+    @kubernetes(image='ghcr.io/wgbh-mla/mario:main')
+    @step
+    def join(self, inputs):
+        """Aggregate successes and failures"""
+        self.results = [result for task in inputs for result in task.results]
+        self.succeeded = [r['guid'] for r in self.results if r['ok']]
+        self.failed = {r['guid']: r['error'] for r in self.results if not r['ok']}
+        self.spans = [span for task in inputs for span in task.spans]
+        self.next(self.end)
+
+    @kubernetes(image='ghcr.io/wgbh-mla/mario:main')
+    @step
+    def end(self):
+        """Report results"""
+        self.log.info(f'{len(self.succeeded)} succeeded, {len(self.failed)} failed')
+        self.export_metrics()
+        for guid, error in self.failed.items():
+            self.log.warning(f'{guid}: {error}')
+
+
+if __name__ == '__main__':
+    BatchPipeline()
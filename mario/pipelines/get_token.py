@@ -2,52 +2,28 @@ from metaflow import FlowSpec, step
 
 
 class TokenFlow(FlowSpec):
+    """Fetch a Chowda API token and publish it to the argo-events secret
+
+    For a long-running process that keeps the secret fresh, use
+    `mario token --watch` instead.
+    """
+
     @step
     def start(self):
-        """Login and get a BearerToken."""
-        from requests import post
-        from requests_oauth2client.tokens import BearerToken
-
-        from mario.config import API_AUDIENCE, AUTH0_DOMAIN, CLIENT_ID, CLIENT_SECRET
-        from mario.log import log
-
-        response = post(
-            AUTH0_DOMAIN,
-            data={
-                'grant_type': 'client_credentials',
-                'client_id': CLIENT_ID,
-                'client_secret': CLIENT_SECRET,
-                'audience': API_AUDIENCE,
-            },
-        )
-        log.debug(f'token response status: {response.status_code}')
-        if response.status_code != 200:
-            log.error(f'Token returned {response.status_code}: {response.text}')
-            raise Exception(
-                f'Token did not return 200. Returned: {response.status_code}: {response.text}'
-            )
-        bearer_token = BearerToken(**response.json())
-        self.access_token = bearer_token.access_token
+        """Login, get a BearerToken and upload it as a kubernetes secret."""
+        from mario.log import flow_log
+        from mario.token import TokenProvider, patch_secret
+
+        token = TokenProvider(on_refresh=patch_secret).token()
+        # Never log the token itself
+        flow_log(self).info(f'Updated token, expires in {token.expires_in():.0f}s')
         self.next(self.end)
 
     @step
     def end(self):
-        """Upload the token as a kubernetes secret."""
-        from json import dumps
-        from subprocess import run
-
-        print('Updating kubernetes secret...')
-        access_token = f'Bearer {self.access_token}'
-        patch = {'stringData': {'token': access_token}}
-        cmd = 'kubectl -n argo-events patch secret argo-events-chowda-api-token -p'.split()
-        cmd.append(dumps(patch))
-        print('running: ', cmd)
-        results = run(cmd, capture_output=True, text=True)
-        print(results.stderr)
-        print(results.stdout)
-        print('Done! Return code: ', results.returncode)
-        if results.returncode != 0:
-            raise Exception('Error updating kubernetes secret')
+        from mario.log import flow_log
+
+        flow_log(self).info('Done!')
 
 
 if __name__ == '__main__':
@@ -1,5 +1,5 @@
 from metaflow import FlowSpec, Parameter, kubernetes, secrets, step, trigger
-from utils import NUNS, PipelineUtils
+from utils import PipelineUtils
 
 
 @trigger(event='pipeline')
@@ -13,59 +13,64 @@ class Pipeline(FlowSpec, PipelineUtils):
     pipeline = Parameter(
         'pipeline', help='List of CLAMS apps to run media through', separator=','
     )
+    spec = Parameter(
+        'spec',
+        help='JSON pipeline spec of named apps and the apps they run after. '
+        'Used instead of pipeline',
+        default=None,
+    )
     bucket = Parameter(
         'bucket', help='S3 bucket to store results in', default='clams-mmif'
     )
     batch_id = Parameter(
         'batch_id', help='Batch ID to store results in', default=None, type=int
     )
+    preprocess = Parameter(
+        'preprocess',
+        help='Make audio and low frame rate proxies for apps that declare needs',
+        default=False,
+        type=bool,
+    )
 
     @secrets(sources=['CLAMS-SonyCi-API', 'CLAMS-chowda-secret'])
     @kubernetes(
-        image='ghcr.io/wgbh-mla/chowda:main',
+        image='ghcr.io/wgbh-mla/mario:main',
         persistent_volume_claims={'media-pvc': '/m'},
     )
     @step
     def start(self):
         """Download the media file and initiliaze the mmif"""
+        from mario.log import summarize
 
-        self.get_asset_id()
+        self.prepare()
         assert self.asset_id, f'No asset found for {self.guid}'
-        print(f'Found asset {self.asset_id}')
+        self.log.info(f'Found asset {self.asset_id}')
 
-        if self.mmif_location not in NUNS:
-            print('Downloading mmif from', self.mmif_location)
-            self.input_mmif = self.download_mmif(self.mmif_location)
-        else:
-            print('No mmif provided. Sourcing new mmif')
-            self.input_mmif = self.create_new_mmif()
         assert self.input_mmif, 'Problem getting mmif'
-        print('Got mmif')
-        print(self.input_mmif)
+        self.log.info('Got mmif {mmif}', mmif=summarize(self.input_mmif))
 
-        self.download_media_file()
-        print('Downloaded file')
+        self.log.info('Downloaded file')
+        self.log.info(f'Phase timings: {self.phase_timings}')
 
         self.next(self.run_pipeline)
 
-    @kubernetes(image='ghcr.io/wgbh-mla/mario:main')
+    # Streamed mmifs are spooled to the run's workspace on the media volume
+    @kubernetes(
+        image='ghcr.io/wgbh-mla/mario:main',
+        persistent_volume_claims={'media-pvc': '/m'},
+    )
     @step
     def run_pipeline(self):
         """Run the mmif through a CLAMS pipeline"""
-        mmif = self.input_mmif
-        print('starting pipeline')
-        print(self.pipeline)
-        for app in self.pipeline:
-            print(f'Running {app}')
-            mmif = self.app(app, mmif)
-            print(f'{app} done')
-        self.output_mmif = mmif
-        print(f'Finished pipeline of {len(self.pipeline)} apps!')
+        self.log.info(f'Starting pipeline {self.spec or self.pipeline}')
+        self.output_mmif = self.keep(self.run_apps(self.input_mmif), 'output')
+        self.log.info(f'Finished pipeline of {len(self.apps())} apps!')
+        self.log.info(f'App timings: {self.dag_timings}')
         self.next(self.end)
 
     @secrets(sources=['CLAMS-chowda-secret'])
     @kubernetes(
-        image='ghcr.io/wgbh-mla/chowda:main',
+        image='ghcr.io/wgbh-mla/mario:main',
         persistent_volume_claims={
             'media-pvc': '/m',
         },
@@ -76,8 +81,10 @@ class Pipeline(FlowSpec, PipelineUtils):
         self.s3_path = f'{self.guid}/{self.batch_id}/{self.guid}.mmif'
         self.upload_mmif(self.s3_path)
         self.update_database(self.s3_path)
+        self.clear_checkpoints()
         self.cleanup()
-        print(f'Successfully processed {self.guid}')
+        self.export_metrics()
+        self.log.info(f'Successfully processed {self.guid}')
 
 
 if __name__ == '__main__':
@@ -1,60 +1,178 @@
 """Utility functions for CLAMS Pipeline Runner"""
 
+from threading import Lock
+from typing import Dict, List, Optional
+
 # Parameter values that should be treated as None. This is necessary
 # because falsy values show up differently when called via CLI vs argo
 NUNS = (None, 'null', '')
 
+# Guards creating `spans` when steps record them from several threads
+spans_lock = Lock()
+
 
 class PipelineUtils:
     """Utility functions for CLAMS Pipeline Runner"""
 
-    def get_asset_id(self) -> None:
-        from chowda.db import engine
-        from chowda.models import Batch, MediaFile, MetaflowRun
+    # Queue database rows and write them in bulk with `chowda().flush()`
+    defer_writes = False
+    # Make reduced media proxies for apps that declare `needs`
+    preprocess = False
+
+    def metaflow_run_id(self) -> str:
+        """ID of the MetaflowRun row for this media file"""
         from metaflow import current
-        from sqlmodel import Session, select
 
+        return current.run_id
+
+    def span(self, name: str, **attrs):
+        """Time a phase of work and record it in `self.spans`
+
+        Spans are stored as a Metaflow artifact and can be exported as
+        metrics with `export_metrics`. See `mario.log.span`.
+        """
+        from mario.log import span
+
+        with spans_lock:
+            spans = getattr(self, 'spans', None)
+            if spans is None:
+                self.spans = spans = []
+        return span(spans, name, guid=getattr(self, 'guid', None), **attrs)
+
+    def export_metrics(self) -> str:
+        """Write or push this run's spans as metrics. See `mario.metrics`"""
+        from metaflow import current
+
+        from mario.metrics import export
+
+        labels = {'flow': current.flow_name, 'run_id': current.run_id}
+        if getattr(self, 'guid', None):
+            labels['guid'] = self.guid
+        return export(getattr(self, 'spans', None) or [], labels)
+
+    @property
+    def mmif_bucket(self) -> str:
+        """The S3 bucket of this run's mmifs"""
+        return self.bucket if self.bucket not in NUNS else 'clams-mmif'
+
+    @property
+    def log(self):
+        """A logger bound to this run's guid, batch and step"""
+        from mario.log import flow_log
+
+        return flow_log(self)
+
+    def workspace(self):
+        """The media workspace for this media file in this run"""
+        from metaflow import current
+
+        from mario.workspace import Workspace
+
+        return Workspace(self.guid, f'{current.flow_name}/{current.run_id}')
+
+    def get_asset_id(self) -> None:
         """Get the asset.id + filename for a media file"""
-        from os.path import join
+        from metaflow import current
 
-        with Session(engine) as db:
-            media_file = db.exec(
-                select(MediaFile).where(MediaFile.guid == self.guid)
-            ).one()
+        from mario.db import chowda
 
+        with self.span('asset'):
+            db = chowda()
             # Add the Metaflow Run to the database
-            batch = db.get(Batch, self.batch_id)
             pathspec = current.flow_name + '/' + current.run_id
-            print(f'Adding {current.run_id} to {batch.name} with {pathspec}')
-            new_metaflow_run = MetaflowRun(
-                id=current.run_id,
-                batch=batch,
-                media_file=media_file,
+            run_id = self.metaflow_run_id()
+            self.log.info(f'Adding {run_id} to batch {self.batch_id} with {pathspec}')
+            db.add_run(
+                run_id,
+                self.guid,
+                self.batch_id,
+                defer=self.defer_writes,
                 pathspec=pathspec,
                 current_step=current.step_name,
                 current_task=current.task_id,
             )
-            db.add(new_metaflow_run)
-            db.commit()
-
-            assert media_file.assets, f'No media assets found for {self.guid}'
-            # Get the first asset. This is ok, because we are now filtering
-            # SonyCiAssets on ingest, so they should all be media.
-            asset = media_file.assets[0]
-            self.asset_id = asset.id
-            self.asset_name = asset.name
-            self.type = asset.type.value.lower()
-            self.filename = join('/m', self.asset_name)
+            self.asset_id, self.asset_name, self.type = db.asset(self.guid)
+            self.filename = self.workspace().file(self.asset_name)
+
+    def get_input_mmif(self) -> None:
+        """Download the input mmif from S3, or source a new one
+
+        With `MMIF_STREAM` set, an existing mmif is kept as a ref to S3 and
+        only streamed from there when it is needed. An existing mmif's media
+        documents are pointed at this run's workspace, see `relocate`.
+        """
+        from mario.config import MMIF_STREAM
+        from mario.mmif import MMIFRef
+
+        if self.mmif_location not in NUNS and MMIF_STREAM:
+            mmif = MMIFRef(f's3://{self.mmif_bucket}/{self.mmif_location}')
+            self.input_mmif = self.relocate(mmif)
+        elif self.mmif_location not in NUNS:
+            self.log.info(f'Downloading mmif from {self.mmif_location}')
+            self.input_mmif = self.relocate(self.download_mmif(self.mmif_location))
+        else:
+            self.log.info('No mmif provided. Sourcing new mmif')
+            self.input_mmif = self.create_new_mmif()
+
+    def relocate(self, mmif):
+        """`mmif` with the media file and its proxies in this run's workspace
+
+        See `Workspace.relocate`.
+        """
+        return self.workspace().relocate(mmif, self.asset_name)
+
+    def prepare(self) -> None:
+        """Get the asset, input mmif, and media file, overlapping network I/O
+
+        Sourcing a new mmif, or pointing an existing one at this run's
+        workspace, only needs `self.filename`, not the downloaded bytes, so
+        both run alongside the media download. Per-phase timings are stored
+        in `self.phase_timings`.
+        """
+        from mario.phases import Phase, run_phases
+
+        phases = [
+            Phase('asset', self.get_asset_id),
+            Phase('mmif', self.get_input_mmif, after=('asset',)),
+            Phase('media', self.download_media_file, after=('asset',)),
+        ]
+        if self.preprocess:
+            phases.append(
+                Phase('preprocess', self.preprocess_media, after=('mmif', 'media'))
+            )
+        self.phase_timings = run_phases(phases)
+
+    def preprocess_media(self) -> None:
+        """Make reduced proxies of the media for the apps that declare `needs`
+
+        The proxies are added to `self.input_mmif` as documents, and
+        `self.proxy_documents` maps each need to its document id. Sizes, and
+        the bytes apps no longer read, are stored in `self.preprocess_stats`.
+        App spans then record whether the app was sent a proxy, so the app
+        time saved shows in the `proxy` label of the exported metrics.
+        """
+        from mario.mmif import load
+        from mario.preprocess import add_documents, make_proxies, proxy_stats
+
+        apps = self.apps()
+        with self.span('preprocess') as span:
+            proxies = make_proxies(
+                self.filename, {need for app in apps for need in app.needs}
+            )
+            span['bytes'] = sum(proxy['bytes'] for proxy in proxies.values())
+        self.input_mmif = load(self.input_mmif)
+        self.proxy_documents = add_documents(self.input_mmif, proxies)
+        self.preprocess_stats = {
+            'seconds': span['seconds'],
+            **proxy_stats(self.filename, proxies, [app.needs for app in apps]),
+        }
+        self.log.info(f'Preprocessed media: {self.preprocess_stats}')
 
     def get_mmif_from_database(self):
-        from chowda.db import engine
-        from chowda.models import MediaFile
-        from sqlmodel import Session, select
-
-        with Session(engine) as db:
-            media_file = db.exec(
-                select(MediaFile).where(MediaFile.guid == self.guid)
-            ).one()
+        from mario.db import chowda
+
+        with chowda().lock:
+            media_file = chowda().media_file(self.guid)
             # TODO Ensure this gets the most recent mmif
             location = media_file.mmifs[-1].mmif_location
         # get the mmif from the S3 bucket
@@ -63,129 +181,373 @@ class PipelineUtils:
         return self.download_mmif_from_s3(location)
 
     def create_new_mmif(self) -> dict:
-        from requests import post
+        from mario.client import client
 
-        return post(
-            'http://fastclam/source',
-            json={'files': [f'{self.type}:' + self.filename]},
-        ).json()
+        with self.span('fastclam') as span:
+            response = client().post(
+                'http://fastclam/source',
+                json={'files': [f'{self.type}:' + self.filename]},
+            )
+            response.raise_for_status()
+            span['bytes'] = span['mmif_bytes'] = len(response.content)
+        return response.json()
 
     def download_media_file(self) -> None:
-        """Download the media file"""
-        from urllib.request import urlretrieve
-
-        from sonyci import SonyCi
-
-        ci = SonyCi(**SonyCi.from_env())
-        self.asset = ci.get(f'assets/{self.asset_id}')
-
-        url = self.asset['proxyUrl']
-        print('Downloading file')
-        urlretrieve(url, self.filename)
-
-    def app(self, app: str, mmif: dict) -> dict:
-        """Run the mmif through a CLAMS app"""
-        from requests import post
-
-        response = post(app, json=mmif)
+        """Download the media file
+
+        The proxy is fetched in parallel byte-range chunks, and resumes from
+        any chunks already on disk if the step is retried. Stale workspaces
+        are evicted to make room for it first, see `enforce_budget`. With
+        `MEDIA_CACHE` enabled, it is shared with every other run of the same
+        asset, see `mario.media`.
+        """
+        from dataclasses import asdict
+
+        from mario.ci import proxy_checksum, sonyci
+        from mario.media import fetch_media
+        from mario.workspace import enforce_budget
+
+        with self.span('media') as span:
+            self.asset = sonyci().get(self.asset_id)
+
+            url = self.asset['proxyUrl']
+            self.log.info('Downloading file')
+            _, result = fetch_media(
+                self.asset_id,
+                url,
+                self.workspace(),
+                self.asset_name,
+                proxy_checksum(self.asset),
+                reserve=lambda size: enforce_budget(needed=size),
+            )
+            span['cache'] = 'miss' if result else 'hit'
+            span['bytes'] = result.fetched if result else 0
+        if result is None:
+            self.log.info(f'Found asset {self.asset_id} in the media cache')
+            self.download_stats = {'filename': self.filename, 'cache': 'hit'}
+            return
+        self.download_stats = {**asdict(result), 'throughput': result.throughput}
+
+    def app_slot(self, app: str):
+        """Context manager held while a request to `app` is in flight
+
+        Limits concurrent requests per app when `self.app_limits` maps app
+        urls to semaphores, as in batch mode.
+        """
+        from contextlib import nullcontext
+
+        return getattr(self, 'app_limits', {}).get(app) or nullcontext()
+
+    def app(self, app: str, mmif, **attrs):
+        """Run the mmif through a CLAMS app
+
+        Requests wait for a slot from the cluster-wide adaptive scheduler,
+        see `mario.scheduler`. `attrs` are added to the app's span.
+
+        With `MMIF_STREAM` set, or given an `MMIFRef`, the mmif is sent from a
+        file and the response is spooled to one, and an `MMIFRef` to the
+        output is returned instead of the parsed mmif.
+        """
+        from mario.client import client
+        from mario.config import MMIF_STREAM
+        from mario.mmif import MMIFRef, post
+        from mario.scheduler import scheduler
+
+        stream = MMIF_STREAM or isinstance(mmif, MMIFRef)
+        directory = self.workspace().create().path if stream else None
+        with self.app_slot(app), scheduler().slot(app) as lease:
+            with self.span('app', app=app, waited=lease.waited, **attrs) as span:
+                response, output, sent, received = post(app, mmif, directory)
+                span['bytes'] = sent + received
+                span['mmif_bytes'] = received
+            if response.status_code != 200:
+                lease.failed()
+        self.http_stats = client().metrics()
         if response.status_code != 200:
             from mario.utils import CLAMSAppError
 
             raise CLAMSAppError(
                 f'{app} failed: {response.status_code} - {response.content}'
             )
-        return response.json()
+        return output
+
+    def checkpoints(self):
+        """Checkpoints for this media file in this run, or None if `CHECKPOINTS`
+        is not set
+
+        Keyed by the original run id, so `resume`d runs find the checkpoints
+        of the run they resume.
+        """
+        from metaflow import current
+
+        from mario.checkpoint import checkpoints_for
+
+        run_id = current.origin_run_id or current.run_id
+        return checkpoints_for(current.flow_name, run_id, self.guid)
+
+    def clear_checkpoints(self) -> None:
+        """Delete this media file's checkpoints, once its output is stored"""
+        checkpoints = self.checkpoints()
+        if checkpoints is not None:
+            self.log.info(f'Deleted {checkpoints.clear()} checkpoints')
+
+    def apps(self) -> list:
+        """The apps to run, from `self.spec` if given, else `self.pipeline`"""
+        from mario.dag import chain, parse
+
+        spec = getattr(self, 'spec', None)
+        if spec not in NUNS:
+            return parse(spec)
+        return chain(self.pipeline)
+
+    def run_cached(self, cache, app: str, mmif, run_app):
+        """Run `mmif` through `app`, reusing its cached output if `cache` is set
+
+        Refs are hashed and cached as files in the workspace, without parsing.
+        Paths in the workspace are cached relative to it, so outputs are
+        shared with runs of the same media in other workspaces.
+        """
+        from mario.cache import run_cached
+        from mario.mmif import MMIFRef
+
+        if cache is None:
+            return run_app(app, mmif)
+        workspace = self.workspace().create().path
+        directory = workspace if isinstance(mmif, MMIFRef) else None
+        return run_cached(
+            app, mmif, run_app, cache, directory=directory, workspace=workspace
+        )
+
+    def run_apps(self, mmif):
+        """Run the mmif through the pipeline's apps
+
+        Apps run as soon as the apps they depend on are done, so independent
+        branches of a spec run concurrently, and their views are merged into
+        the output. With `CHECKPOINTS` set, each app's output is checkpointed,
+        and a retried run loads the checkpoints of apps that already finished.
+        If an `MMIF_CACHE` is configured, apps that were already run on the
+        same input are skipped and their cached output is used instead. Apps
+        that declare `consumes` are only sent the views they read, and the
+        views they add are spliced back into the full mmif. Checkpoint
+        locations are stored in `self.checkpoint_locations`, and per-app
+        timings in `self.dag_timings`. With `MMIF_STREAM` set, the output may
+        be an `MMIFRef`, see `keep`.
+        """
+        from dataclasses import asdict
+        from functools import partial
+
+        from mario.cache import mmif_cache
+        from mario.dag import DAGRun
+        from mario.mmif import run_projected
+
+        def run_app(app: str, mmif, **attrs):
+            self.log.info(f'Running {app}')
+            mmif = self.app(app, mmif, **attrs)
+            self.log.info(f'{app} done')
+            return mmif
+
+        checkpoints = self.checkpoints()
+        self.checkpoint_locations = [] if checkpoints is None else checkpoints.saved
+        cache = mmif_cache()
+
+        def run_node(index: int, app, mmif):
+            if checkpoints is not None and checkpoints.exists(index, app.url):
+                self.log.info(f'Resuming {app.name} from checkpoint')
+                return self.relocate(checkpoints.load(index, app.url))
+            proxies = getattr(self, 'proxy_documents', None) or {}
+            # Preprocessed runs record whether the app was sent a proxy
+            attrs = {'proxy': bool(set(app.needs) & set(proxies))} if proxies else {}
+            runner = partial(run_app, **attrs)
+            # Send only the media documents and views the app needs
+            output = run_projected(
+                mmif,
+                partial(self.run_cached, cache, app.url, run_app=runner),
+                app.consumes,
+                app.needs,
+                proxies,
+            )
+            if checkpoints is not None:
+                with self.span('checkpoint', app=app.url):
+                    checkpoints.save(index, app.url, output)
+            return output
+
+        apps = self.apps()
+        dag = DAGRun(apps, mmif, run_node)
+        # An empty pipeline returns the mmif unchanged
+        mmif = dag.run(max_workers=max(1, len(apps)))
+        self.dag_timings = dag.timings
+
+        if cache is not None:
+            cache.evict()
+            self.cache_stats = {**asdict(cache.stats), 'hit_rate': cache.stats.hit_rate}
+        return mmif
+
+    def keep(self, mmif, name: str):
+        """`mmif` as it should be stored as an artifact
+
+        Refs to local files do not outlive the step, so they are loaded, or
+        uploaded to S3 and kept as refs if larger than `MMIF_REF_SIZE`.
+        """
+        from metaflow import current
+
+        from mario.config import MMIF_REF_SIZE
+        from mario.mmif import MMIFRef, store
+
+        if not isinstance(mmif, MMIFRef) or mmif.s3:
+            return mmif
+        if mmif.size <= MMIF_REF_SIZE:
+            return mmif.load()
+        key = f'refs/{current.flow_name}/{current.run_id}/{self.guid}/{name}.mmif'
+        with self.span('upload', ref=name) as span:
+            ref = store(mmif, self.mmif_bucket, key)
+            span['bytes'] = ref.size
+        self.log.info(f'Stored {name} mmif ({mmif.size} bytes) as {ref.location}')
+        return ref
 
     def update_database(self, s3_path: str) -> None:
         """Update the database with the output mmif"""
-        from chowda.db import engine
-        from chowda.models import MMIF, Batch, MediaFile, MetaflowRun
-        from metaflow import current
-        from sqlmodel import Session, select
-
-        with Session(engine) as db:
-            media_file = db.exec(
-                select(MediaFile).where(MediaFile.guid == self.guid)
-            ).one()
-            batch = db.get(Batch, self.batch_id)
-            metaflow_run = db.get(MetaflowRun, current.run_id)
-            mmif = MMIF(
-                media_file=media_file,
-                metaflow_run=metaflow_run,
-                batch_output=batch,
-                mmif_location=s3_path,
+        from mario.db import chowda
+
+        with self.span('db'):
+            chowda().add_mmif(
+                self.guid,
+                self.metaflow_run_id(),
+                self.batch_id,
+                s3_path,
+                defer=self.defer_writes,
             )
-            db.add(mmif)
-            db.commit()
 
     def download_mmif(self, s3_path: str) -> dict:
         """Download an mmif from S3"""
-        from json import loads
-
-        from boto3 import client
+        from mario.mmif import download
 
-        bucket = self.bucket if self.bucket not in NUNS else 'clams-mmif'
-        client = client('s3')
-        response = client.get_object(Bucket=bucket, Key=s3_path)
-        body = response['Body'].read().decode('utf-8')
-        return loads(body)
+        with self.span('mmif_download'):
+            return download(self.mmif_bucket, s3_path)
 
     def upload_mmif(self, s3_path: str) -> None:
         """Upload the output mmif to S3"""
-        from json import dumps
-        from os.path import join
-
-        from boto3 import client
-
-        mmif_filename = join(self.guid + '.mmif')
-
-        with open(mmif_filename, 'w') as f:
-            f.write(dumps(self.output_mmif))
+        from mario.mmif import upload
 
         # Upload transcript to aws
-        bucket = self.bucket if self.bucket != 'null' else 'clams-mmif'
-        print(f'Uploading {mmif_filename} to {bucket} {s3_path}')
-        client = client('s3')
-        client.upload_file(
-            mmif_filename,
-            bucket,
-            s3_path,
-        )
-        print('Uploaded mmif!')
+        self.log.info(f'Uploading mmif to {self.mmif_bucket} {s3_path}')
+        with self.span('upload') as span:
+            size = span['bytes'] = upload(self.output_mmif, self.mmif_bucket, s3_path)
+        self.log.info(f'Uploaded mmif! ({size} bytes)')
         return s3_path
 
     def download_mmif_from_s3(self, s3_path: str):
-        from json import loads
-        from os import remove
-        from os.path import join
-
-        from boto3 import client
-
-        bucket = self.bucket if self.bucket != 'null' else 'clams-mmif'
-        mmif_filename = join(self.guid + '.mmif')
-
-        print(f'Downloading {s3_path} to {mmif_filename}')
-        s3_client = client('s3')
-        s3_client.download_file(
-            bucket,
-            s3_path,
-            mmif_filename,
-        )
-
-        with open(mmif_filename) as file:
-            file_contents = file.read()
-
-        remove(mmif_filename)
+        from mario.mmif import download
+
+        self.log.info(f'Downloading {s3_path}')
+        with self.span('mmif_download'):
+            return download(self.mmif_bucket, s3_path)
+
+    def get_batch_guids(self) -> List[str]:
+        """Get the guids of every media file in self.batch_id, in one query"""
+        from mario.db import chowda
+
+        return chowda().batch_guids(self.batch_id)
+
+    def process(self) -> str:
+        """Run this media file through the whole pipeline
+
+        Returns:
+            The S3 path of the output mmif
+        """
+        self.prepare()
+        self.output_mmif = self.run_apps(self.input_mmif)
+        s3_path = f'{self.guid}/{self.batch_id}/{self.guid}.mmif'
+        self.upload_mmif(s3_path)
+        self.update_database(s3_path)
+        self.clear_checkpoints()
+        return s3_path
 
-        return loads(file_contents)
+    def process_chunk(
+        self, guids: List[str], workers: int, app_concurrency: int
+    ) -> List[Dict]:
+        """Process `guids` concurrently, with at most `app_concurrency`
+        in-flight requests to each CLAMS app.
+
+        A failure is recorded in the results instead of failing the chunk,
+        including media files whose database rows could not be written.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from threading import BoundedSemaphore
+
+        from mario.ci import sonyci
+        from mario.db import chowda
+
+        self.spans = []
+        limits = {app.url: BoundedSemaphore(app_concurrency) for app in self.apps()}
+        chowda().prefetch(guids)
+        with self.span('sonyci'):
+            sonyci().prefetch_guids(guids)
+
+        def process(guid: str) -> Dict:
+            item = MediaItem(
+                guid,
+                pipeline=self.pipeline,
+                spec=self.spec,
+                bucket=self.bucket,
+                batch_id=self.batch_id,
+                app_limits=limits,
+            )
+            try:
+                return {'guid': guid, 'ok': True, 's3_path': item.process()}
+            except Exception as e:
+                item.log.exception(f'Failed to process {guid}')
+                return {'guid': guid, 'ok': False, 'error': repr(e)}
+            finally:
+                item.cleanup()
+                self.spans.extend(getattr(item, 'spans', None) or [])
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            results = list(pool.map(process, guids))
+        # Write the MetaflowRun and MMIF rows for the whole chunk at once
+        db = chowda()
+        failed = len(db.failed)
+        with self.span('db_flush'):
+            db.flush()
+        unrecorded = {row['media_file_id'] for _, row in db.failed[failed:]}
+        for result in results:
+            if result['ok'] and result['guid'] in unrecorded:
+                result.update(ok=False, error='Could not write its database rows')
+        return results
 
     def cleanup(self) -> None:
-        """delete media file and transcripts"""
-        from glob import glob
-        from os import remove
-
-        cleaned = 0
-        for f in glob(f'/m/{self.guid}*'):
-            remove(f)
-            cleaned += 1
-        print(f'Cleaned up {cleaned} files')
+        """delete media file and transcripts, and release the cached media"""
+        from mario.media import release_media
+
+        workspace = self.workspace()
+        cleaned = workspace.cleanup()
+        release_media(getattr(self, 'asset_id', None), workspace)
+        self.log.info(f'Cleaned up {cleaned} files')
+
+
+class MediaItem(PipelineUtils):
+    """A single media file processed outside of a per-GUID flow, e.g. as one of
+    many GUIDs in a batch run"""
+
+    defer_writes = True
+
+    def __init__(
+        self,
+        guid: str,
+        pipeline: Optional[List[str]] = None,
+        spec: Optional[str] = None,
+        bucket: str = 'clams-mmif',
+        batch_id: Optional[int] = None,
+        mmif_location: Optional[str] = None,
+        app_limits: Optional[Dict] = None,
+    ):
+        self.guid = guid
+        self.pipeline = pipeline
+        self.spec = spec
+        self.bucket = bucket
+        self.batch_id = batch_id
+        self.mmif_location = mmif_location
+        self.app_limits = app_limits or {}
+
+    def metaflow_run_id(self) -> str:
+        """One Metaflow run handles many media files, so key each row by guid"""
+        return f'{super().metaflow_run_id()}-{self.guid}'
@@ -10,21 +10,24 @@ class Whisper(FlowSpec):
 
     @secrets(sources=['CLAMS-SonyCi-API', 'CLAMS-chowda-secret'])
     @kubernetes(
-        image='ghcr.io/wgbh-mla/chowda:main',
+        image='ghcr.io/wgbh-mla/mario:main',
         persistent_volume_claims={'media-pvc': '/m'},
     )
     @step
     def start(self):
         """Download the media file"""
-        from os.path import join
-        from subprocess import run
-        from urllib.request import urlretrieve
-
         from chowda.db import engine
         from chowda.models import SonyCiAsset
-        from sonyci import SonyCi
+        from metaflow import current
         from sqlmodel import Session, select
 
+        from mario.ci import proxy_checksum, sonyci
+        from mario.log import flow_log
+        from mario.media import fetch_media
+        from mario.workspace import Workspace
+
+        log = flow_log(self)
+
         # get SonyCi Asset ID
         with Session(engine) as db:
             self.asset_id = (
@@ -33,17 +36,17 @@ class Whisper(FlowSpec):
                 .id
             )
         assert self.asset_id, f'No asset found for {self.guid}'
-        print(f'Found asset {self.asset_id}')
-        # run(f'ci download {self.asset_id} -o {join("/m", self.guid)}')
-        ci = SonyCi(**SonyCi.from_env())
-        self.asset = ci.get(f'assets/{self.asset_id}')
+        log.info(f'Found asset {self.asset_id}')
+        self.asset = sonyci().get(self.asset_id)
 
         url = self.asset['proxyUrl']
-        print('Downloading file')
-        urlretrieve(url, join('/m', self.guid))
+        workspace = Workspace(self.guid, f'{current.flow_name}/{current.run_id}')
+        log.info(f'Downloading file to {workspace.path}')
+        self.media_path, _ = fetch_media(
+            self.asset_id, url, workspace, self.guid, proxy_checksum(self.asset)
+        )
 
-        print('Downloaded file')
-        run(['ls', '-al', '/m'])
+        log.info('Downloaded file')
 
         self.next(self.whisper)
 
@@ -58,17 +61,21 @@ class Whisper(FlowSpec):
     @step
     def whisper(self):
         """Run the transcript through Whisper"""
-        from shutil import copy
+        # The whisper-bot image does not ship mario, so only use its packages
+        from os.path import dirname
         from subprocess import run
 
-        copy(f'/m/{self.guid}', '/')
+        # Read the media in place on the shared volume, and write the JSON
+        # transcript next to it in the run's workspace. `end` converts it
         self.cmd = [
             'whisper',
             '--model',
             self.model,
+            '--output_format',
+            'json',
             '-o',
-            '/m',
-            f'/{self.guid}',
+            dirname(self.media_path),
+            self.media_path,
         ]
         print('Running:', self.cmd)
         run(self.cmd, check=True)
@@ -76,41 +83,39 @@ class Whisper(FlowSpec):
         self.next(self.end)
 
     @kubernetes(
-        image='ghcr.io/wgbh-mla/mario:pr-2',
+        image='ghcr.io/wgbh-mla/mario:main',
         persistent_volume_claims={
             'media-pvc': '/m',
         },
     )
     @step
     def end(self):
-        """Report results and cleanup"""
-        from glob import glob
-        from os import remove
-        from subprocess import run
+        """Convert the transcript, upload every output, and cleanup"""
+        from os.path import basename, dirname, join, splitext
 
-        from boto3 import client
+        from metaflow import current
 
-        run(['ls', '-al', '/m'])
-        # Hack to remove the extension until we fix the guid list
-        filename = '.'.join(self.guid.split('.')[:-1])
-        s3_path = f'{filename.split(".")[0]}/{self.model}/{filename.split(".")[0]}.json'
+        from mario.log import flow_log
+        from mario.media import release_media
+        from mario.transcripts import postprocess, upload_transcripts
+        from mario.workspace import Workspace
 
-        # Upload transcript to aws
-        print(f'Uploading {filename} to {s3_path}')
-        client = client('s3')
-        client.upload_file(
-            f'/m/{filename}.json',
-            'clams-transcripts',
-            s3_path,
-        )
-        print(f'Successfully processed {self.guid}')
+        log = flow_log(self)
+
+        # Whisper names its outputs after the media file, minus the extension
+        stem = splitext(basename(self.media_path))[0]
+        json_path = join(dirname(self.media_path), f'{stem}.json')
+        outputs = postprocess(json_path, self.media_path)
+
+        keys = upload_transcripts(outputs, 'clams-transcripts', self.guid, self.model)
+        log.info(f'Uploaded {", ".join(sorted(keys.values()))}')
+        log.info(f'Successfully processed {self.guid}')
 
         # delete media file and transcripts
-        cleaned = 0
-        for f in glob(f'/m/{filename}*'):
-            remove(f)
-            cleaned += 1
-        print(f'Cleaned up {cleaned} files')
+        workspace = Workspace(self.guid, f'{current.flow_name}/{current.run_id}')
+        cleaned = workspace.cleanup()
+        release_media(self.asset_id, workspace)
+        log.info(f'Cleaned up {cleaned} files')
 
 
 if __name__ == '__main__':
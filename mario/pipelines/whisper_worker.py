@@ -0,0 +1,107 @@
+from metaflow import FlowSpec, Parameter, kubernetes, secrets, step, trigger
+
+
+@trigger(event='whisper-worker')
+class WhisperWorker(FlowSpec):
+    """Run a transcript through a persistent Whisper worker
+
+    Like `Whisper`, but the transcription is queued for the workers of
+    `mario.transcribe`, which keep their models loaded, so no step holds a GPU.
+    """
+
+    guid = Parameter('guid', help='GUID of the transcript to process')
+    model = Parameter('model', help='Whisper model to use', default='base')
+
+    @secrets(sources=['CLAMS-SonyCi-API', 'CLAMS-chowda-secret'])
+    @kubernetes(
+        image='ghcr.io/wgbh-mla/mario:main',
+        persistent_volume_claims={'media-pvc': '/m'},
+    )
+    @step
+    def start(self):
+        """Download the media file"""
+        from chowda.db import engine
+        from chowda.models import SonyCiAsset
+        from metaflow import current
+        from sqlmodel import Session, select
+
+        from mario.ci import proxy_checksum, sonyci
+        from mario.log import flow_log
+        from mario.media import fetch_media
+        from mario.workspace import Workspace
+
+        log = flow_log(self)
+
+        # get SonyCi Asset ID
+        with Session(engine) as db:
+            self.asset_id = (
+                db.exec(select(SonyCiAsset).where(SonyCiAsset.name == self.guid))
+                .one()
+                .id
+            )
+        assert self.asset_id, f'No asset found for {self.guid}'
+        log.info(f'Found asset {self.asset_id}')
+        self.asset = sonyci().get(self.asset_id)
+
+        url = self.asset['proxyUrl']
+        workspace = Workspace(self.guid, f'{current.flow_name}/{current.run_id}')
+        log.info(f'Downloading file to {workspace.path}')
+        self.media_path, _ = fetch_media(
+            self.asset_id, url, workspace, self.guid, proxy_checksum(self.asset)
+        )
+        log.info('Downloaded file')
+
+        self.next(self.transcribe)
+
+    @kubernetes(image='ghcr.io/wgbh-mla/mario:main')
+    @step
+    def transcribe(self):
+        """Queue the transcription and wait for a worker to finish it
+
+        The worker reads the media and writes its outputs on the shared volume.
+        """
+        from mario.log import flow_log
+        from mario.transcribe import enqueue, wait
+
+        log = flow_log(self)
+        job = enqueue(self.media_path, self.model)
+        log.info(f'Submitted transcription job {job.id}')
+        result = wait(job)
+        self.timings, self.outputs = result['timings'], result['outputs']
+        log.info(f'Transcribed: {self.timings}')
+
+        self.next(self.end)
+
+    @kubernetes(
+        image='ghcr.io/wgbh-mla/mario:main',
+        persistent_volume_claims={
+            'media-pvc': '/m',
+        },
+    )
+    @step
+    def end(self):
+        """Upload every output, and cleanup"""
+        from metaflow import current
+
+        from mario.log import flow_log
+        from mario.media import release_media
+        from mario.transcripts import upload_transcripts
+        from mario.workspace import Workspace
+
+        log = flow_log(self)
+
+        keys = upload_transcripts(
+            self.outputs, 'clams-transcripts', self.guid, self.model
+        )
+        log.info(f'Uploaded {", ".join(sorted(keys.values()))}')
+        log.info(f'Successfully processed {self.guid}')
+
+        # delete media file and transcripts
+        workspace = Workspace(self.guid, f'{current.flow_name}/{current.run_id}')
+        cleaned = workspace.cleanup()
+        release_media(self.asset_id, workspace)
+        log.info(f'Cleaned up {cleaned} files')
+
+
+if __name__ == '__main__':
+    WhisperWorker()
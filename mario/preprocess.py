@@ -0,0 +1,202 @@
+"""Reduced media proxies for CLAMS apps that do not need the full video
+
+Apps in a pipeline spec can declare what they `need`: `audio` (16 kHz mono
+audio, as Whisper uses), `frames` (the video at a low frame rate, as
+barsdetection uses), or `video`. A single ffmpeg run writes every proxy
+that is needed from the streams the media has, each proxy is added to the
+mmif as an extra document, and each app is sent an mmif with only the
+documents it needs. The proxies are on the same timeline as the original, so
+annotations line up.
+"""
+
+from dataclasses import dataclass
+from os.path import getsize, splitext
+from subprocess import run
+from time import perf_counter
+from typing import Dict, Iterable, List, Set, Tuple
+
+from mario.config import PREPROCESS_FPS
+from mario.log import log
+
+AUDIO_DOCUMENT = 'http://mmif.clams.ai/vocabulary/AudioDocument/v1'
+VIDEO_DOCUMENT = 'http://mmif.clams.ai/vocabulary/VideoDocument/v1'
+
+
+@dataclass
+class Proxy:
+    """How to make one kind of proxy"""
+
+    suffix: str
+    mime: str
+    type: str
+    stream: str
+    args: Tuple[str, ...]
+
+
+PROXIES = {
+    'audio': Proxy(
+        '.16k.wav',
+        'audio/wav',
+        AUDIO_DOCUMENT,
+        'audio',
+        ('-map', '0:a:0', '-vn', '-ac', '1', '-ar', '16000', '-c:a', 'pcm_s16le'),
+    ),
+    'frames': Proxy(
+        f'.{PREPROCESS_FPS:g}fps.mp4',
+        'video/mp4',
+        VIDEO_DOCUMENT,
+        'video',
+        (
+            '-map',
+            '0:v:0',
+            '-an',
+            '-vf',
+            f'fps={PREPROCESS_FPS}',
+            '-c:v',
+            'libx264',
+            '-preset',
+            'veryfast',
+            '-crf',
+            '28',
+        ),
+    ),
+}
+
+
+def streams(media_path: str) -> Set[str]:
+    """The kinds of stream in `media_path`, e.g. {'audio', 'video'}"""
+    cmd = [
+        'ffprobe',
+        '-v',
+        'error',
+        '-show_entries',
+        'stream=codec_type',
+        '-of',
+        'csv=p=0',
+        media_path,
+    ]
+    output = run(cmd, check=True, capture_output=True, text=True).stdout
+    return {line.strip() for line in output.splitlines() if line.strip()}
+
+
+def proxy_names(name: str) -> List[str]:
+    """Names of every proxy `make_proxies` can write for the media file `name`"""
+    stem = splitext(name)[0]
+    return [stem + proxy.suffix for proxy in PROXIES.values()]
+
+
+def make_proxies(media_path: str, needs: Iterable[str]) -> Dict[str, Dict]:
+    """Write the proxies in `needs` next to `media_path` with one ffmpeg run
+
+    `video` needs no proxy, and unknown needs are ignored. Proxies of a
+    stream the media does not have, e.g. audio of a silent video, are
+    skipped, and apps that need them are sent the original.
+
+    Returns:
+        {need: {path, bytes, seconds}}, where seconds is the whole ffmpeg run
+    """
+    needs = sorted(need for need in set(needs) if need in PROXIES)
+    if not needs:
+        return {}
+    found = streams(media_path)
+    missing = [need for need in needs if PROXIES[need].stream not in found]
+    if missing:
+        log.warning(f'No stream for {", ".join(missing)} proxies in {media_path}')
+        needs = [need for need in needs if need not in missing]
+        if not needs:
+            return {}
+    stem = splitext(media_path)[0]
+    cmd = ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-i', media_path]
+    paths = {}
+    for need in needs:
+        paths[need] = stem + PROXIES[need].suffix
+        cmd += [*PROXIES[need].args, paths[need]]
+    started = perf_counter()
+    run(cmd, check=True)
+    seconds = perf_counter() - started
+    log.info(f'Made {", ".join(needs)} proxies of {media_path} in {seconds:.1f}s')
+    return {
+        need: {'path': path, 'bytes': getsize(path), 'seconds': seconds}
+        for need, path in paths.items()
+    }
+
+
+def proxy_stats(
+    media_path: str, proxies: Dict[str, Dict], needs: Iterable[Iterable[str]]
+) -> Dict:
+    """Sizes of the media and its proxies, and the bytes apps no longer read
+
+    Args:
+        media_path: The original media file
+        proxies: The proxies made of it, see `make_proxies`
+        needs: What each app of the pipeline needs
+    """
+    source = getsize(media_path)
+    saved = 0
+    for app_needs in needs:
+        reads = [proxies[need]['bytes'] for need in app_needs if need in proxies]
+        # Apps that need the video still read the original
+        if reads and 'video' not in app_needs:
+            saved += source - sum(reads)
+    return {
+        'source_bytes': source,
+        'proxy_bytes': {need: proxy['bytes'] for need, proxy in proxies.items()},
+        'bytes_saved': saved,
+    }
+
+
+def add_documents(mmif: dict, proxies: Dict[str, Dict]) -> Dict[str, str]:
+    """Add each proxy to the mmif as a document. Returns {need: document id}"""
+    documents = mmif.setdefault('documents', [])
+    ids = {document['properties']['id'] for document in documents}
+    added = {}
+    for need, proxy in proxies.items():
+        n = len(ids) + 1
+        while f'd{n}' in ids:
+            n += 1
+        ids.add(f'd{n}')
+        documents.append(
+            {
+                '@type': PROXIES[need].type,
+                'properties': {
+                    'id': f'd{n}',
+                    'mime': PROXIES[need].mime,
+                    'location': f'file://{proxy["path"]}',
+                },
+            }
+        )
+        added[need] = f'd{n}'
+    return added
+
+
+def documents_for(mmif: dict, needs: Iterable[str], proxies: Dict[str, str]) -> dict:
+    """The mmif as an app that `needs` these inputs should see it
+
+    Proxy documents the app does not need are hidden, and the original video
+    is hidden if a proxy replaces it. Apps that declare no needs see the
+    mmif without any proxies.
+
+    Args:
+        mmif: The full mmif
+        needs: What the app needs
+        proxies: {need: document id} of the proxy documents
+    """
+    if not proxies:
+        return mmif
+    keep = {proxies[need] for need in needs if need in proxies}
+    drop = set(proxies.values()) - keep
+    if keep and 'video' not in needs:
+        drop |= {
+            document['properties']['id']
+            for document in mmif.get('documents', [])
+            if document.get('@type') == VIDEO_DOCUMENT
+            and document['properties']['id'] not in keep
+        }
+    if not drop:
+        return mmif
+    documents: List[dict] = [
+        document
+        for document in mmif.get('documents', [])
+        if document['properties']['id'] not in drop
+    ]
+    return {**mmif, 'documents': documents}
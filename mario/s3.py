@@ -0,0 +1,133 @@
+"""Shared S3 client and tuned transfers
+
+One client is shared by every upload and download in a process, with a
+connection pool large enough for concurrent multipart transfers. Uploads
+use a `TransferConfig` tuned from the environment, can be sent straight
+from memory, and many objects can be uploaded at once with `upload_many`.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from io import BytesIO
+from os.path import getsize
+from typing import IO, Dict, Iterable, List, Optional, Tuple
+
+from mario.config import (
+    S3_MAX_CONCURRENCY,
+    S3_MAX_POOL,
+    S3_MULTIPART_CHUNKSIZE,
+    S3_MULTIPART_THRESHOLD,
+    S3_UPLOAD_WORKERS,
+)
+from mario.log import log
+
+
+@lru_cache(maxsize=None)
+def s3():
+    """The shared S3 client for this process"""
+    from boto3 import client
+    from botocore.config import Config
+
+    return client(
+        's3',
+        config=Config(
+            max_pool_connections=S3_MAX_POOL,
+            retries={'max_attempts': 5, 'mode': 'adaptive'},
+        ),
+    )
+
+
+def transfer_config(
+    threshold: int = S3_MULTIPART_THRESHOLD,
+    chunksize: int = S3_MULTIPART_CHUNKSIZE,
+    concurrency: int = S3_MAX_CONCURRENCY,
+):
+    """A TransferConfig for multipart uploads of `chunksize` parts"""
+    from boto3.s3.transfer import TransferConfig
+
+    return TransferConfig(
+        multipart_threshold=threshold,
+        multipart_chunksize=chunksize,
+        max_concurrency=concurrency,
+        use_threads=concurrency > 1,
+    )
+
+
+def parse_url(url: str) -> Tuple[str, str]:
+    """(bucket, key) of an `s3://bucket/key` url"""
+    bucket, _, key = url[len('s3://') :].partition('/')
+    return bucket, key
+
+
+def upload_fileobj(
+    f: IO[bytes],
+    bucket: str,
+    key: str,
+    extra: Optional[Dict] = None,
+    client=None,
+    config=None,
+) -> None:
+    """Upload a binary file object, in parallel parts if it is large"""
+    (client or s3()).upload_fileobj(
+        f, bucket, key, ExtraArgs=extra, Config=config or transfer_config()
+    )
+
+
+def upload_bytes(
+    data: bytes, bucket: str, key: str, extra: Optional[Dict] = None, **kwargs
+) -> int:
+    """Upload `data` from memory, without a temporary file. Returns its size"""
+    upload_fileobj(BytesIO(data), bucket, key, extra, **kwargs)
+    return len(data)
+
+
+def upload_file(
+    path: str, bucket: str, key: str, extra: Optional[Dict] = None, **kwargs
+) -> int:
+    """Upload a local file. Returns its size"""
+    with open(path, 'rb') as f:
+        upload_fileobj(f, bucket, key, extra, **kwargs)
+    return getsize(path)
+
+
+@dataclass
+class Upload:
+    """One object for `upload_many`, from `data` in memory or a local `path`"""
+
+    bucket: str
+    key: str
+    data: Optional[bytes] = None
+    path: Optional[str] = None
+    extra: Dict = field(default_factory=dict)
+
+    def send(self, **kwargs) -> int:
+        if self.data is not None:
+            return upload_bytes(self.data, self.bucket, self.key, self.extra, **kwargs)
+        return upload_file(self.path, self.bucket, self.key, self.extra, **kwargs)
+
+
+def upload_many(
+    uploads: Iterable[Upload], workers: int = S3_UPLOAD_WORKERS, **kwargs
+) -> List[int]:
+    """Upload many objects concurrently. Returns their sizes, in order
+
+    Every upload is attempted. If any fail, the first error is raised after
+    the rest have finished.
+    """
+    uploads = list(uploads)
+
+    def send(upload: Upload):
+        try:
+            return upload.send(**kwargs)
+        except Exception as e:
+            log.error(f'Failed to upload s3://{upload.bucket}/{upload.key}: {e}')
+            return e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(uploads)))) as pool:
+        results = list(pool.map(send, uploads))
+    for result in results:
+        if isinstance(result, Exception):
+            raise result
+    log.debug(f'Uploaded {len(uploads)} objects, {sum(results)} bytes')
+    return results
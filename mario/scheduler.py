@@ -0,0 +1,259 @@
+"""Adaptive admission control for CLAMS app requests
+
+Every worker that calls an app takes a lease from a Redis sorted set for
+that app before sending a request, so the app sees at most `limit` requests
+at once across the whole cluster. The limit adapts AIMD style: it grows by
+about one per round of successful requests, and is multiplied by `decrease`
+when a request fails or is slower than the latency target.
+
+Leases are renewed while held and expire if a worker dies, so a crashed pod
+cannot hold a slot forever. If Redis is unreachable, requests are let
+through without admission control, and Redis is tried again after a delay
+that doubles with each consecutive failure.
+"""
+
+from contextlib import contextmanager
+from functools import lru_cache
+from random import uniform
+from threading import Event, Thread
+from time import monotonic, sleep, time
+from typing import Iterator, Optional
+from uuid import uuid4
+
+from mario.checkpoint import slug
+from mario.config import (
+    APP_ADMISSION_TIMEOUT,
+    APP_CONCURRENCY_MAX,
+    APP_CONCURRENCY_MIN,
+    APP_CONCURRENCY_START,
+    APP_DECREASE_COOLDOWN,
+    APP_LATENCY_TARGET,
+    APP_LEASE_TTL,
+    APP_SCHEDULER,
+    REDIS_URL,
+)
+from mario.log import log
+from mario.utils import AdmissionError
+
+
+class Lease:
+    """A slot held for one request to an app
+
+    Call `failed` if the request did not succeed without raising, e.g. on an
+    error status, so the scheduler backs off.
+    """
+
+    def __init__(self, app: str, id: Optional[str] = None, waited: float = 0.0):
+        self.app = app
+        self.id = id
+        self.waited = waited
+        self.ok = True
+        self.started = monotonic()
+
+    def failed(self) -> None:
+        self.ok = False
+
+
+class Scheduler:
+    """Cluster-wide adaptive concurrency limits per app
+
+    Args:
+        connection: Redis connection, or None to let every request through
+        prefix: Prefix for the Redis keys
+        retry: Seconds to wait before using Redis again after it fails,
+            doubled for each consecutive failure up to `retry_max`
+    """
+
+    def __init__(
+        self,
+        connection=None,
+        prefix: str = 'mario:apps',
+        start: float = APP_CONCURRENCY_START,
+        minimum: float = APP_CONCURRENCY_MIN,
+        maximum: float = APP_CONCURRENCY_MAX,
+        decrease: float = 0.5,
+        target: float = APP_LATENCY_TARGET,
+        cooldown: float = APP_DECREASE_COOLDOWN,
+        lease_ttl: float = APP_LEASE_TTL,
+        retry: float = 5.0,
+        retry_max: float = 5 * 60.0,
+    ):
+        self.connection = connection
+        self.prefix = prefix
+        self.start = start
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.target = target
+        self.cooldown = cooldown
+        self.lease_ttl = lease_ttl
+        self.retry = retry
+        self.retry_max = retry_max
+        self.failures = 0
+        self.down_until = 0.0
+
+    def available(self) -> bool:
+        """Whether to use Redis, i.e. it is configured and not backing off"""
+        return self.connection is not None and monotonic() >= self.down_until
+
+    def down(self, error: Exception) -> None:
+        """Let requests through without Redis until the backoff elapses"""
+        self.failures += 1
+        delay = min(self.retry_max, self.retry * 2 ** (self.failures - 1))
+        self.down_until = monotonic() + delay
+        log.warning(
+            f'Admission control unavailable, continuing without it '
+            f'for {delay:.0f}s: {error}'
+        )
+
+    def keys(self, app: str):
+        """Redis keys for the leases and the limit state of `app`"""
+        return f'{self.prefix}:{slug(app)}:leases', f'{self.prefix}:{slug(app)}:state'
+
+    def limit(self, app: str) -> float:
+        """The current concurrency limit for `app`"""
+        limit = self.connection.hget(self.keys(app)[1], 'limit')
+        return float(limit) if limit is not None else self.start
+
+    def in_flight(self, app: str) -> int:
+        leases, _ = self.keys(app)
+        return self.connection.zcount(leases, time(), '+inf')
+
+    def try_acquire(self, app: str) -> Optional[str]:
+        """Take a lease if `app` is under its limit. Returns the lease id"""
+        from redis.exceptions import WatchError
+
+        leases, state = self.keys(app)
+        # Drop leases that were not renewed, e.g. of crashed workers
+        self.connection.zremrangebyscore(leases, '-inf', time())
+        with self.connection.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(leases, state)
+                    limit = pipe.hget(state, 'limit')
+                    limit = float(limit) if limit is not None else self.start
+                    if pipe.zcard(leases) >= int(limit):
+                        pipe.unwatch()
+                        return None
+                    lease = uuid4().hex
+                    pipe.multi()
+                    pipe.zadd(leases, {lease: time() + self.lease_ttl})
+                    pipe.execute()
+                    return lease
+                except WatchError:
+                    continue
+
+    def acquire(self, app: str, timeout: float = APP_ADMISSION_TIMEOUT) -> str:
+        """Wait for a lease on `app`
+
+        Raises:
+            AdmissionError: if no slot is free within `timeout` seconds
+        """
+        deadline = monotonic() + timeout
+        delay = 0.05
+        while True:
+            lease = self.try_acquire(app)
+            if lease is not None:
+                return lease
+            if monotonic() >= deadline:
+                raise AdmissionError(f'No free slot for {app} after {timeout}s')
+            sleep(uniform(0, delay))
+            delay = min(delay * 2, 2.0)
+
+    def renew(self, app: str, lease: str) -> None:
+        leases, _ = self.keys(app)
+        self.connection.zadd(leases, {lease: time() + self.lease_ttl}, xx=True)
+
+    def release(self, app: str, lease: str, seconds: float, ok: bool) -> float:
+        """Return a lease, and adapt the limit to how the request went
+
+        Returns the new limit.
+        """
+        from redis.exceptions import WatchError
+
+        leases, state = self.keys(app)
+        self.connection.zrem(leases, lease)
+        overloaded = not ok or bool(self.target and seconds > self.target)
+        with self.connection.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(state)
+                    values = {
+                        key.decode() if isinstance(key, bytes) else key: value
+                        for key, value in pipe.hgetall(state).items()
+                    }
+                    limit = float(values.get('limit', self.start))
+                    decreased = float(values.get('decreased', 0))
+                    now = time()
+                    if not overloaded:
+                        limit = min(self.maximum, limit + 1 / limit)
+                    elif now - decreased >= self.cooldown:
+                        limit = max(self.minimum, limit * self.decrease)
+                        decreased = now
+                        log.info(f'Backing off {app} to {limit:.1f} concurrent')
+                    pipe.multi()
+                    pipe.hset(state, mapping={'limit': limit, 'decreased': decreased})
+                    pipe.execute()
+                    return limit
+                except WatchError:
+                    continue
+
+    @contextmanager
+    def slot(self, app: str) -> Iterator[Lease]:
+        """Hold a lease on `app` for the duration of a request
+
+        Renews the lease in the background while it is held. An exception
+        in the block counts as a failed request.
+        """
+        if not self.available():
+            yield Lease(app)
+            return
+        from redis.exceptions import RedisError
+
+        started = monotonic()
+        try:
+            lease = Lease(app, self.acquire(app), monotonic() - started)
+        except RedisError as e:
+            self.down(e)
+            yield Lease(app)
+            return
+        if self.failures:
+            log.info('Admission control restored')
+            self.failures = 0
+
+        stop = Event()
+
+        def heartbeat():
+            while not stop.wait(self.lease_ttl / 3):
+                try:
+                    self.renew(app, lease.id)
+                except RedisError as e:
+                    log.warning(f'Failed to renew lease on {app}: {e}')
+
+        Thread(target=heartbeat, daemon=True).start()
+        try:
+            yield lease
+        except BaseException:
+            lease.failed()
+            raise
+        finally:
+            stop.set()
+            try:
+                self.release(app, lease.id, monotonic() - lease.started, lease.ok)
+            except RedisError as e:
+                log.warning(f'Failed to release lease on {app}: {e}')
+
+
+@lru_cache(maxsize=None)
+def scheduler() -> Scheduler:
+    """The shared scheduler for this process"""
+    if not APP_SCHEDULER:
+        return Scheduler()
+    try:
+        from redis import Redis
+    except ImportError:
+        log.warning('redis is not installed, running without admission control')
+        return Scheduler()
+    return Scheduler(
+        Redis.from_url(REDIS_URL, socket_connect_timeout=2, socket_timeout=10)
+    )
@@ -0,0 +1,196 @@
+"""Cached Auth0 client-credentials tokens with proactive refresh
+
+`TokenProvider` fetches a token once and hands out the cached copy until
+shortly before it expires. Started in the background, it refreshes ahead of
+expiry with jitter, so many processes do not all refresh at once, and calls
+`on_refresh` with each new token, e.g. `patch_secret` to publish it for
+argo-events.
+"""
+
+from dataclasses import dataclass, field
+from random import uniform
+from threading import Event, RLock, Thread
+from time import time
+from typing import Callable, Optional
+
+from mario.config import (
+    API_AUDIENCE,
+    AUTH0_DOMAIN,
+    CLIENT_ID,
+    CLIENT_SECRET,
+    TOKEN_REFRESH_JITTER,
+    TOKEN_REFRESH_MARGIN,
+    TOKEN_SECRET_NAME,
+    TOKEN_SECRET_NAMESPACE,
+)
+from mario.log import log
+from mario.utils import TokenError
+
+
+@dataclass
+class Token:
+    """An access token and when it expires, in epoch seconds"""
+
+    # Left out of the repr, so logging a Token does not leak it
+    access_token: str = field(repr=False)
+    expires_at: float
+    token_type: str = 'Bearer'
+
+    @property
+    def header(self) -> str:
+        """The Authorization header value"""
+        return f'{self.token_type} {self.access_token}'
+
+    def expires_in(self) -> float:
+        return self.expires_at - time()
+
+
+def token_url(domain: str) -> str:
+    """The token endpoint for an Auth0 domain, or `domain` if already a url"""
+    if domain.startswith(('http://', 'https://')):
+        return domain
+    return f'https://{domain}/oauth/token'
+
+
+class TokenProvider:
+    """Client-credentials tokens, cached until shortly before they expire
+
+    Args:
+        url: Auth0 domain or token endpoint
+        margin: Refresh this many seconds before the token expires
+        jitter: Refresh up to this many seconds earlier still, at random
+        on_refresh: Called with each newly fetched token
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = AUTH0_DOMAIN,
+        client_id: Optional[str] = CLIENT_ID,
+        client_secret: Optional[str] = CLIENT_SECRET,
+        audience: Optional[str] = API_AUDIENCE,
+        margin: float = TOKEN_REFRESH_MARGIN,
+        jitter: float = TOKEN_REFRESH_JITTER,
+        on_refresh: Optional[Callable[[Token], None]] = None,
+    ):
+        if not url:
+            raise TokenError('AUTH0_DOMAIN is not set')
+        self.url = token_url(url)
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.audience = audience
+        self.margin = margin
+        self.jitter = jitter
+        self.on_refresh = on_refresh
+        self.cached: Optional[Token] = None
+        self.lock = RLock()
+        self.stopped = Event()
+        self.refreshes = 0
+
+    def fetch(self) -> Token:
+        """Fetch a new token from the token endpoint"""
+        from mario.client import client
+
+        response = client().post(
+            self.url,
+            data={
+                'grant_type': 'client_credentials',
+                'client_id': self.client_id,
+                'client_secret': self.client_secret,
+                'audience': self.audience,
+            },
+        )
+        if response.status_code != 200:
+            raise TokenError(
+                f'Token endpoint returned {response.status_code}: {response.text}'
+            )
+        data = response.json()
+        return Token(
+            data['access_token'],
+            time() + float(data.get('expires_in', 3600)),
+            data.get('token_type', 'Bearer'),
+        )
+
+    def fresh(self, token: Optional[Token]) -> bool:
+        return token is not None and token.expires_in() > self.margin
+
+    def refresh(self) -> Token:
+        """Fetch a new token now, and pass it to `on_refresh`"""
+        with self.lock:
+            token = self.fetch()
+            self.cached = token
+            self.refreshes += 1
+        log.info(f'Refreshed token, expires in {token.expires_in():.0f}s')
+        if self.on_refresh is not None:
+            self.on_refresh(token)
+        return token
+
+    def token(self) -> Token:
+        """The cached token, refreshed first if it is close to expiring"""
+        token = self.cached
+        if self.fresh(token):
+            return token
+        with self.lock:
+            # Another thread may have refreshed while we waited
+            if self.fresh(self.cached):
+                return self.cached
+            return self.refresh()
+
+    def next_refresh(self) -> float:
+        """Seconds until the background refresh should run"""
+        if self.cached is None:
+            return 0.0
+        due = self.cached.expires_in() - self.margin - uniform(0, self.jitter)
+        return max(0.0, due)
+
+    def run(self) -> None:
+        """Keep the token fresh until `stop` is called"""
+        failures = 0
+        while not self.stopped.wait(self.next_refresh() if not failures else 0):
+            try:
+                self.refresh()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                retry = min(60.0, 2.0**failures) + uniform(0, 1)
+                log.warning(f'Token refresh failed ({e}), retrying in {retry:.0f}s')
+                if self.stopped.wait(retry):
+                    break
+
+    def start(self) -> Thread:
+        """Refresh the token in a background thread"""
+        self.stopped.clear()
+        thread = Thread(target=self.run, name='token-refresh', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+
+def kubernetes_api(host: Optional[str] = None):
+    """A CoreV1Api, configured from the cluster, kubeconfig, or `host`"""
+    from kubernetes import client, config
+
+    if host:
+        configuration = client.Configuration()
+        configuration.host = host
+        return client.CoreV1Api(client.ApiClient(configuration))
+    try:
+        config.load_incluster_config()
+    except config.ConfigException:
+        config.load_kube_config()
+    return client.CoreV1Api()
+
+
+def patch_secret(
+    token: Token,
+    namespace: str = TOKEN_SECRET_NAMESPACE,
+    name: str = TOKEN_SECRET_NAME,
+    api=None,
+) -> None:
+    """Write the token's Authorization header to a Kubernetes secret"""
+    api = api or kubernetes_api()
+    api.patch_namespaced_secret(
+        name, namespace, {'stringData': {'token': token.header}}
+    )
+    log.info(f'Updated secret {namespace}/{name}')
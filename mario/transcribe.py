@@ -0,0 +1,167 @@
+"""Persistent Whisper transcription worker
+
+Whisper models are loaded once per worker process and kept resident, so a
+worker can transcribe many files without paying model start-up for each one.
+Start a worker on the media volume with the models mounted. It must be a
+SimpleWorker, since the default worker forks a fresh process for every job:
+
+    pip install .[whisper]
+    WHISPER_DEVICE=cuda rq worker -w rq.worker.SimpleWorker -u redis://redis/0 whisper
+
+The Docker image's default worker neither listens on this queue nor has
+whisper installed. Submit jobs with `enqueue`, or run the `WhisperWorker`
+flow. For tests, `WHISPER_BACKEND=stub` replaces the model with a stand-in
+that needs neither torch nor a GPU, or use the `tiny` model with
+`WHISPER_DEVICE=cpu`.
+"""
+
+from json import dump
+from os import makedirs
+from os.path import basename, dirname, getsize, join, splitext
+from threading import Lock
+from time import monotonic, perf_counter, sleep
+from typing import Dict, Optional, Tuple
+
+from mario.config import (
+    REDIS_URL,
+    WHISPER_BACKEND,
+    WHISPER_DEVICE,
+    WHISPER_JOB_TIMEOUT,
+    WHISPER_QUEUE,
+)
+from mario.log import log
+
+# Models loaded in this process, by name
+models: Dict[str, object] = {}
+models_lock = Lock()
+
+
+class StubModel:
+    """Model stand-in that returns a fixed-shape transcript without inference
+
+    Segment count scales with the size of the input file, so downstream
+    stages see realistic amounts of output.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def transcribe(self, path: str, **kwargs) -> dict:
+        segments = [
+            {
+                'id': i,
+                'start': i * 5.0,
+                'end': i * 5.0 + 4.5,
+                'text': f' Segment {i} of {basename(path)}.',
+            }
+            for i in range(max(1, getsize(path) // (1024 * 1024)))
+        ]
+        return {
+            'text': ''.join(s['text'] for s in segments),
+            'segments': segments,
+            'language': 'en',
+        }
+
+
+def load_model(name: str) -> Tuple[object, float]:
+    """The loaded model `name`, and the seconds spent loading it (0 if cached)"""
+    with models_lock:
+        if name in models:
+            return models[name], 0.0
+        started = perf_counter()
+        if WHISPER_BACKEND == 'stub':
+            model = StubModel(name)
+        else:
+            import whisper
+
+            model = whisper.load_model(name, device=WHISPER_DEVICE)
+        models[name] = model
+        seconds = perf_counter() - started
+        log.info(f'Loaded whisper model {name} in {seconds:.1f}s')
+        return model, seconds
+
+
+def write_outputs(result: dict, media_path: str, output_dir: str) -> Dict[str, str]:
+    """Write the JSON transcript, its caption formats and an mmif of it
+
+    Returns {ext: path}. See `mario.transcripts.convert`.
+    """
+    from mario.transcripts import convert
+
+    makedirs(output_dir, exist_ok=True)
+    stem = splitext(basename(media_path))[0]
+    outputs = {'json': join(output_dir, f'{stem}.json')}
+    with open(outputs['json'], 'w') as f:
+        dump(result, f)
+    outputs.update(convert(result, output_dir, stem, media_path))
+    return outputs
+
+
+def transcribe(
+    media_path: str, model: str = 'base', output_dir: Optional[str] = None
+) -> dict:
+    """Transcribe `media_path` with a resident model. Runs in the worker
+
+    Returns:
+        The output paths, and the model load vs inference time for this job
+    """
+    started = monotonic()
+    whisper_model, load_seconds = load_model(model)
+    inference_started = perf_counter()
+    result = whisper_model.transcribe(media_path)
+    inference_seconds = perf_counter() - inference_started
+    outputs = write_outputs(result, media_path, output_dir or dirname(media_path))
+    timings = {
+        'model_load': load_seconds,
+        'inference': inference_seconds,
+        'total': monotonic() - started,
+    }
+    log.info(f'Transcribed {media_path} with {model}: {timings}')
+    return {
+        'media_path': media_path,
+        'model': model,
+        'outputs': outputs,
+        'timings': timings,
+    }
+
+
+def queue(name: str = WHISPER_QUEUE, connection=None):
+    """The rq queue whisper workers listen on"""
+    from redis import Redis
+    from rq import Queue
+
+    return Queue(name, connection=connection or Redis.from_url(REDIS_URL))
+
+
+def enqueue(
+    media_path: str,
+    model: str = 'base',
+    output_dir: Optional[str] = None,
+    connection=None,
+):
+    """Submit a transcription job. Returns the rq Job"""
+    return queue(connection=connection).enqueue(
+        transcribe,
+        media_path,
+        model,
+        output_dir,
+        job_timeout=WHISPER_JOB_TIMEOUT,
+        result_ttl=24 * 60 * 60,
+    )
+
+
+def wait(job, timeout: float = WHISPER_JOB_TIMEOUT, poll: float = 5) -> dict:
+    """Wait for a job to finish and return its result
+
+    Raises:
+        RuntimeError: if the job fails, or does not finish within `timeout`
+    """
+    deadline = monotonic() + timeout
+    while monotonic() < deadline:
+        status = job.get_status(refresh=True)
+        if status == 'finished':
+            return job.return_value()
+        if status in ('failed', 'stopped', 'canceled'):
+            raise RuntimeError(f'Transcription job {job.id} {status}: {job.exc_info}')
+        sleep(poll)
+    raise RuntimeError(f'Transcription job {job.id} timed out after {timeout}s')
@@ -0,0 +1,250 @@
+"""Whisper transcript post-processing
+
+A Whisper result is converted in one pass over its segments into an mmif
+with a view of TimeFrames aligned to TextDocuments, and every caption
+format we publish. All outputs are then uploaded at once under consistent
+keys, `<guid>/<model>/<guid>.<ext>`.
+"""
+
+from contextlib import ExitStack
+from datetime import datetime
+from os import makedirs
+from os.path import basename, dirname, join, splitext
+from typing import Callable, Dict, Iterable, Optional
+
+from mario.log import log
+
+TEXT_DOCUMENT = 'http://mmif.clams.ai/vocabulary/TextDocument/v1'
+TIME_FRAME = 'http://mmif.clams.ai/vocabulary/TimeFrame/v2'
+ALIGNMENT = 'http://mmif.clams.ai/vocabulary/Alignment/v1'
+VIDEO_DOCUMENT = 'http://mmif.clams.ai/vocabulary/VideoDocument/v1'
+WHISPER_APP = 'http://apps.clams.ai/whisper-wrapper/mario'
+
+# Caption formats, in the order the whisper CLI writes them
+FORMATS = ('txt', 'vtt', 'srt', 'tsv')
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'mmif': 'application/json',
+    'txt': 'text/plain',
+    'vtt': 'text/vtt',
+    'srt': 'application/x-subrip',
+    'tsv': 'text/tab-separated-values',
+}
+
+# Extensions of media file names that flows may be given in place of a GUID
+MEDIA_EXTENSIONS = (
+    '.mp4',
+    '.m4v',
+    '.mov',
+    '.mkv',
+    '.mpg',
+    '.mxf',
+    '.h264',
+    '.wav',
+    '.mp3',
+    '.m4a',
+)
+
+
+def timestamp(seconds: float, decimal: str = '.') -> str:
+    """`HH:MM:SS.mmm`, with `decimal` before the milliseconds"""
+    ms = round(seconds * 1000)
+    hours, ms = divmod(ms, 3_600_000)
+    minutes, ms = divmod(ms, 60_000)
+    seconds, ms = divmod(ms, 1000)
+    return f'{hours:02d}:{minutes:02d}:{seconds:02d}{decimal}{ms:03d}'
+
+
+HEADERS = {'vtt': 'WEBVTT\n\n', 'tsv': 'start\tend\ttext\n'}
+
+# Lines of each format for segment (index, start, end, text)
+LINES: Dict[str, Callable[[int, float, float, str], str]] = {
+    'txt': lambda i, start, end, text: f'{text}\n',
+    'vtt': lambda i, start, end, text: (
+        f'{timestamp(start)} --> {timestamp(end)}\n{text}\n\n'
+    ),
+    'srt': lambda i, start, end, text: (
+        f'{i + 1}\n{timestamp(start, ",")} --> {timestamp(end, ",")}\n{text}\n\n'
+    ),
+    'tsv': lambda i, start, end, text: (
+        f'{round(start * 1000)}\t{round(end * 1000)}\t{text}\n'
+    ),
+}
+
+
+def load_transcript(path: str) -> dict:
+    """Parse a Whisper JSON transcript"""
+    from mario.mmif import loads
+
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def segment_annotations(i: int, start: float, end: float, text: str) -> list:
+    """A TimeFrame, its TextDocument, and the Alignment between them"""
+    return [
+        {
+            '@type': TIME_FRAME,
+            'properties': {
+                'id': f'tf_{i}',
+                'start': round(start * 1000),
+                'end': round(end * 1000),
+                'frameType': 'speech',
+            },
+        },
+        {
+            '@type': TEXT_DOCUMENT,
+            'properties': {'id': f'td_{i + 1}', 'text': {'@value': text}},
+        },
+        {
+            '@type': ALIGNMENT,
+            'properties': {
+                'id': f'al_{i}',
+                'source': f'tf_{i}',
+                'target': f'td_{i + 1}',
+            },
+        },
+    ]
+
+
+def transcript_mmif(
+    annotations: list, text: str, media_path: Optional[str], language: str
+) -> dict:
+    """An mmif of the media file with one view of the transcript
+
+    Without a `media_path`, the mmif has no documents, and its TimeFrames
+    refer to none.
+    """
+    full = {
+        '@type': TEXT_DOCUMENT,
+        'properties': {'id': 'td_0', 'text': {'@value': text, '@language': language}},
+    }
+    documents = []
+    time_frames = {'timeUnit': 'milliseconds'}
+    if media_path:
+        documents.append(
+            {
+                '@type': VIDEO_DOCUMENT,
+                'properties': {
+                    'id': 'd1',
+                    'mime': 'video/mp4',
+                    'location': f'file://{media_path}',
+                },
+            }
+        )
+        time_frames['document'] = documents[0]['properties']['id']
+    return {
+        'metadata': {'mmif': 'http://mmif.clams.ai/1.0.0'},
+        'documents': documents,
+        'views': [
+            {
+                'id': 'v_0',
+                'metadata': {
+                    'app': WHISPER_APP,
+                    'timestamp': datetime.now().isoformat(),
+                    'contains': {
+                        TEXT_DOCUMENT: {},
+                        TIME_FRAME: time_frames,
+                        ALIGNMENT: {},
+                    },
+                },
+                'annotations': [full, *annotations],
+            }
+        ],
+    }
+
+
+def convert(
+    result: dict,
+    output_dir: str,
+    stem: str,
+    media_path: Optional[str] = None,
+    formats: Iterable[str] = FORMATS,
+    mmif: bool = True,
+) -> Dict[str, str]:
+    """Write `formats` and, if `mmif`, an mmif of a Whisper `result` in one pass
+
+    Every file is written as the segments are read, so no format is built
+    in memory first. Returns {ext: path}, with `mmif` for the mmif.
+    """
+    from mario.mmif import write
+
+    makedirs(output_dir, exist_ok=True)
+    outputs = {ext: join(output_dir, f'{stem}.{ext}') for ext in formats}
+    annotations, texts = [], []
+    with ExitStack() as stack:
+        files = {
+            ext: stack.enter_context(open(path, 'w', encoding='utf-8'))
+            for ext, path in outputs.items()
+        }
+        for ext, f in files.items():
+            f.write(HEADERS.get(ext, ''))
+        for i, segment in enumerate(result.get('segments', [])):
+            start, end = segment['start'], segment['end']
+            text = segment['text'].strip().replace('-->', '->')
+            for ext, f in files.items():
+                f.write(LINES[ext](i, start, end, text))
+            if mmif:
+                annotations.extend(segment_annotations(i, start, end, text))
+            texts.append(text)
+    if mmif:
+        outputs['mmif'] = join(output_dir, f'{stem}.mmif')
+        language = result.get('language', 'en')
+        with open(outputs['mmif'], 'wb') as f:
+            write(
+                transcript_mmif(annotations, ' '.join(texts), media_path, language),
+                f,
+                'identity',
+            )
+    log.debug(f'Converted {len(texts)} segments of {stem} to {", ".join(outputs)}')
+    return outputs
+
+
+def media_guid(name: str) -> str:
+    """The GUID of a media file name, e.g. `cpb-aacip-1.h264.mp4`, or `name` if
+    it already is one
+
+    Only media extensions are removed, so GUIDs that contain dots are kept.
+    """
+    guid = basename(name)
+    stem, ext = splitext(guid)
+    while ext.lower() in MEDIA_EXTENSIONS and stem:
+        guid = stem
+        stem, ext = splitext(guid)
+    return guid
+
+
+def transcript_key(guid: str, model: str, ext: str) -> str:
+    """S3 key of a transcript, by the GUID of the media file"""
+    guid = media_guid(guid)
+    return f'{guid}/{model}/{guid}.{ext}'
+
+
+def upload_transcripts(
+    outputs: Dict[str, str], bucket: str, guid: str, model: str, **kwargs
+) -> Dict[str, str]:
+    """Upload every output at once. Returns {ext: key}"""
+    from mario.s3 import Upload, upload_many
+
+    keys = {ext: transcript_key(guid, model, ext) for ext in outputs}
+    upload_many(
+        [
+            Upload(
+                bucket,
+                keys[ext],
+                path=path,
+                extra={'ContentType': CONTENT_TYPES.get(ext, 'text/plain')},
+            )
+            for ext, path in outputs.items()
+        ],
+        **kwargs,
+    )
+    return keys
+
+
+def postprocess(json_path: str, media_path: Optional[str] = None) -> Dict[str, str]:
+    """Convert the Whisper JSON at `json_path`, next to it. Returns {ext: path}"""
+    stem = splitext(basename(json_path))[0]
+    outputs = convert(load_transcript(json_path), dirname(json_path), stem, media_path)
+    return {'json': json_path, **outputs}
@@ -9,12 +9,33 @@ class CLAMSAppError(Exception):
     """Error raised when a CLAMS app fails to run"""
 
 
-def rm(filename: str):
+class DownloadError(Exception):
+    """Error raised when a download fails or does not verify"""
+
+
+class CircuitOpenError(Exception):
+    """Error raised when calls to a URL are refused after repeated failures"""
+
+
+class AdmissionError(Exception):
+    """Error raised when a CLAMS app has no free slot within the timeout"""
+
+
+class TokenError(Exception):
+    """Error raised when an access token cannot be fetched"""
+
+
+class QueueFullError(Exception):
+    """Error raised when a job queue stays full for longer than the timeout"""
+
+
+def rm(filename: str, directory: str = MEDIA_DIR):
     """
     Remove a file from the media directory.
     """
     try:
-        remove(join(MEDIA_DIR, filename))
+        remove(join(directory, filename))
     except FileNotFoundError:
         log.debug(f'File {filename} not found.')
-    log.success(f'File {filename} removed.')
+    else:
+        log.success(f'File {filename} removed.')
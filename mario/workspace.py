@@ -0,0 +1,191 @@
+"""Per-run media workspaces on the shared media volume
+
+Each run gets its own directory, `MEDIA_DIR/work/<guid>/<run>`, for the
+media file and everything derived from it. Files are handed between names
+with reflinks or hardlinks instead of copies, cleanup removes exactly the
+run's own directory, and a disk budget evicts the least recently used stale
+workspaces on the volume.
+"""
+
+from contextlib import suppress
+from fcntl import ioctl
+from os import link, listdir, makedirs, remove, rmdir, scandir, stat, utime, walk
+from os.path import basename, dirname, getsize, isdir, join, relpath
+from shutil import copyfile, rmtree
+from time import time
+from typing import List, Optional, Tuple
+
+from mario.config import MEDIA_BUDGET, MEDIA_DIR, MEDIA_STALE_AGE, WORKSPACE_DIR
+from mario.log import log
+from mario.utils import rm
+
+# ioctl to clone a file's extents (btrfs, xfs) without copying data
+FICLONE = 0x40049409
+
+
+def reflink(src: str, dst: str) -> None:
+    """Clone `src` to `dst` with a copy-on-write reflink"""
+    with open(src, 'rb') as s, open(dst, 'wb') as d:
+        ioctl(d.fileno(), FICLONE, s.fileno())
+
+
+def hand_over(src: str, dst: str) -> str:
+    """Make `src` available at `dst` without copying, if the filesystem allows
+
+    Tries a reflink, then a hardlink, then falls back to a copy. Returns the
+    method used. An existing `dst` is replaced, not written through, since it
+    may be a link to `src`.
+    """
+    with suppress(FileNotFoundError):
+        remove(dst)
+    try:
+        reflink(src, dst)
+        return 'reflink'
+    except OSError:
+        with suppress(FileNotFoundError):
+            remove(dst)
+    try:
+        link(src, dst)
+        return 'hardlink'
+    except OSError:
+        copyfile(src, dst)
+        log.warning(f'Copied {src} to {dst}. Could not link across filesystems')
+        return 'copy'
+
+
+def du(path: str) -> int:
+    """Total size of the files under `path`, counting hardlinks once"""
+    if not isdir(path):
+        return getsize(path)
+    seen = {}
+    for directory, _, names in walk(path):
+        for name in names:
+            info = stat(join(directory, name))
+            seen[info.st_dev, info.st_ino] = info.st_size
+    return sum(seen.values())
+
+
+class Workspace:
+    """Working directory for one media file in one run
+
+    Args:
+        guid: GUID of the media file
+        run: Key for the owning run, e.g. `<flow>/<run id>`
+        root: The shared media directory
+    """
+
+    def __init__(self, guid: str, run: str, root: str = MEDIA_DIR):
+        self.guid = guid
+        self.run = run
+        self.root = root
+        self.path = join(root, WORKSPACE_DIR, guid, run.replace('/', '-'))
+
+    def create(self) -> 'Workspace':
+        """Create the workspace, recording the owning run"""
+        makedirs(self.path, exist_ok=True)
+        with open(join(self.path, '.owner'), 'w') as f:
+            f.write(self.run)
+        return self
+
+    def touch(self) -> None:
+        """Mark the workspace as in use, so it is not evicted"""
+        utime(self.path)
+
+    def file(self, name: str) -> str:
+        """Path of a file in the workspace"""
+        self.create()
+        self.touch()
+        return join(self.path, name)
+
+    def hand_over(self, src: str, name: Optional[str] = None) -> str:
+        """Bring `src` into the workspace as `name`, without copying if possible"""
+        dst = self.file(name or basename(src))
+        method = hand_over(src, dst)
+        log.debug(f'Handed {src} to {dst} by {method}')
+        return dst
+
+    def relocate(self, mmif, name: str):
+        """`mmif` with the media file `name` and its proxies in this workspace
+
+        Mmifs made by earlier runs point at media in their own workspace,
+        which may be gone. A ref is parsed, and written to the workspace only
+        if a document moved.
+        """
+        from mario.mmif import MMIFRef, dump, load, relocate
+        from mario.preprocess import proxy_names
+
+        loaded = load(mmif)
+        moved = relocate(loaded, self.path, [name, *proxy_names(name)])
+        if moved is loaded:
+            return mmif
+        log.info(f'Moved the mmif documents to {self.path}')
+        if isinstance(mmif, MMIFRef):
+            return dump(moved, self.file('input.mmif'))
+        return moved
+
+    def cleanup(self) -> int:
+        """Remove this run's files. Returns the number of files removed"""
+        if not isdir(self.path):
+            return 0
+        cleaned = 0
+        for entry in scandir(self.path):
+            if entry.is_file():
+                rm(relpath(entry.path, self.root), self.root)
+                cleaned += 1
+        rmtree(self.path, ignore_errors=True)
+        # Remove the guid directory too, if no other run is using it
+        with suppress(OSError):
+            rmdir(join(self.root, WORKSPACE_DIR, self.guid))
+        return cleaned
+
+
+def usage(root: str = MEDIA_DIR) -> List[Tuple[str, int, float]]:
+    """(path, size, last used) of every workspace and loose file in `root`"""
+    entries = []
+    for entry in scandir(root):
+        if entry.is_file():
+            entries.append((entry.path, entry.stat().st_size, entry.stat().st_mtime))
+    work = join(root, WORKSPACE_DIR)
+    if isdir(work):
+        for guid in listdir(work):
+            for run in listdir(join(work, guid)):
+                path = join(work, guid, run)
+                entries.append((path, du(path), stat(path).st_mtime))
+    return entries
+
+
+def enforce_budget(
+    needed: int = 0,
+    budget: int = MEDIA_BUDGET,
+    stale_age: float = MEDIA_STALE_AGE,
+    root: str = MEDIA_DIR,
+) -> int:
+    """Evict least recently used stale workspaces until `needed` more bytes fit
+
+    Only workspaces and files untouched for `stale_age` seconds are evicted,
+    so runs in progress are never affected. Returns the bytes freed.
+    """
+    if not budget:
+        return 0
+    entries = sorted(usage(root), key=lambda entry: entry[2])
+    total = sum(size for _, size, _ in entries)
+    freed = 0
+    now = time()
+    for path, size, used in entries:
+        if total + needed - freed <= budget:
+            break
+        if now - used < stale_age:
+            continue
+        log.info(f'Evicting stale {path} ({size} bytes)')
+        if isdir(path):
+            rmtree(path, ignore_errors=True)
+            with suppress(OSError):
+                rmdir(dirname(path))
+        else:
+            rm(relpath(path, root), root)
+        freed += size
+    if total + needed - freed > budget:
+        log.warning(
+            f'Media volume is over budget: {total - freed + needed} > {budget} bytes'
+        )
+    return freed
@@ -0,0 +1,31 @@
+from http.server import ThreadingHTTPServer
+from threading import Thread
+
+import pytest
+
+
+@pytest.fixture
+def serve():
+    """Start local HTTP servers on background threads, stopped after the test
+
+    Call it with a `ThreadingHTTPServer`, or with a request handler class, the
+    path of the new server's `url`, and attributes the handler reads from
+    `self.server`, such as its scripted responses.
+    """
+    servers = []
+
+    def start(server, path: str = '/', **attrs) -> ThreadingHTTPServer:
+        if isinstance(server, type):
+            server = ThreadingHTTPServer(('127.0.0.1', 0), server)
+            server.daemon_threads = True
+            server.url = f'http://127.0.0.1:{server.server_port}{path}'
+        for name, value in attrs.items():
+            setattr(server, name, value)
+        Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
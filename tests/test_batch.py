@@ -0,0 +1,141 @@
+from collections import Counter
+from json import dumps
+from threading import Lock
+from time import sleep
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('chowda.models')
+pytest.importorskip('metaflow')
+
+from mario.pipelines.utils import MediaItem, PipelineUtils  # noqa: E402
+from mario.workspace import Workspace  # noqa: E402
+
+GUIDS = [f'cpb-aacip-{i}' for i in range(6)]
+APPS = ['http://app-a', 'http://app-b']
+# The media file every app fails on
+BAD = GUIDS[3]
+
+
+class Response:
+    def __init__(self, status_code: int, mmif: dict):
+        self.status_code = status_code
+        self.mmif = mmif
+        self.content = dumps(mmif).encode()
+        self.request = SimpleNamespace(body=b'')
+
+    def json(self) -> dict:
+        return self.mmif
+
+
+class Apps:
+    """Stub CLAMS apps that record the most requests each had in flight"""
+
+    def __init__(self):
+        self.in_flight = Counter()
+        self.peak = Counter()
+        self.lock = Lock()
+
+    def post(self, url: str, json: dict, **kwargs) -> Response:
+        with self.lock:
+            self.in_flight[url] += 1
+            self.peak[url] = max(self.peak[url], self.in_flight[url])
+        sleep(0.05)
+        with self.lock:
+            self.in_flight[url] -= 1
+        if BAD in json['documents'][0]['properties']['location']:
+            return Response(500, {'error': 'boom'})
+        view = {'id': f'v_{len(json["views"])}', 'metadata': {'app': url}}
+        return Response(200, {**json, 'views': [*json['views'], view]})
+
+    def metrics(self) -> dict:
+        return {}
+
+
+class Batch(PipelineUtils):
+    pipeline = APPS
+    spec = None
+    bucket = 'clams-mmif'
+
+
+@pytest.fixture
+def stubs(tmp_path, monkeypatch):
+    import metaflow
+
+    from mario import ci, client, db
+    from mario.benchmarks.fakes import chowda_sqlite
+
+    engine, batch_id = chowda_sqlite(str(tmp_path / 'chowda.db'), GUIDS)
+    chowda = db.ChowdaDB(engine)
+    flushes = []
+    flush = chowda.flush
+    monkeypatch.setattr(
+        chowda, 'flush', lambda **kwargs: flushes.append(kwargs) or flush(**kwargs)
+    )
+    monkeypatch.setattr(db, 'chowda', lambda: chowda)
+    apps = Apps()
+    monkeypatch.setattr(client, 'client', lambda: apps)
+    sonyci = SimpleNamespace(prefetch_guids=lambda guids: None)
+    monkeypatch.setattr(ci, 'sonyci', lambda: sonyci)
+    current = SimpleNamespace(
+        flow_name='BatchPipeline',
+        run_id='1',
+        origin_run_id=None,
+        step_name='run_chunk',
+        task_id='2',
+        is_running_flow=True,
+    )
+    monkeypatch.setattr(metaflow, 'current', current)
+
+    # Media stays in tmp_path, and mmifs are not sourced or uploaded
+    monkeypatch.setattr(
+        PipelineUtils,
+        'workspace',
+        lambda self: Workspace(self.guid, 'BatchPipeline/1', str(tmp_path)),
+    )
+    monkeypatch.setattr(MediaItem, 'download_media_file', lambda self: None)
+    monkeypatch.setattr(
+        MediaItem,
+        'create_new_mmif',
+        lambda self: {
+            'documents': [{'properties': {'id': 'd1', 'location': self.filename}}],
+            'views': [],
+        },
+    )
+    monkeypatch.setattr(MediaItem, 'upload_mmif', lambda self, s3_path: s3_path)
+    yield SimpleNamespace(db=chowda, batch_id=batch_id, apps=apps, flushes=flushes)
+    chowda.session.close()
+
+
+def count(db, model) -> int:
+    from sqlmodel import Session, select
+
+    with Session(db.engine) as session:
+        return len(session.exec(select(model)).all())
+
+
+def test_process_chunk(stubs):
+    from chowda.models import MMIF, MetaflowRun
+
+    batch = Batch()
+    batch.batch_id = stubs.batch_id
+    results = batch.process_chunk(GUIDS, workers=len(GUIDS), app_concurrency=2)
+
+    assert [result['guid'] for result in results] == GUIDS
+    # The failure is recorded, and the other media files still processed
+    failed = [result for result in results if not result['ok']]
+    assert [result['guid'] for result in failed] == [BAD]
+    assert 'CLAMSAppError' in failed[0]['error']
+    for result in results:
+        if result['ok']:
+            guid = result['guid']
+            assert result['s3_path'] == f'{guid}/{stubs.batch_id}/{guid}.mmif'
+    # Each app had at most app_concurrency requests in flight
+    assert set(stubs.apps.peak) == set(APPS)
+    assert max(stubs.apps.peak.values()) == 2
+    # Every row was written in one flush at the end
+    assert stubs.flushes == [{}]
+    assert count(stubs.db, MetaflowRun) == len(GUIDS)
+    assert count(stubs.db, MMIF) == len(GUIDS) - 1
+    assert {span['name'] for span in batch.spans} >= {'app', 'db_flush'}
@@ -0,0 +1,192 @@
+from os import utime
+from time import time
+
+import pytest
+
+from mario.cache import LocalCache, MMIFCache, cache_key, canonical, run_cached
+from mario.mmif import MMIFRef, dumps, write
+
+MMIF = {
+    'metadata': {'mmif': 'http://mmif.clams.ai/1.0.0'},
+    'documents': [],
+    'views': [],
+}
+APP = 'http://app'
+
+
+def ref(path, mmif: dict = MMIF, encoding: str = 'identity') -> MMIFRef:
+    with open(path, 'wb') as f:
+        write(mmif, f, encoding)
+        size = f.tell()
+    return MMIFRef(str(path), size, encoding)
+
+
+def with_view(app: str, mmif) -> dict:
+    from mario.mmif import load
+
+    mmif = load(mmif)
+    return {**mmif, 'views': [*mmif['views'], {'id': f'v{len(mmif["views"])}'}]}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return LocalCache(str(tmp_path / 'cache'))
+
+
+def test_cache_is_abstract():
+    with pytest.raises(TypeError):
+        MMIFCache()
+
+
+def test_key_depends_on_app_version_and_input():
+    key = cache_key(APP, MMIF, '1.0')
+    assert key == cache_key(APP, dict(reversed(MMIF.items())), '1.0')
+    assert key != cache_key(APP, MMIF, '1.1')
+    assert key != cache_key('http://other', MMIF, '1.0')
+    assert key != cache_key(APP, {**MMIF, 'views': [{'id': 'v0'}]}, '1.0')
+
+
+def test_ref_key_hashes_the_stored_bytes(tmp_path):
+    plain = ref(tmp_path / 'plain.json', encoding='identity')
+    compressed = ref(tmp_path / 'compressed.json.gz', encoding='gzip')
+    assert cache_key(APP, plain, '1.0') == cache_key(APP, compressed, '1.0')
+    # Not canonicalized, so refs do not share keys with parsed mmifs
+    assert dumps(MMIF) != canonical(MMIF)
+    assert cache_key(APP, plain, '1.0') != cache_key(APP, MMIF, '1.0')
+
+
+def test_get_and_put(cache, tmp_path):
+    assert cache.get('key') is None
+    cache.put('key', MMIF)
+    assert cache.get('key') == MMIF
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.stores) == (1, 1, 1)
+
+
+def test_stats_count_parallel_lookups(cache):
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache.put('key', MMIF)
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(cache.get, ['key', 'missing'] * 100))
+    assert (cache.stats.hits, cache.stats.misses) == (100, 100)
+    assert cache.stats.hit_rate == 0.5
+
+
+def test_refs_are_streamed(cache, tmp_path):
+    cache.put('key', ref(tmp_path / 'output.json'))
+    cached = cache.get('key', str(tmp_path))
+    assert isinstance(cached, MMIFRef)
+    assert cached.location == str(tmp_path / 'key.cached.json')
+    assert cached.load() == MMIF
+    assert cache.get('missing', str(tmp_path)) is None
+    assert not (tmp_path / 'missing.cached.json').exists()
+
+
+def test_run_cached(cache):
+    calls = []
+
+    def run_app(app, mmif):
+        calls.append(app)
+        return with_view(app, mmif)
+
+    first = run_cached(APP, MMIF, run_app, cache, '1.0')
+    assert run_cached(APP, MMIF, run_app, cache, '1.0') == first
+    assert calls == [APP]
+    # A new version of the app is run again
+    run_cached(APP, MMIF, run_app, cache, '2.0')
+    assert calls == [APP, APP]
+
+
+def test_run_cached_refs(cache, tmp_path):
+    def run_app(app, mmif):
+        return ref(tmp_path / 'output.json', with_view(app, mmif))
+
+    source = ref(tmp_path / 'input.json')
+    run_cached(APP, source, run_app, cache, '1.0', str(tmp_path))
+    cached = run_cached(APP, source, None, cache, '1.0', str(tmp_path))
+    assert isinstance(cached, MMIFRef)
+    assert cached.load()['views'] == [{'id': 'v0'}]
+
+
+def located(workspace: str) -> dict:
+    location = f'file://{workspace}/media.mp4'
+    return {**MMIF, 'documents': [{'properties': {'id': 'd1', 'location': location}}]}
+
+
+def test_runs_in_other_workspaces_share_entries(cache):
+    calls = []
+
+    def run_app(app, mmif):
+        calls.append(app)
+        return with_view(app, mmif)
+
+    for run in ('run-1', 'run-2'):
+        workspace = f'/m/work/g/{run}'
+        output = run_cached(
+            APP, located(workspace), run_app, cache, '1.0', workspace=workspace
+        )
+    assert calls == [APP]
+    # The output points at the media in the run's own workspace
+    assert output['documents'] == located('/m/work/g/run-2')['documents']
+    assert output['views'] == [{'id': 'v0'}]
+
+
+def test_refs_in_other_workspaces_share_entries(cache, tmp_path, monkeypatch):
+    from mario import mmif
+
+    # Small reads, so workspace paths are split across them
+    monkeypatch.setattr(mmif, 'COPY_SIZE', 7)
+
+    def run_app(app, mmif):
+        return ref(tmp_path / 'output.json', with_view(app, mmif))
+
+    first = ref(tmp_path / 'first.json', located('/m/work/g/run-1'))
+    second = ref(tmp_path / 'second.json', located('/m/work/g/run-2'))
+    run_cached(APP, first, run_app, cache, '1.0', str(tmp_path), '/m/work/g/run-1')
+    key = cache_key(APP, second, '1.0', '/m/work/g/run-2')
+    assert key == cache_key(APP, first, '1.0', '/m/work/g/run-1')
+    cached = run_cached(
+        APP, second, None, cache, '1.0', str(tmp_path), '/m/work/g/run-2'
+    )
+    assert cached.load() == with_view(APP, located('/m/work/g/run-2'))
+
+
+def test_unknown_version_bypasses_the_cache(cache, monkeypatch):
+    from mario import cache as caches
+
+    monkeypatch.setattr(caches, 'app_version', lambda app: None)
+    run_cached(APP, MMIF, with_view, cache)
+    assert cache.stats.stores == 0
+
+
+def test_evict(tmp_path):
+    cache = LocalCache(str(tmp_path), max_bytes=len(canonical(MMIF)) * 2, max_age=60)
+    for key in ('old', 'a', 'b', 'c'):
+        cache.put(key, MMIF)
+    utime(cache.path('old'), (time() - 120, time() - 120))
+    utime(cache.path('a'), (time() - 30, time() - 30))
+    assert cache.evict() == 2
+    assert sorted(key for key, _, _ in cache.entries()) == ['b', 'c']
+
+
+def test_s3_cache(tmp_path, monkeypatch):
+    moto = pytest.importorskip('moto')
+    from mario import s3
+    from mario.cache import from_url
+
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        s3.s3.cache_clear()
+        s3.s3().create_bucket(Bucket='cache')
+        cache = from_url('s3://cache/mmifs')
+        assert cache.get('key') is None
+        cache.put('key', MMIF)
+        cache.put('ref', ref(tmp_path / 'output.json'))
+        assert cache.get('key') == MMIF
+        assert cache.get('ref', str(tmp_path)).load() == MMIF
+        assert sorted(key for key, _, _ in cache.entries()) == ['key', 'ref']
+        cache.delete('key')
+        assert cache.get('key') is None
+    s3.s3.cache_clear()
@@ -0,0 +1,29 @@
+from mario.checkpoint import Checkpoints, checkpoints_for
+
+MMIF = {'metadata': {}, 'documents': [], 'views': []}
+
+
+def test_save_load_clear(tmp_path):
+    checkpoints = Checkpoints(str(tmp_path), 'Pipeline/1/cpb-aacip-1')
+    checkpoints.save(0, 'http://app-a', MMIF)
+    checkpoints.save(1, 'http://app-b', MMIF)
+    other = Checkpoints(str(tmp_path), 'Pipeline/1/cpb-aacip-2')
+    other.save(0, 'http://app-a', MMIF)
+
+    assert checkpoints.exists(0, 'http://app-a')
+    assert checkpoints.load(1, 'http://app-b') == MMIF
+    assert checkpoints.clear() == 2
+    assert not checkpoints.exists(0, 'http://app-a')
+    assert other.exists(0, 'http://app-a')
+    assert checkpoints.clear() == 0
+
+
+def test_checkpoints_for(tmp_path, monkeypatch):
+    from mario import config
+
+    monkeypatch.setattr(config, 'CHECKPOINTS', '')
+    assert checkpoints_for('Pipeline', '1', 'cpb-aacip-1') is None
+    monkeypatch.setattr(config, 'CHECKPOINTS', str(tmp_path))
+    checkpoints = checkpoints_for('Pipeline', '1', 'cpb-aacip-1')
+    assert checkpoints.run == 'Pipeline/1/cpb-aacip-1'
+    assert checkpoints.location == str(tmp_path)
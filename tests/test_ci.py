@@ -0,0 +1,198 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from threading import Lock
+from time import sleep, time
+
+import pytest
+
+sonyci_client = pytest.importorskip('sonyci')
+
+from mario import ci  # noqa: E402
+from mario.ci import SonyCiAssets, proxy_checksum, url_expiry  # noqa: E402
+
+TOKEN = 'fake-token'
+
+
+class Handler(BaseHTTPRequestHandler):
+    """The asset endpoint of the Sony Ci API"""
+
+    server: 'FakeSonyCi'
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status: int, body: dict):
+        data = dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):  # noqa: N802
+        if self.headers['Authorization'] != f'Bearer {TOKEN}':
+            self.reply(401, {'error': 'unauthorized'})
+            return
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'assets':
+            self.reply(404, {'error': 'not found'})
+            return
+        asset_id = parts[1]
+        with self.server.lock:
+            self.server.requests.append(asset_id)
+            self.server.active += 1
+            self.server.peak = max(self.server.peak, self.server.active)
+        try:
+            sleep(self.server.latency)
+            if asset_id not in self.server.assets:
+                self.reply(404, {'error': f'no asset {asset_id}'})
+                return
+            self.reply(200, self.server.asset(asset_id))
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+
+
+class FakeSonyCi(ThreadingHTTPServer):
+    """A local Sony Ci API serving `assets`, with signed proxyUrls that expire
+    `expires_in` seconds after each lookup"""
+
+    daemon_threads = True
+
+    def __init__(self, assets, expires_in=None, latency: float = 0):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.assets = set(assets)
+        self.expires_in = expires_in
+        self.latency = latency
+        self.requests = []
+        self.active = self.peak = 0
+        self.lock = Lock()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_port}/'
+
+    def asset(self, asset_id: str) -> dict:
+        url = f'https://media.example/{asset_id}.mp4'
+        if self.expires_in is not None:
+            url += f'?Expires={int(time() + self.expires_in)}&Signature=fake'
+        return {
+            'id': asset_id,
+            'name': asset_id,
+            'proxyUrl': url,
+            'proxies': [{'location': url, 'md5Checksum': 'abc'}],
+        }
+
+    def client(self):
+        """A Sony Ci client for this API, already logged in"""
+        from requests_oauth2client import BearerToken
+
+        return sonyci_client.SonyCi(
+            base_url=self.url, t=BearerToken(TOKEN, expires_in=3600)
+        )
+
+
+@pytest.fixture
+def api(serve):
+    return serve(FakeSonyCi([f'asset-{i}' for i in range(10)], latency=0.05))
+
+
+def test_url_expiry():
+    assert url_expiry(None) is None
+    assert url_expiry('https://example/a.mp4') is None
+    assert url_expiry('https://example/a.mp4?Expires=1700000000') == 1700000000
+    signed = 'X-Amz-Date=20240101T000000Z&X-Amz-Expires=3600'
+    assert url_expiry(f'https://example/a.mp4?{signed}') == 1704067200 + 3600
+    assert url_expiry('https://example/a.mp4?Expires=soon') is None
+
+
+def test_proxy_checksum():
+    url = 'https://media.example/a.mp4?Expires=1'
+    asset = {
+        'proxyUrl': url,
+        'proxies': [
+            {'location': 'https://media.example/b.mp4', 'md5Checksum': 'other'},
+            {'location': 'https://media.example/a.mp4?Expires=2', 'md5': 'abc'},
+        ],
+    }
+    assert proxy_checksum(asset) == 'md5:abc'
+    assert proxy_checksum({'proxyUrl': url}) is None
+
+
+def test_lookups_are_cached(api):
+    assets = SonyCiAssets(api.client())
+    asset = assets.get('asset-1')
+    assert assets.get('asset-1') is asset
+    assert assets.proxy_url('asset-1') == asset['proxyUrl']
+    assert api.requests == ['asset-1']
+    assert (assets.stats.hits, assets.stats.misses) == (2, 1)
+
+
+def test_ttl(api):
+    assets = SonyCiAssets(api.client(), ttl=0.2)
+    assets.get('asset-1')
+    sleep(0.3)
+    assets.get('asset-1')
+    assert api.requests == ['asset-1', 'asset-1']
+
+
+def test_dropped_before_the_proxy_url_expires(api):
+    api.expires_in = 60
+    assets = SonyCiAssets(api.client(), ttl=3600, margin=30)
+    asset = assets.get('asset-1')
+    assert assets.expires_at(asset) == pytest.approx(time() + 30, abs=2)
+    # Lookups whose urls expire within the margin are never served cached
+    assets.margin = 120
+    assets.fetch('asset-2')
+    assets.get('asset-2')
+    assert api.requests == ['asset-1', 'asset-2', 'asset-2']
+
+
+def test_prefetch(api):
+    assets = SonyCiAssets(api.client())
+    assets.get('asset-0')
+    ids = [f'asset-{i}' for i in range(10)] + ['asset-3', 'missing']
+    assert assets.prefetch(ids, workers=3) == 9
+    assert 1 < api.peak <= 3
+    assert sorted(api.requests) == sorted(
+        [f'asset-{i}' for i in range(10)] + ['missing']
+    )
+    # The failed lookup is tried again, the rest are cached
+    assert assets.prefetch(ids, workers=3) == 0
+    assert api.requests[-1] == 'missing'
+
+
+def test_prefetch_guids(api, tmp_path, monkeypatch):
+    pytest.importorskip('chowda.models')
+    from mario import db as chowda_db
+    from mario.benchmarks.fakes import chowda_sqlite
+
+    guids = [f'{i}' for i in range(6)]
+    engine, _ = chowda_sqlite(str(tmp_path / 'chowda.db'), guids)
+    monkeypatch.setattr(chowda_db, 'chowda', lambda: chowda_db.ChowdaDB(engine))
+    assets = SonyCiAssets(api.client())
+    assert assets.prefetch_guids([*guids, 'no-such-guid'], workers=4) == 6
+    assert sorted(api.requests) == [f'asset-{guid}' for guid in guids]
+    assert api.peak <= 4
+
+
+def test_shared_client(api, monkeypatch):
+    made = []
+    logged_in = api.client()
+
+    class Client(sonyci_client.SonyCi):
+        def __init__(self, **kwargs):
+            made.append(self)
+            super().__init__(base_url=logged_in.base_url, t=logged_in.t)
+
+    monkeypatch.setattr(sonyci_client, 'SonyCi', Client)
+    ci.sonyci.cache_clear()
+    try:
+        assert ci.sonyci() is ci.sonyci()
+        ci.sonyci().get('asset-1')
+        ci.sonyci().get('asset-2')
+        assert len(made) == 1
+        assert api.requests == ['asset-1', 'asset-2']
+    finally:
+        ci.sonyci.cache_clear()
@@ -0,0 +1,159 @@
+from http.server import BaseHTTPRequestHandler
+from time import sleep
+
+import pytest
+
+from mario.client import CircuitBreaker, Client
+from mario.utils import CircuitOpenError
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Answers with the server's next scripted status, after its `delay`
+
+    A status of 0 drops the connection without answering.
+    """
+
+    def respond(self):
+        server = self.server
+        server.calls.append(self.command)
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        sleep(server.delay)
+        status = server.statuses.pop(0) if server.statuses else 200
+        if not status:
+            self.close_connection = True
+            return
+        self.send_response(status)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    do_GET = do_POST = respond  # noqa: N815
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(serve):
+    return serve(Handler, statuses=[], calls=[], delay=0)
+
+
+def test_retries_503(server):
+    server.statuses = [503, 503]
+    http = Client(retries=3, backoff=0)
+    response = http.post(server.url, json={})
+    assert response.status_code == 200
+    assert len(server.calls) == 3
+    stats = http.metrics()[server.url]
+    assert stats['attempts'] == 3
+    assert stats['retries'] == 2
+    assert stats['failures'] == 0
+    assert stats['circuit'] == 'closed'
+    assert stats['mean_latency'] > 0
+
+
+def test_returns_last_response_when_retries_run_out(server):
+    server.statuses = [503] * 3
+    http = Client(retries=2, backoff=0)
+    assert http.get(server.url).status_code == 503
+    stats = http.metrics()[server.url]
+    assert stats['attempts'] == 3
+    assert stats['failures'] == 1
+
+
+def test_does_not_retry_4xx(server):
+    server.statuses = [404]
+    http = Client(retries=3, backoff=0)
+    assert http.get(server.url).status_code == 404
+    assert len(server.calls) == 1
+
+
+def test_read_timeouts_are_only_retried_for_idempotent_methods(server):
+    from requests.exceptions import ReadTimeout
+
+    server.delay = 0.3
+    http = Client(read_timeout=0.1, retries=2, backoff=0)
+    with pytest.raises(ReadTimeout):
+        http.post(server.url, json={})
+    assert server.calls == ['POST']
+    # The failure is still counted
+    stats = http.metrics()[server.url]
+    assert (stats['attempts'], stats['failures']) == (1, 1)
+
+    with pytest.raises(ReadTimeout):
+        http.get(server.url)
+    assert server.calls == ['POST'] + ['GET'] * 3
+
+
+def test_dropped_posts_are_not_sent_again(server):
+    from requests.exceptions import ConnectionError
+
+    server.statuses = [0, 0]
+    http = Client(retries=2, backoff=0)
+    with pytest.raises(ConnectionError):
+        http.post(server.url, json={})
+    # The app got the POST, so it is not sent again
+    assert server.calls == ['POST']
+
+    assert http.get(server.url).status_code == 200
+    assert server.calls == ['POST', 'GET', 'GET']
+
+
+def test_refused_posts_are_retried_and_open_the_circuit():
+    from socket import socket
+
+    from requests.exceptions import ConnectionError
+
+    with socket() as closed:
+        closed.bind(('127.0.0.1', 0))
+        url = f'http://127.0.0.1:{closed.getsockname()[1]}/'
+    http = Client(retries=2, backoff=0, circuit_threshold=5, circuit_reset=60)
+    with pytest.raises(ConnectionError):
+        http.post(url, json={})
+    stats = http.metrics()[url]
+    assert (stats['attempts'], stats['retries'], stats['failures']) == (3, 2, 1)
+    assert stats['circuit'] == 'closed'
+    with pytest.raises(ConnectionError):
+        http.post(url, json={})
+    assert http.metrics()[url]['circuit'] == 'open'
+    with pytest.raises(CircuitOpenError):
+        http.post(url, json={})
+
+
+def test_circuit_opens_then_half_opens(server):
+    server.statuses = [503] * 2
+    http = Client(retries=0, backoff=0, circuit_threshold=2, circuit_reset=0.2)
+    assert http.get(server.url).status_code == 503
+    assert http.get(server.url).status_code == 503
+    assert http.metrics()[server.url]['circuit'] == 'open'
+
+    with pytest.raises(CircuitOpenError):
+        http.get(server.url)
+    assert len(server.calls) == 2
+    assert http.metrics()[server.url]['rejected'] == 1
+
+    sleep(0.25)
+    assert http.metrics()[server.url]['circuit'] == 'half-open'
+    # The trial call succeeds, and closes the circuit
+    assert http.get(server.url).status_code == 200
+    assert http.metrics()[server.url]['circuit'] == 'closed'
+
+
+def test_open_circuit_stops_retries(server):
+    server.statuses = [503] * 5
+    http = Client(retries=5, backoff=0, circuit_threshold=2, circuit_reset=60)
+    assert http.get(server.url).status_code == 503
+    assert len(server.calls) == 2
+
+
+def test_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(threshold=1, reset=0.1)
+    breaker.failure()
+    assert not breaker.allow()
+    sleep(0.15)
+    assert breaker.allow()
+    # Others wait for the trial to report
+    assert not breaker.allow()
+    breaker.failure()
+    assert breaker.state == 'open'
@@ -0,0 +1,224 @@
+from threading import Lock
+from time import sleep
+from typing import Optional
+
+import pytest
+
+from mario.dag import App, DAGRun, chain, parse
+from mario.mmif import fresh_view_id, view_ids
+from mario.pipelines.utils import PipelineUtils
+
+VIDEO = 'http://mmif.clams.ai/vocabulary/VideoDocument/v1'
+AUDIO = 'http://mmif.clams.ai/vocabulary/AudioDocument/v1'
+TIME_FRAME = 'http://mmif.clams.ai/vocabulary/TimeFrame/v5'
+TEXT = 'http://mmif.clams.ai/vocabulary/TextDocument/v1'
+
+SOURCE = {
+    'metadata': {'mmif': 'http://mmif.clams.ai/1.0.0'},
+    'documents': [
+        {'@type': VIDEO, 'properties': {'id': 'd1'}},
+        {'@type': AUDIO, 'properties': {'id': 'd2'}},
+    ],
+    'views': [],
+}
+
+
+def stub(name: str, contains: str, reads: Optional[str] = None, delay: float = 0):
+    """A CLAMS app that adds one view, with the next free id like real apps
+
+    The view's annotation refers to the first annotation of the last view
+    containing `reads`, if there is one.
+    """
+
+    def app(mmif: dict) -> dict:
+        sleep(delay)
+        annotation = {'@type': contains, 'properties': {'id': 'a1', 'app': name}}
+        for view in reversed(mmif['views']):
+            if reads in view['metadata']['contains']:
+                annotation['properties']['source'] = f'{view["id"]}:a1'
+                break
+        view = {
+            'id': fresh_view_id(view_ids(mmif)),
+            'metadata': {'app': name, 'contains': {contains: {}}},
+            'annotations': [annotation],
+        }
+        return {**mmif, 'views': [*mmif['views'], view]}
+
+    return app
+
+
+def by_app(mmif: dict) -> dict:
+    """{app: (view id, source reference)} of every view"""
+    return {
+        view['metadata']['app']: (
+            view['id'],
+            view['annotations'][0]['properties'].get('source'),
+        )
+        for view in mmif['views']
+    }
+
+
+def test_chain():
+    apps = chain(['http://a', 'http://b', 'http://a'])
+    assert [app.name for app in apps] == ['http://a', 'http://b', 'http://a#2']
+    assert [app.after for app in apps] == [(), ('http://a',), ('http://b',)]
+    assert parse('["http://a", "http://b"]') == apps[:2]
+
+
+def test_parse_orders_topologically():
+    apps = parse(
+        {
+            'ner': {
+                'url': 'http://ner',
+                'after': 'whisper',
+                'consumes': 'TextDocument',
+            },
+            'whisper': {'url': 'http://whisper', 'needs': ['audio']},
+            'bars': {'url': 'http://bars'},
+        }
+    )
+    assert [app.name for app in apps] == ['whisper', 'bars', 'ner']
+    assert apps[0].needs == ('audio',)
+    assert apps[0].consumes is None
+    assert apps[2].consumes == ('TextDocument',)
+
+
+@pytest.mark.parametrize(
+    'spec, error',
+    [
+        (
+            [{'name': 'a', 'url': 'http://a', 'after': 'b'}],
+            'unknown apps',
+        ),
+        (
+            [
+                {'name': 'a', 'url': 'http://a', 'after': 'b'},
+                {'name': 'b', 'url': 'http://b', 'after': 'a'},
+                {'name': 'c', 'url': 'http://c'},
+            ],
+            'cycle',
+        ),
+        (
+            [{'name': 'a', 'url': 'http://a'}, {'name': 'a', 'url': 'http://b'}],
+            'unique',
+        ),
+    ],
+)
+def test_parse_rejects(spec, error):
+    with pytest.raises(ValueError, match=error):
+        parse(spec)
+
+
+@pytest.mark.parametrize('slow', ['bars', 'whisper'])
+def test_branches_merge_in_spec_order(slow):
+    """Both branches name their view v_0. The merged ids do not depend on which
+    branch finishes first"""
+    apps = parse(
+        [
+            {'name': 'bars', 'url': 'http://bars'},
+            {'name': 'whisper', 'url': 'http://whisper'},
+            {'name': 'ner', 'url': 'http://ner', 'after': 'whisper'},
+            {'name': 'summary', 'url': 'http://summary', 'after': ['bars', 'ner']},
+        ]
+    )
+    stubs = {
+        'bars': stub('bars', TIME_FRAME, delay=0.1 * (slow == 'bars')),
+        'whisper': stub('whisper', TEXT, delay=0.1 * (slow == 'whisper')),
+        'ner': stub('ner', 'NamedEntity', reads=TEXT),
+        'summary': stub('summary', 'Summary', reads='NamedEntity'),
+    }
+    inputs = {}
+
+    def run_app(index: int, app: App, mmif):
+        inputs[app.name] = by_app(mmif)
+        return stubs[app.name](mmif)
+
+    output = DAGRun(apps, SOURCE, run_app).run()
+    # ner ran on whisper's output alone, where whisper's view is v_0
+    assert inputs['ner'] == {'whisper': ('v_0', None)}
+    # summary's input merges both branches, renaming whisper's and ner's views
+    assert inputs['summary'] == {
+        'bars': ('v_0', None),
+        'whisper': ('v_1', None),
+        'ner': ('v_2', 'v_1:a1'),
+    }
+    assert by_app(output) == {
+        **inputs['summary'],
+        'summary': ('v_3', 'v_2:a1'),
+    }
+    assert output['documents'] == SOURCE['documents']
+
+
+def test_linear_chain_returns_last_output():
+    apps = chain(['http://whisper', 'http://ner'])
+    stubs = {
+        'http://whisper': stub('whisper', TEXT),
+        'http://ner': stub('ner', 'NamedEntity', reads=TEXT),
+    }
+    outputs = []
+
+    def run_app(index: int, app: App, mmif):
+        outputs.append(stubs[app.url](mmif))
+        return outputs[-1]
+
+    assert DAGRun(apps, SOURCE, run_app).run() is outputs[-1]
+
+
+class Runner(PipelineUtils):
+    """PipelineUtils with CLAMS apps replaced by in-process stubs"""
+
+    guid = 'cpb-aacip-1'
+
+    def __init__(self, spec: list, stubs: dict, proxies: dict):
+        self.spec = spec
+        self.stubs = stubs
+        self.proxy_documents = proxies
+        self.received = {}
+        self.lock = Lock()
+
+    def app(self, app: str, mmif, **attrs):
+        with self.lock:
+            self.received[app] = mmif
+        return self.stubs[app](mmif)
+
+
+def test_apps_are_sent_the_documents_and_views_they_need():
+    spec = [
+        {'name': 'bars', 'url': 'http://bars'},
+        {'name': 'whisper', 'url': 'http://whisper', 'needs': 'audio'},
+        {
+            'name': 'ner',
+            'url': 'http://ner',
+            'after': ['bars', 'whisper'],
+            'consumes': 'TextDocument',
+        },
+    ]
+    stubs = {
+        'http://bars': stub('bars', TIME_FRAME),
+        'http://whisper': stub('whisper', TEXT),
+        'http://ner': stub('ner', 'NamedEntity', reads=TEXT),
+    }
+    runner = Runner(spec, stubs, {'audio': 'd2'})
+    output = runner.run_apps(SOURCE)
+
+    def documents(app: str):
+        return [d['properties']['id'] for d in runner.received[app]['documents']]
+
+    # The audio proxy replaces the video for whisper, and is hidden from bars
+    assert documents('http://bars') == ['d1']
+    assert documents('http://whisper') == ['d2']
+    # ner is only sent the view with the text, under its merged id
+    assert by_app(runner.received['http://ner']) == {'whisper': ('v_1', None)}
+    # ner's view is spliced back after every other view, and its reference kept
+    assert by_app(output) == {
+        'bars': ('v_0', None),
+        'whisper': ('v_1', None),
+        'ner': ('v_2', 'v_1:a1'),
+    }
+    assert output['documents'] == SOURCE['documents']
+
+
+def test_empty_pipeline_returns_the_input():
+    runner = Runner([], {}, {})
+    assert runner.run_apps(SOURCE) == SOURCE
+    assert runner.received == {}
@@ -0,0 +1,133 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip('chowda.models')
+
+# Writes must not touch the objects cached in the session
+pytestmark = pytest.mark.filterwarnings('error::sqlalchemy.exc.SAWarning')
+
+GUIDS = ['cpb-aacip-1', 'cpb-aacip-2', 'cpb-aacip-3']
+
+
+@pytest.fixture
+def db(tmp_path):
+    from mario.benchmarks.fakes import chowda_sqlite
+    from mario.db import ChowdaDB
+
+    engine, batch_id = chowda_sqlite(str(tmp_path / 'chowda.db'), GUIDS)
+    db = ChowdaDB(engine)
+    db.batch_id = batch_id
+    yield db
+    db.session.close()
+
+
+def count(db, model) -> int:
+    from sqlmodel import Session, select
+
+    with Session(db.engine) as session:
+        return len(session.exec(select(model)).all())
+
+
+def test_lookups_are_cached(db):
+    media_file = db.media_file(GUIDS[0])
+    assert db.media_file(GUIDS[0]) is media_file
+    assert media_file.assets[0].id == f'asset-{GUIDS[0]}'
+    assert db.batch(db.batch_id) is db.batch(db.batch_id)
+    assert db.batch(None) is None
+
+
+def test_asset(db):
+    assert db.asset(GUIDS[0]) == (f'asset-{GUIDS[0]}', f'{GUIDS[0]}.mp4', 'video')
+
+
+def test_prefetch(db):
+    db.prefetch(GUIDS)
+    assert set(db.media_files) == set(GUIDS)
+
+
+def test_batch_guids(db):
+    assert db.batch_guids(db.batch_id) == sorted(GUIDS)
+
+
+def test_deferred_rows_are_written_together(db):
+    from chowda.models import MMIF, MetaflowRun
+
+    for i, guid in enumerate(GUIDS):
+        db.add_run(f'run-{i}', guid, db.batch_id, defer=True, pathspec=f'Flow/{i}')
+        db.add_mmif(guid, f'run-{i}', db.batch_id, f'{guid}.mmif', defer=True)
+    assert count(db, MetaflowRun) == 0
+    assert db.flush() == 2 * len(GUIDS)
+    assert count(db, MetaflowRun) == len(GUIDS)
+    assert count(db, MMIF) == len(GUIDS)
+    assert db.flush() == 0
+
+
+def test_rows_are_linked_by_id(db):
+    from chowda.models import MMIF
+    from sqlmodel import Session, select
+
+    media_file = db.media_file(GUIDS[0])
+    db.add_run('run-0', GUIDS[0], db.batch_id, defer=True, pathspec='Flow/0')
+    db.add_mmif(GUIDS[0], 'run-0', db.batch_id, 'a.mmif', defer=True)
+    db.flush()
+    with Session(db.engine) as session:
+        mmif = session.exec(select(MMIF)).one()
+        assert mmif.media_file_id == GUIDS[0]
+        assert mmif.batch_output_id == db.batch_id
+        assert mmif.metaflow_run.pathspec == 'Flow/0'
+        assert mmif.metaflow_run.batch_id == db.batch_id
+    # Cached lookups are still usable
+    assert db.media_file(GUIDS[0]) is media_file
+    assert media_file.assets
+
+
+def test_undeferred_rows_are_written_at_once(db):
+    from chowda.models import MetaflowRun
+
+    db.add_run('run-0', GUIDS[0], db.batch_id, pathspec='Flow/0')
+    assert count(db, MetaflowRun) == 1
+    assert db.metaflow_run('run-0').pathspec == 'Flow/0'
+
+
+def test_undeferred_rows_that_fail_raise(db):
+    from chowda.models import MetaflowRun
+    from sqlalchemy.exc import IntegrityError
+
+    db.add_run('run-0', GUIDS[0], db.batch_id, pathspec='Flow/0')
+    with pytest.raises(IntegrityError):
+        db.add_run('run-0', GUIDS[1], db.batch_id, pathspec='Flow/1')
+    assert count(db, MetaflowRun) == 1
+    assert len(db.failed) == 1
+    # The session is still usable
+    db.add_run('run-1', GUIDS[1], db.batch_id, pathspec='Flow/1')
+    assert count(db, MetaflowRun) == 2
+
+
+def test_failed_flush_writes_the_other_rows(db):
+    from chowda.models import MetaflowRun
+
+    db.add_run('run-0', GUIDS[0], db.batch_id, defer=True, pathspec='Flow/0')
+    # A second run with the same id fails the bulk commit, and only itself
+    db.add_run('run-0', GUIDS[1], db.batch_id, defer=True, pathspec='Flow/1')
+    db.add_run('run-2', GUIDS[2], db.batch_id, defer=True, pathspec='Flow/2')
+    assert db.flush() == 2
+    assert count(db, MetaflowRun) == 2
+    assert len(db.failed) == 1
+    assert db.pending == []
+
+
+def test_rows_added_from_threads(db):
+    from chowda.models import MetaflowRun
+
+    def add(i: int):
+        guid = GUIDS[i % len(GUIDS)]
+        db.add_run(f'run-{i}', guid, db.batch_id, defer=True, pathspec=f'Flow/{i}')
+        with db.lock:
+            return db.media_file(guid).assets[0].id
+
+    with ThreadPoolExecutor(8) as pool:
+        assets = list(pool.map(add, range(30)))
+    assert len(assets) == 30
+    assert db.flush() == 30
+    assert count(db, MetaflowRun) == 30
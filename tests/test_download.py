@@ -0,0 +1,161 @@
+from hashlib import md5
+from http.server import BaseHTTPRequestHandler
+from json import dump
+from time import sleep
+
+import pytest
+
+from mario import download as downloads
+from mario.download import Manifest, chunk_ranges, download
+from mario.utils import DownloadError
+
+DATA = bytes(range(256)) * 400
+CHUNK = 10_000
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serves the server's `data`, honoring Range requests if it `ranges`"""
+
+    def do_GET(self):  # noqa: N802
+        server = self.server
+        data = server.data
+        header = self.headers.get('Range')
+        server.requests.append(header)
+        if not (server.ranges and header):
+            self.respond(200, data)
+            return
+        start, _, end = header.removeprefix('bytes=').partition('-')
+        start, end = int(start), min(int(end), len(data) - 1)
+        body = data[start : end + 1]
+        # The one byte probe always answers, so only chunks stall
+        self.respond(
+            206, body, f'bytes {start}-{end}/{len(data)}', header != 'bytes=0-0'
+        )
+
+    def respond(self, status, body, content_range=None, stall=False):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', '"etag"')
+        if content_range:
+            self.send_header('Content-Range', content_range)
+        self.end_headers()
+        if stall and self.server.stall:
+            self.wfile.write(body[: len(body) // 2])
+            self.wfile.flush()
+            sleep(self.server.stall)
+            return
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(serve):
+    return serve(Handler, '/media.mp4', data=DATA, ranges=True, stall=0, requests=[])
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(downloads, 'sleep', lambda seconds: None)
+
+
+def test_chunk_ranges():
+    assert chunk_ranges(25, 10) == [(0, 9), (10, 19), (20, 24)]
+
+
+def test_chunked_download(server, tmp_path):
+    filename = str(tmp_path / 'media.mp4')
+    result = download(server.url, filename, f'md5:{md5(DATA).hexdigest()}', CHUNK, 4)
+    assert (tmp_path / 'media.mp4').read_bytes() == DATA
+    assert result.chunks == len(chunk_ranges(len(DATA), CHUNK))
+    assert result.fetched == result.size == len(DATA)
+    assert result.resumed == 0
+    assert not (tmp_path / 'media.mp4.part').exists()
+    assert not (tmp_path / 'media.mp4.parts').exists()
+
+
+def test_reserve_is_called_with_the_size_before_downloading(server, tmp_path):
+    filename = str(tmp_path / 'media.mp4')
+    reserved = []
+
+    def reserve(size: int):
+        reserved.append(size)
+        assert not (tmp_path / 'media.mp4.part').exists()
+
+    download(server.url, filename, chunk_size=CHUNK, reserve=reserve)
+    assert reserved == [len(DATA)]
+
+
+def test_resume_from_manifest(server, tmp_path):
+    filename = str(tmp_path / 'media.mp4')
+    # A previous attempt finished the first two chunks
+    with open(filename + '.part', 'wb') as f:
+        f.write(DATA[: 2 * CHUNK] + bytes(len(DATA) - 2 * CHUNK))
+    manifest = Manifest(filename + '.parts', len(DATA), CHUNK, '"etag"')
+    with open(manifest.path, 'w') as f:
+        dump({'key': manifest.key, 'done': [0, 1]}, f)
+
+    result = download(server.url, filename, chunk_size=CHUNK, workers=2)
+    assert (tmp_path / 'media.mp4').read_bytes() == DATA
+    assert result.resumed == 2 * CHUNK
+    assert result.fetched == len(DATA) - 2 * CHUNK
+    assert f'bytes=0-{CHUNK - 1}' not in server.requests
+    assert f'bytes={CHUNK}-{2 * CHUNK - 1}' not in server.requests
+
+
+def test_manifest_for_another_file_is_ignored(server, tmp_path):
+    filename = str(tmp_path / 'media.mp4')
+    with open(filename + '.part', 'wb') as f:
+        f.write(bytes(len(DATA)))
+    with open(filename + '.parts', 'w') as f:
+        dump({'key': {'etag': 'other'}, 'done': [0, 1]}, f)
+
+    result = download(server.url, filename, chunk_size=CHUNK, workers=2)
+    assert (tmp_path / 'media.mp4').read_bytes() == DATA
+    assert result.resumed == 0
+
+
+def test_sequential_fallback(server, tmp_path):
+    server.ranges = False
+    filename = str(tmp_path / 'media.mp4')
+    # A longer partial file from an earlier attempt is truncated
+    with open(filename + '.part', 'wb') as f:
+        f.write(b'x' * (len(DATA) + 10))
+    result = download(server.url, filename, chunk_size=CHUNK)
+    assert (tmp_path / 'media.mp4').read_bytes() == DATA
+    assert result.chunks == 1
+    assert result.fetched == len(DATA)
+
+
+def test_md5_mismatch(server, tmp_path):
+    filename = str(tmp_path / 'media.mp4')
+    with pytest.raises(DownloadError, match='md5'):
+        download(server.url, filename, 'md5:' + '0' * 32, CHUNK)
+    assert not (tmp_path / 'media.mp4').exists()
+
+
+def test_corrupt_download_is_fetched_again(server, tmp_path):
+    filename = str(tmp_path / 'media.mp4')
+    checksum = f'md5:{md5(DATA).hexdigest()}'
+    server.data = bytes(len(DATA))
+    with pytest.raises(DownloadError, match='md5'):
+        download(server.url, filename, checksum, CHUNK, 4)
+    # Nothing is left to resume from, so the retry fetches every chunk
+    assert not (tmp_path / 'media.mp4.part').exists()
+    assert not (tmp_path / 'media.mp4.parts').exists()
+
+    server.data = DATA
+    result = download(server.url, filename, checksum, CHUNK, 4)
+    assert (tmp_path / 'media.mp4').read_bytes() == DATA
+    assert result.resumed == 0
+    assert result.fetched == len(DATA)
+
+
+def test_stall_timeout(server, tmp_path, monkeypatch):
+    server.stall = 2
+    monkeypatch.setattr(downloads, 'TIMEOUT', (1, 0.2))
+    filename = str(tmp_path / 'media.mp4')
+    with pytest.raises(DownloadError, match='Failed to fetch bytes'):
+        download(server.url, filename, chunk_size=len(DATA))
+    assert not (tmp_path / 'media.mp4').exists()
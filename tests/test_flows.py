@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip('chowda.models')
+pytest.importorskip('metaflow')
+pytest.importorskip('moto')
+CONFIGS = pytest.importorskip('mario.benchmarks.flows').CONFIGS
+
+
+def config_id(config: dict) -> str:
+    return '-'.join(f'{key}={value}' for key, value in config.items())
+
+
+@pytest.mark.parametrize('config', CONFIGS, ids=config_id)
+def test_flows_run_against_local_fakes(config):
+    from mario.benchmarks import isolated
+    from mario.benchmarks.flows import bench
+
+    # In a fresh process, since fakes must be set up before mario.config and
+    # chowda.db are imported
+    result, _ = isolated(bench, config, 2, 1)
+    assert result['files'] == 2
+    assert result['p50_s'] > 0
+
+
+@pytest.mark.parametrize('flow', ['AppWhisper', 'AppBarsdetection'])
+def test_app_flows_record_their_runs_and_mmifs(flow):
+    from mario.benchmarks import isolated
+    from mario.benchmarks.flows import records
+
+    result, _ = isolated(records, flow, 2)
+    guid = 'cpb-aacip-bench-0000'
+    assert [(run['id'], run['batch_id']) for run in result['runs']] == [
+        ('0', None),
+        ('1', None),
+    ]
+    assert {run['media_file_id'] for run in result['runs']} == {guid}
+    app = flow.replace('App', 'app-').lower()
+    assert [
+        (mmif['metaflow_run_id'], mmif['batch_output_id'], mmif['mmif_location'])
+        for mmif in result['mmifs']
+    ] == [(run_id, None, f'{guid}/{app}/{guid}.mmif') for run_id in '01']
+    # AppWhisper starts from the latest mmif, so the second run adds a view
+    assert result['views'] == ([1, 2] if flow == 'AppWhisper' else [1, 1])
@@ -0,0 +1,112 @@
+from threading import Timer
+from time import time
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('rq')
+
+from rq import SimpleWorker  # noqa: E402
+from rq.registry import (  # noqa: E402
+    FailedJobRegistry,
+    ScheduledJobRegistry,
+    StartedJobRegistry,
+)
+
+from mario import jobs  # noqa: E402
+from mario.config import JOB_RETRIES  # noqa: E402
+from mario.utils import QueueFullError  # noqa: E402
+
+processed = []
+
+
+def process(guid: str, **parameters) -> str:
+    processed.append(guid)
+    return guid
+
+
+def fail(guid: str, **parameters):
+    raise RuntimeError(f'{guid} failed')
+
+
+@pytest.fixture
+def connection():
+    processed.clear()
+    return fakeredis.FakeStrictRedis()
+
+
+def work(connection) -> None:
+    queues = [jobs.queue(priority, connection) for priority in jobs.PRIORITIES]
+    SimpleWorker(queues, connection=connection).work(burst=True)
+
+
+def test_unknown_priority(connection):
+    with pytest.raises(ValueError):
+        jobs.queue('urgent', connection)
+
+
+def test_priority_order(connection):
+    for guid, priority in [
+        ('low-1', 'low'),
+        ('default-1', 'default'),
+        ('low-2', 'low'),
+        ('high-1', 'high'),
+    ]:
+        jobs.submit(guid, priority, connection, func=process)
+    assert jobs.depths(connection) == {'high': 1, 'default': 1, 'low': 2}
+    work(connection)
+    assert processed == ['high-1', 'default-1', 'low-1', 'low-2']
+
+
+def test_parameters_and_backpressure(connection):
+    job = jobs.submit('guid', connection=connection, func=process, batch_id=3)
+    assert job.kwargs == {'batch_id': 3}
+    assert job.meta['backpressure'] == 0
+    assert job.retries_left == JOB_RETRIES
+
+
+def test_full_queue_times_out(connection):
+    jobs.submit('a', connection=connection, func=process)
+    jobs.submit('b', connection=connection, func=process)
+    with pytest.raises(QueueFullError):
+        jobs.submit('c', connection=connection, func=process, max_depth=2, timeout=0.3)
+    assert jobs.depths(connection)['default'] == 2
+
+
+def test_waits_for_room(connection):
+    q = jobs.queue('default', connection)
+    first = jobs.submit('a', connection=connection, func=process)
+    Timer(0.3, q.remove, [first]).start()
+    job = jobs.submit('b', connection=connection, func=process, max_depth=1, timeout=5)
+    assert job.meta['backpressure'] >= 0.2
+    assert q.job_ids == [job.id]
+
+
+def test_failed_jobs_are_retried_later(connection):
+    job = jobs.submit('guid', connection=connection, func=fail)
+    work(connection)
+    job.refresh()
+    assert job.get_status() == 'scheduled'
+    assert job.retries_left == JOB_RETRIES - 1
+    registry = ScheduledJobRegistry(queue=jobs.queue('default', connection))
+    assert registry.get_job_ids() == [job.id]
+
+
+def test_requeue_abandoned(connection):
+    q = jobs.queue('default', connection)
+    retried = jobs.submit('retried', connection=connection, func=process)
+    exhausted = jobs.submit('exhausted', connection=connection, func=process)
+    exhausted.retries_left = 0
+    exhausted.save()
+    # Both were started by a worker that died, so their leases expired
+    started = StartedJobRegistry(queue=q)
+    for job in (retried, exhausted):
+        q.remove(job)
+        connection.zadd(started.key, {f'{job.id}:execution': time() - 10})
+
+    assert jobs.requeue_abandoned(connection) == 2
+    retried.refresh()
+    assert retried.get_status() == 'scheduled'
+    assert FailedJobRegistry(queue=q).get_job_ids() == [exhausted.id]
+    assert started.get_job_ids() == []
+    assert jobs.requeue_abandoned(connection) == 0
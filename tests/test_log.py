@@ -0,0 +1,90 @@
+import subprocess
+import sys
+from io import StringIO
+from json import loads
+from pathlib import Path
+
+import pytest
+
+from mario.config import LOG_MAX_CHARS
+from mario.log import BackgroundWriter, configure, flow_log, log, summarize
+
+MMIF = {
+    'metadata': {'mmif': 'http://mmif.clams.ai/1.0.0'},
+    'documents': [{'@type': 'VideoDocument', 'properties': {'id': 'd1'}}],
+    'views': [{'id': 'v_0', 'annotations': [{'properties': {'text': 'x' * 2000}}]}],
+}
+
+
+@pytest.fixture
+def stream():
+    stream = StringIO()
+    configure('json', 'DEBUG', stream, enqueue=False)
+    yield stream
+    configure()
+
+
+def records(stream) -> list:
+    return [loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_long_messages_are_truncated(stream):
+    log.info('x' * (LOG_MAX_CHARS + 500))
+    message = records(stream)[0]['message']
+    assert message.startswith('x' * LOG_MAX_CHARS + '... ')
+    assert f'[{LOG_MAX_CHARS + 500} chars, sha1 ' in message
+
+
+def test_large_bound_values_are_summarized(stream):
+    log.bind(mmif=MMIF, text='y' * (LOG_MAX_CHARS + 1), guid='cpb-1', n=3).info('Hi')
+    record = records(stream)[0]
+    assert record['mmif'] == summarize(MMIF)
+    assert record['mmif']['views'] == 1
+    assert record['mmif']['annotations'] == 1
+    assert record['text']['chars'] == LOG_MAX_CHARS + 1
+    assert (record['guid'], record['n'], record['message']) == ('cpb-1', 3, 'Hi')
+
+
+def test_small_mmifs_are_logged_whole():
+    small = {**MMIF, 'views': []}
+    assert summarize(small) == small
+
+
+def test_flow_log_binds_context(stream):
+    class Flow:
+        guid = 'cpb-1'
+        batch_id = 'null'
+
+    flow_log(Flow()).info('Hi')
+    record = records(stream)[0]
+    assert record['guid'] == 'cpb-1'
+    # Null parameters are left out
+    assert 'batch_id' not in record
+
+
+def test_background_writer_writes_everything_queued():
+    stream = StringIO()
+    writer = BackgroundWriter(stream)
+    for i in range(1000):
+        writer.write(f'{i}\n')
+    writer.stop()
+    assert stream.getvalue().splitlines() == [str(i) for i in range(1000)]
+    assert not writer.thread.is_alive()
+
+
+def test_background_writer_flushes_at_exit():
+    code = (
+        'from mario.log import log\n'
+        'for i in range(500):\n'
+        '    log.info(f"record {i}")\n'
+    )
+    result = subprocess.run(
+        [sys.executable, '-c', code],
+        env={'LOG_FORMAT': 'json', 'PATH': ''},
+        cwd=Path(__file__).parents[1],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    messages = [loads(line)['message'] for line in result.stderr.splitlines()]
+    assert messages == [f'record {i}' for i in range(500)]
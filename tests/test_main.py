@@ -0,0 +1,131 @@
+from json import dumps, loads
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('typer')
+
+from typer.testing import CliRunner  # noqa: E402
+
+from mario.__main__ import app  # noqa: E402
+
+MMIF = {
+    'documents': [
+        {
+            '@type': 'http://mmif.clams.ai/vocabulary/VideoDocument/v1',
+            'properties': {'id': 'd1', 'location': 'file:///media/guid.mp4'},
+        }
+    ],
+    'views': [],
+}
+
+
+@pytest.fixture
+def runner():
+    try:
+        return CliRunner(mix_stderr=False)
+    except TypeError:
+        # click 8.2 always keeps stderr separate
+        return CliRunner()
+
+
+@pytest.fixture
+def mmif(tmp_path):
+    path = tmp_path / 'input.mmif'
+    path.write_text(dumps(MMIF))
+    return str(path)
+
+
+class Apps:
+    """Stub CLAMS apps that each add an empty view"""
+
+    def __init__(self):
+        self.urls = []
+
+    def post(self, url: str, json: dict, **kwargs):
+        self.urls.append(url)
+        view = {
+            'id': f'v_{len(json["views"])}',
+            'metadata': {'app': url},
+            'annotations': [{'@type': 'TimeFrame'}],
+        }
+        output = {**json, 'views': [*json['views'], view]}
+        return SimpleNamespace(status_code=200, json=lambda: output)
+
+
+def test_run(runner, mmif, tmp_path, monkeypatch):
+    from mario import client
+
+    apps = Apps()
+    monkeypatch.setattr(client, 'client', lambda: apps)
+    output = tmp_path / 'output.mmif'
+
+    result = runner.invoke(
+        app,
+        ['run', mmif, '--pipeline', 'http://app-a,http://app-b', '-o', str(output)],
+    )
+    assert result.exit_code == 0, result.stderr
+    assert apps.urls == ['http://app-a', 'http://app-b']
+    assert 'Ran 2 apps' in result.stderr
+    views = loads(output.read_text())['views']
+    assert [view['metadata']['app'] for view in views] == apps.urls
+
+    result = runner.invoke(app, ['run', mmif, '--pipeline', 'http://app-a'])
+    assert result.exit_code == 0, result.stderr
+    assert len(loads(result.stdout)['views']) == 1
+
+
+def test_run_empty_spec(runner, mmif):
+    result = runner.invoke(app, ['run', mmif, '--spec', '[]'])
+    assert result.exit_code == 0, result.stderr
+    assert 'Ran 0 apps' in result.stderr
+    assert loads(result.stdout) == MMIF
+
+
+def test_run_needs_a_pipeline(runner, mmif):
+    result = runner.invoke(app, ['run', mmif])
+    assert result.exit_code == 2
+    assert 'Give a --pipeline or a --spec' in result.stderr
+
+
+def test_inspect(runner, mmif, tmp_path):
+    spec = tmp_path / 'spec.json'
+    spec.write_text(
+        dumps(
+            [
+                {'name': 'whisper', 'url': 'http://app-whisper'},
+                {
+                    'name': 'ner',
+                    'url': 'http://app-spacy',
+                    'after': ['whisper'],
+                    'consumes': ['TextDocument'],
+                },
+            ]
+        )
+    )
+    result = runner.invoke(app, ['inspect', '--spec', f'@{spec}'])
+    assert result.exit_code == 0, result.stderr
+    lines = result.stdout.splitlines()
+    assert lines[0].split() == ['0', 'whisper', 'http://app-whisper', 'after:', '-']
+    assert 'after: whisper' in lines[1]
+    assert 'consumes: TextDocument' in lines[1]
+
+    result = runner.invoke(app, ['inspect', mmif])
+    assert result.exit_code == 0, result.stderr
+    assert result.stdout.splitlines() == [
+        'd1  http://mmif.clams.ai/vocabulary/VideoDocument/v1',
+        '    file:///media/guid.mp4',
+    ]
+
+
+def test_importtime(runner):
+    result = runner.invoke(app, ['importtime', 'mario.config', '--budget', '5'])
+    assert result.exit_code == 0, result.stdout
+    assert 'mario.config' in result.stdout
+    assert 'Slowest imports' not in result.stdout
+
+
+def test_importtime_over_budget(runner):
+    result = runner.invoke(app, ['importtime', 'mario.config', '--budget', '0'])
+    assert result.exit_code == 1
+    assert 'Slowest imports of mario.config:' in result.stdout
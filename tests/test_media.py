@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+from os import utime
+from threading import Lock
+from time import sleep, time
+from types import SimpleNamespace
+
+import pytest
+
+from mario.media import MediaCache
+
+DAY = 24 * 60 * 60
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return MediaCache(str(tmp_path / '.cache'), max_bytes=0, max_age=DAY)
+
+
+def fetcher(size: int = 1000, delay: float = 0):
+    """A fetch that writes `size` bytes, recording each call"""
+    calls = []
+    lock = Lock()
+
+    def fetch(path: str) -> str:
+        with lock:
+            calls.append(path)
+        sleep(delay)
+        with open(path, 'wb') as f:
+            f.write(b'x' * size)
+        return 'downloaded'
+
+    fetch.calls = calls
+    return fetch
+
+
+def age(path: str, seconds: float) -> None:
+    used = time() - seconds
+    utime(path, (used, used))
+
+
+def test_miss_then_hit(cache):
+    fetch = fetcher()
+    media, result = cache.acquire('1', 'guid@Flow/1', fetch)
+    assert result == 'downloaded'
+    assert cache.acquire('1', 'guid@Flow/2', fetch) == (media, None)
+    assert len(fetch.calls) == 1
+    assert sorted(cache.refs('1')) == ['guid@Flow-1', 'guid@Flow-2']
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.stores) == (1, 1, 1)
+
+
+def test_concurrent_runs_share_one_download(cache):
+    fetch = fetcher(delay=0.1)
+    with ThreadPoolExecutor(8) as pool:
+        results = list(
+            pool.map(lambda i: cache.acquire('1', f'guid@Flow/{i}', fetch), range(8))
+        )
+    assert len(fetch.calls) == 1
+    assert len({media for media, _ in results}) == 1
+    assert len(cache.refs('1')) == 8
+    assert (cache.stats.hits, cache.stats.misses) == (7, 1)
+
+
+def test_lock_is_exclusive(cache):
+    with cache.lock('1') as locked:
+        assert locked
+        with cache.lock('1', blocking=False) as again:
+            assert not again
+    with cache.lock('1', blocking=False) as locked:
+        assert locked
+
+
+def test_eviction_skips_referenced_entries(cache):
+    cache.max_bytes = 1500
+    cache.acquire('old', 'guid@Flow/1', fetcher())
+    cache.acquire('older', 'guid@Flow/2', fetcher())
+    age(cache.path('older'), 60)
+    cache.release('older', 'guid@Flow/2')
+    # Making room for a new entry may only evict the released one
+    cache.acquire('new', 'guid@Flow/3', fetcher())
+    assert sorted(asset for asset, _, _ in cache.entries()) == ['new', 'old']
+    assert cache.stats.evictions == 1
+    # Still over budget, but every entry left is in use
+    assert cache.evict() == 0
+
+
+def test_eviction_is_least_recently_used_first(cache):
+    cache.max_bytes = 2500
+    for asset, seconds in [('a', 30), ('b', 20), ('c', 10)]:
+        cache.acquire(asset, 'guid@Flow/1', fetcher())
+        cache.release(asset, 'guid@Flow/1')
+        age(cache.path(asset), seconds)
+    # Making room for d evicts a, and evicting after it fits the budget
+    cache.acquire('d', 'guid@Flow/2', fetcher())
+    assert sorted(asset for asset, _, _ in cache.entries()) == ['b', 'c', 'd']
+    assert cache.evict() == 1
+    assert sorted(asset for asset, _, _ in cache.entries()) == ['c', 'd']
+    assert cache.stats.evictions == 2
+
+
+def test_default_budget_is_half_the_space_the_cache_could_use(cache, monkeypatch):
+    from mario import media
+
+    cache.max_bytes = None
+    for asset in ('a', 'b', 'c'):
+        cache.acquire(asset, 'guid@Flow/1', fetcher())
+        cache.release(asset, 'guid@Flow/1')
+    age(cache.path('a'), 20)
+    age(cache.path('b'), 10)
+    # 3000 bytes cached and 1000 free on the volume: a budget of 2000
+    monkeypatch.setattr(media, 'disk_usage', lambda path: SimpleNamespace(free=1000))
+    assert cache.budget(3000) == 2000
+    assert cache.evict() == 1
+    assert sorted(asset for asset, _, _ in cache.entries()) == ['b', 'c']
+
+
+def test_stale_refs_do_not_keep_entries(cache):
+    cache.acquire('1', 'guid@Flow/1', fetcher())
+    # Left behind by a crashed run, and unused for longer than max_age
+    age(cache.ref_path('1', 'guid@Flow/1'), 2 * DAY)
+    age(cache.path('1'), 2 * DAY)
+    assert cache.refs('1') == []
+    assert cache.evict() == 1
+    assert cache.entries() == []
+
+
+def test_locked_entries_are_not_deleted(cache):
+    cache.acquire('1', 'guid@Flow/1', fetcher())
+    cache.release('1', 'guid@Flow/1')
+    with cache.lock('1'):
+        assert not cache.delete('1')
+    assert cache.delete('1')
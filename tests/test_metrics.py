@@ -0,0 +1,170 @@
+from http.server import BaseHTTPRequestHandler
+from json import dumps
+from time import time
+
+from mario.config import PUSHGATEWAY_RETENTION
+from mario.metrics import FAMILIES, aggregate, export, exposition
+
+SPANS = [
+    {'name': 'download', 'seconds': 1.5, 'bytes': 1000},
+    {'name': 'app', 'app': 'http://whisper', 'seconds': 2.0, 'mmif_bytes': 300},
+    {'name': 'app', 'app': 'http://whisper', 'seconds': 1.0, 'error': 'boom'},
+    {'name': 'app', 'app': 'http://bars', 'seconds': 0.5, 'cache': 'hit'},
+    {'name': 'app', 'app': 'http://bars', 'seconds': 0.2, 'proxy': True},
+]
+LABELS = {'flow': 'Pipeline', 'run_id': '1'}
+
+
+def samples(text: str) -> dict:
+    """{sample with labels: value} of every line that is not a comment"""
+    return dict(
+        line.rsplit(' ', 1) for line in text.splitlines() if not line.startswith('#')
+    )
+
+
+def test_aggregate():
+    totals = aggregate(SPANS)
+    assert totals['app', 'http://whisper', ''] == {
+        'seconds': 3.0,
+        'calls': 2,
+        'errors': 1,
+        'bytes': 0,
+        'hits': 0,
+        'mmif_bytes': 300,
+    }
+    assert totals['app', 'http://bars', '']['hits'] == 1
+    assert totals['app', 'http://bars', 'true']['seconds'] == 0.2
+    assert totals['download', '', '']['bytes'] == 1000
+
+
+def test_openmetrics_exposition():
+    text = exposition(SPANS, LABELS)
+    assert text.endswith('\n# EOF\n')
+    lines = text.splitlines()
+    for name, (kind, unit, _, _) in FAMILIES.items():
+        # Metadata comes before the family's samples, and units are suffixes
+        start = lines.index(f'# TYPE {name} {kind}')
+        if unit:
+            assert lines[start + 1] == f'# UNIT {name} {unit}'
+            assert name.endswith(f'_{unit}')
+        sample = f'{name}_total' if kind == 'counter' else name
+        family = [line for line in lines if line.startswith(sample + '{')]
+        assert family
+        assert all(lines.index(line) > start for line in family)
+
+    values = samples(text)
+    labels = 'flow="Pipeline",run_id="1",phase="app",app="http://whisper"'
+    assert values[f'mario_phase_seconds{{{labels}}}'] == '3.0'
+    assert values[f'mario_phase_calls{{{labels}}}'] == '2'
+    assert values[f'mario_phase_errors{{{labels}}}'] == '1'
+    assert values[f'mario_mmif_bytes{{{labels}}}'] == '300'
+    download = 'flow="Pipeline",run_id="1",phase="download"'
+    assert values[f'mario_phase_bytes{{{download}}}'] == '1000'
+    # Gauges are only sampled for phases that saw an mmif
+    assert f'mario_mmif_bytes{{{download}}}' not in values
+    # Apps sent a proxy are counted apart from the same app sent the media
+    bars = 'flow="Pipeline",run_id="1",phase="app",app="http://bars"'
+    assert values[f'mario_phase_seconds{{{bars}}}'] == '0.5'
+    assert values[f'mario_phase_seconds{{{bars},proxy="true"}}'] == '0.2'
+
+
+def test_prometheus_exposition():
+    text = exposition(SPANS, openmetrics=False)
+    assert '# UNIT' not in text
+    assert '# EOF' not in text
+    assert 'mario_phase_calls{phase="download"} 1' in text.splitlines()
+
+
+def test_labels_are_escaped():
+    text = exposition([{'name': 'app', 'app': 'a"b\\c\nd'}])
+    assert 'app="a\\"b\\\\c\\nd"' in text
+
+
+def test_export_writes_file(tmp_path):
+    path = str(tmp_path / 'metrics' / 'mario.prom')
+    text = export(SPANS, LABELS, path=path, gateway=None)
+    with open(path) as f:
+        assert f.read() == text
+    assert not (tmp_path / 'metrics' / 'mario.prom.tmp').exists()
+
+
+def test_export_never_raises(tmp_path, monkeypatch):
+    from mario import client
+
+    monkeypatch.setattr(client, 'sleep', lambda seconds: None)
+    # Nothing listens on port 9, so the push fails, and is only logged
+    path = str(tmp_path / 'mario.prom')
+    text = export(SPANS, LABELS, path=path, gateway='http://127.0.0.1:9')
+    assert text.endswith('# EOF\n')
+
+
+class Pushgateway(BaseHTTPRequestHandler):
+    """Stores pushed groups by path, and lists and deletes them like a Pushgateway"""
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status: int, body: bytes = b''):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):  # noqa: N802
+        text = self.rfile.read(int(self.headers['Content-Length'])).decode()
+        self.server.groups[self.path] = (text, time())
+        self.reply(200)
+
+    def do_DELETE(self):  # noqa: N802
+        self.server.groups.pop(self.path, None)
+        self.reply(202)
+
+    def do_GET(self):  # noqa: N802
+        data = []
+        for path, (_, pushed) in self.server.groups.items():
+            parts = path.split('/')[2:]
+            labels = dict(zip(parts[::2], parts[1::2]))
+            series = {'time_series': [{'value': str(pushed)}]}
+            data.append({'labels': labels, 'push_time_seconds': series})
+        self.reply(200, dumps({'status': 'success', 'data': data}).encode())
+
+
+def test_runs_of_a_flow_push_to_their_own_groups(serve):
+    gateway = serve(Pushgateway, '', groups={})
+    run_1 = {'flow': 'Pipeline', 'run_id': '1', 'guid': 'cpb-aacip-1'}
+    run_2 = {'flow': 'Pipeline', 'run_id': '2', 'guid': 'cpb-aacip-2'}
+    export(SPANS, run_1, path=None, gateway=gateway.url)
+    export(SPANS[:1], run_2, path=None, gateway=gateway.url)
+
+    # The second run does not replace the first, so both can be scraped
+    group = '/metrics/job/mario/flow/Pipeline/run_id/{}/guid/cpb-aacip-{}'
+    assert set(gateway.groups) == {group.format(1, 1), group.format(2, 2)}
+    first = samples(gateway.groups[group.format(1, 1)][0])
+    second = samples(gateway.groups[group.format(2, 2)][0])
+    assert first['mario_phase_calls{phase="download"}'] == '1'
+    assert first['mario_phase_calls{phase="app",app="http://whisper"}'] == '2'
+    assert list(second) == [
+        'mario_phase_seconds{phase="download"}',
+        'mario_phase_calls{phase="download"}',
+        'mario_phase_errors{phase="download"}',
+        'mario_phase_bytes{phase="download"}',
+        'mario_phase_cache_hits{phase="download"}',
+    ]
+    assert '# TYPE mario_phase_seconds gauge' in gateway.groups[group.format(2, 2)][0]
+
+
+def test_old_groups_are_deleted(serve, monkeypatch):
+    from mario import metrics
+
+    gateway = serve(Pushgateway, '', groups={})
+    export(SPANS, {**LABELS, 'guid': 'a'}, path=None, gateway=gateway.url)
+    gateway.groups = {
+        path: (text, pushed - 2 * PUSHGATEWAY_RETENTION)
+        for path, (text, pushed) in gateway.groups.items()
+    }
+    export(SPANS, {**LABELS, 'run_id': '2'}, path=None, gateway=gateway.url)
+    assert list(gateway.groups) == ['/metrics/job/mario/flow/Pipeline/run_id/2']
+    # Values with a slash are base64 encoded in the group's path
+    assert metrics.group_url('http://gw/', 'mario', {'flow': 'a/b', 'guid': ''}) == (
+        'http://gw/metrics/job/mario/flow@base64/YS9i/guid@base64/='
+    )
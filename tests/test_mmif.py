@@ -0,0 +1,224 @@
+from io import BytesIO
+
+import pytest
+
+from mario.mmif import (
+    ENCODINGS,
+    MAGIC,
+    MMIFRef,
+    download,
+    project,
+    read,
+    relocate,
+    rewrite_refs,
+    run_projected,
+    splice,
+    type_name,
+    upload,
+    write,
+)
+
+TIME_FRAME = 'http://mmif.clams.ai/vocabulary/TimeFrame/v5'
+TEXT = 'http://mmif.clams.ai/vocabulary/TextDocument/v1'
+ALIGNMENT = 'http://mmif.clams.ai/vocabulary/Alignment/v1'
+
+
+def view(id: str, contains: str, **properties) -> dict:
+    return {
+        'id': id,
+        'metadata': {'contains': {contains: {}}},
+        'annotations': [{'@type': contains, 'properties': {'id': 'a1', **properties}}],
+    }
+
+
+FULL = {
+    'metadata': {'mmif': 'http://mmif.clams.ai/1.0.0'},
+    'documents': [{'properties': {'id': 'd1'}}],
+    'views': [
+        view('v_0', TIME_FRAME),
+        view('v_1', TEXT),
+        view('v_2', ALIGNMENT, source='v_1:a1', target='v_0:a1'),
+        view('v_3', 'http://vocab/Other/v1'),
+    ],
+}
+
+
+def ids(mmif: dict) -> list:
+    return [view['id'] for view in mmif['views']]
+
+
+def test_type_name():
+    assert type_name(TIME_FRAME) == 'TimeFrame'
+    assert type_name('http://vocab/Thing/') == 'Thing'
+    assert type_name('Thing') == 'Thing'
+
+
+def test_project_keeps_consumed_and_referenced_views():
+    assert ids(project(FULL, [TEXT])) == ['v_1']
+    # Alignment refers to both other views, so they are sent too
+    assert ids(project(FULL, ['Alignment'])) == ['v_0', 'v_1', 'v_2']
+    assert project(FULL, None) is FULL
+    assert ids(project(FULL, [])) == []
+    assert project(FULL, ['TimeFrame', 'TextDocument', 'Alignment', 'Other']) is FULL
+
+
+def test_rewrite_refs():
+    renamed = rewrite_refs(FULL['views'][2], {'v_1': 'v_9'})
+    properties = renamed['annotations'][0]['properties']
+    assert properties['source'] == 'v_9:a1'
+    assert properties['target'] == 'v_0:a1'
+    # Plain ids and unknown views are left alone
+    assert rewrite_refs('v_1', {'v_1': 'v_9'}) == 'v_1'
+    assert rewrite_refs('x:a1', {'v_1': 'v_9'}) == 'x:a1'
+
+
+def test_rewrite_refs_leaves_text_alone():
+    annotation = {
+        '@type': TEXT,
+        'properties': {
+            'id': 'a2',
+            'text': 'v_1:a1',
+            'targets': ['v_1:a1', 'v_0:a1'],
+            'document': 'v_1:a1',
+        },
+    }
+    properties = rewrite_refs(annotation, {'v_1': 'v_9'})['properties']
+    # Text that looks like a reference is not one
+    assert properties['text'] == 'v_1:a1'
+    assert properties['targets'] == ['v_9:a1', 'v_0:a1']
+    assert properties['document'] == 'v_9:a1'
+    # Nor is it followed by project
+    quoted = view('v_4', 'http://vocab/Quote/v1', text='v_1:a1')
+    mmif = {**FULL, 'views': [*FULL['views'], quoted]}
+    assert ids(project(mmif, ['Quote'])) == ['v_4']
+
+
+def test_project_splice_round_trip():
+    sent = project(FULL, ['TextDocument'])
+    added = view('v_4', 'NamedEntity', source='v_1:a1')
+    output = {**sent, 'views': [*sent['views'], added]}
+    spliced = splice(FULL, sent, output)
+    # Every view is kept, and the new one is added as the app named it
+    assert spliced['views'] == [*FULL['views'], added]
+    assert spliced['documents'] == FULL['documents']
+    assert spliced['metadata'] == FULL['metadata']
+
+
+def test_splice_renames_clashing_views_and_their_refs():
+    sent = project(FULL, ['TextDocument'])
+    added = [
+        view('v_2', 'NamedEntity', source='v_1:a1'),
+        view('v_3', 'Summary', source='v_2:a1'),
+    ]
+    output = {**sent, 'views': [*sent['views'], *added]}
+    spliced = splice(FULL, sent, output)
+    assert ids(spliced) == ['v_0', 'v_1', 'v_2', 'v_3', 'v_4', 'v_5']
+    # Views from before the app are untouched
+    assert spliced['views'][:4] == FULL['views']
+    entity, summary = spliced['views'][4:]
+    # References to the app's own views follow their new ids, and
+    # references to views it was sent keep theirs
+    assert entity['annotations'][0]['properties']['source'] == 'v_1:a1'
+    assert summary['annotations'][0]['properties']['source'] == 'v_4:a1'
+    assert entity['metadata']['contains'] == {'NamedEntity': {}}
+
+
+def test_relocate_moves_media_documents_to_the_workspace():
+    mmif = {
+        'documents': [
+            {'properties': {'id': 'd1', 'location': 'file:///m/work/g/old/a.mp4'}},
+            {'properties': {'id': 'd2', 'location': '/m/a.16k.wav'}},
+            {'properties': {'id': 'd3', 'location': 'file:///m/other.mp4'}},
+            {'properties': {'id': 'd4', 'location': 's3://bucket/a.mp4'}},
+        ],
+        'views': [],
+    }
+    moved = relocate(mmif, '/m/work/g/new', ['a.mp4', 'a.16k.wav'])
+    locations = [doc['properties']['location'] for doc in moved['documents']]
+    assert locations == [
+        'file:///m/work/g/new/a.mp4',
+        '/m/work/g/new/a.16k.wav',
+        'file:///m/other.mp4',
+        's3://bucket/a.mp4',
+    ]
+    # The original is not changed, and is returned if nothing moves
+    assert mmif['documents'][0]['properties']['location'].endswith('old/a.mp4')
+    assert relocate(moved, '/m/work/g/new', ['a.mp4']) is moved
+
+
+BUCKET = 'clams-mmif'
+
+
+@pytest.fixture(params=ENCODINGS)
+def encoding(request):
+    if request.param == 'zstd':
+        pytest.importorskip('zstandard')
+    return request.param
+
+
+@pytest.fixture
+def client(monkeypatch):
+    moto = pytest.importorskip('moto')
+    from mario import s3
+
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        s3.s3.cache_clear()
+        client = s3.s3()
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+    s3.s3.cache_clear()
+
+
+def encoded(encoding: str) -> bytes:
+    f = BytesIO()
+    write(FULL, f, encoding)
+    return f.getvalue()
+
+
+def test_write_and_read(encoding):
+    data = encoded(encoding)
+    magic = {name: magic for magic, name in MAGIC.items()}.get(encoding, b'{')
+    assert data.startswith(magic)
+    assert read(BytesIO(data), encoding) == FULL
+    # and detected when the encoding is not known
+    assert read(BytesIO(data)) == FULL
+
+
+def test_upload_and_download(client, encoding):
+    size = upload(FULL, BUCKET, 'guid.mmif', encoding, client=client)
+    head = client.head_object(Bucket=BUCKET, Key='guid.mmif')
+    assert head['ContentLength'] == size
+    assert head['ContentType'] == 'application/json'
+    if encoding == 'identity':
+        assert 'ContentEncoding' not in head
+    else:
+        assert head['ContentEncoding'] == encoding
+    assert download(BUCKET, 'guid.mmif', client=client) == FULL
+    assert MMIFRef(f's3://{BUCKET}/guid.mmif').load() == FULL
+
+
+def test_legacy_objects_without_a_content_encoding(client, encoding):
+    client.put_object(Bucket=BUCKET, Key='legacy.mmif', Body=encoded(encoding))
+    assert 'ContentEncoding' not in client.head_object(Bucket=BUCKET, Key='legacy.mmif')
+    assert download(BUCKET, 'legacy.mmif', client=client) == FULL
+    assert MMIFRef(f's3://{BUCKET}/legacy.mmif').load() == FULL
+
+
+def test_run_projected():
+    sent = []
+
+    def ner(mmif: dict) -> dict:
+        sent.append(ids(mmif))
+        added = view('v_2', 'NamedEntity', source='v_1:a1')
+        return {**mmif, 'views': [*mmif['views'], added]}
+
+    output = run_projected(FULL, ner, ['TextDocument'])
+    assert sent == [['v_1']]
+    # The new view's id is taken in the full mmif, so it and its refs are renamed
+    assert ids(output) == ['v_0', 'v_1', 'v_2', 'v_3', 'v_4']
+    assert output['views'][-1]['annotations'][0]['properties']['source'] == 'v_1:a1'
+    # Apps that read everything are sent the mmif itself
+    assert run_projected(FULL, lambda mmif: mmif) is FULL
@@ -0,0 +1,100 @@
+from time import sleep
+
+import pytest
+
+from mario.phases import Phase, run_phases
+from mario.pipelines.utils import PipelineUtils
+
+
+def timed(name: str, seconds: float, order: list):
+    def phase():
+        order.append(f'{name} started')
+        sleep(seconds)
+        order.append(f'{name} done')
+
+    return phase
+
+
+def test_dependencies_run_first_and_independent_phases_overlap():
+    order = []
+    timings = run_phases(
+        [
+            Phase('asset', timed('asset', 0.05, order)),
+            Phase('mmif', timed('mmif', 0.2, order), after=('asset',)),
+            Phase('media', timed('media', 0.2, order), after=('asset',)),
+        ]
+    )
+    assert order[:2] == ['asset started', 'asset done']
+    assert set(order[2:4]) == {'mmif started', 'media started'}
+    phases = timings['phases']
+    assert phases['mmif']['start'] >= phases['asset']['end']
+    assert phases['media']['start'] >= phases['asset']['end']
+    # mmif and media ran at the same time, so the run took about 0.25s, not 0.45s
+    assert phases['mmif']['start'] < phases['media']['end']
+    assert phases['media']['start'] < phases['mmif']['end']
+    assert timings['wall'] < 0.4
+    assert timings['saved'] == pytest.approx(timings['serial'] - timings['wall'])
+
+
+def test_unknown_dependency():
+    with pytest.raises(ValueError, match='unknown'):
+        run_phases([Phase('media', lambda: None, after=('asset',))])
+
+
+def test_cycle():
+    ran = []
+    with pytest.raises(ValueError, match='cycle'):
+        run_phases(
+            [
+                Phase('ok', lambda: ran.append('ok')),
+                Phase('a', lambda: ran.append('a'), after=('b',)),
+                Phase('b', lambda: ran.append('b'), after=('a',)),
+            ]
+        )
+    assert ran == ['ok']
+
+
+def test_first_failure_is_raised_and_stops_dependents():
+    order = []
+
+    def fail():
+        sleep(0.05)
+        raise RuntimeError('asset lookup failed')
+
+    with pytest.raises(RuntimeError, match='asset lookup failed'):
+        run_phases(
+            [
+                Phase('asset', fail),
+                Phase('mmif', timed('mmif', 0.1, order)),
+                Phase('media', timed('media', 0, order), after=('asset',)),
+            ]
+        )
+    # Phases already running finish, but nothing that depends on the failure runs
+    assert order == ['mmif started', 'mmif done']
+
+
+class Prepared(PipelineUtils):
+    """PipelineUtils with each phase of `prepare` replaced by a timed stub"""
+
+    mmif_location = None
+
+    def __init__(self):
+        self.order = []
+
+    def get_asset_id(self):
+        timed('asset', 0.05, self.order)()
+
+    def get_input_mmif(self):
+        timed('mmif', 0.2, self.order)()
+
+    def download_media_file(self):
+        timed('media', 0.2, self.order)()
+
+
+def test_prepare_overlaps_the_mmif_and_media():
+    prepared = Prepared()
+    prepared.prepare()
+    assert prepared.order[:2] == ['asset started', 'asset done']
+    assert set(prepared.order[2:4]) == {'mmif started', 'media started'}
+    assert set(prepared.phase_timings['phases']) == {'asset', 'mmif', 'media'}
+    assert prepared.phase_timings['wall'] < 0.4
@@ -0,0 +1,139 @@
+from shutil import which
+from subprocess import CompletedProcess, run
+
+import pytest
+
+from mario import preprocess
+from mario.preprocess import (
+    AUDIO_DOCUMENT,
+    PROXIES,
+    VIDEO_DOCUMENT,
+    add_documents,
+    documents_for,
+    make_proxies,
+    proxy_stats,
+)
+
+MMIF = {
+    'metadata': {'mmif': 'http://mmif.clams.ai/1.0.0'},
+    'documents': [{'@type': VIDEO_DOCUMENT, 'properties': {'id': 'd1'}}],
+    'views': [],
+}
+
+
+@pytest.fixture
+def ffmpeg(monkeypatch):
+    """Record ffmpeg commands instead of running them, for media with `streams`"""
+    calls = []
+
+    def fake(cmd, **kwargs):
+        calls.append(cmd)
+        if cmd[0] == 'ffprobe':
+            return CompletedProcess(cmd, 0, '\n'.join(fake.streams) + '\n')
+        for need in PROXIES.values():
+            for path in cmd:
+                if path.endswith(need.suffix):
+                    with open(path, 'wb') as f:
+                        f.write(b'x' * 10)
+        return CompletedProcess(cmd, 0)
+
+    fake.streams = ['video', 'audio']
+    fake.calls = calls
+    monkeypatch.setattr(preprocess, 'run', fake)
+    return fake
+
+
+def test_one_ffmpeg_run_makes_every_proxy(ffmpeg, tmp_path):
+    media = str(tmp_path / 'media.mp4')
+    proxies = make_proxies(media, ['audio', 'frames', 'video', 'unknown', 'audio'])
+    assert sorted(proxies) == ['audio', 'frames']
+    assert proxies['audio']['path'] == str(tmp_path / 'media.16k.wav')
+    assert proxies['audio']['bytes'] == 10
+    commands = [cmd[0] for cmd in ffmpeg.calls]
+    assert commands == ['ffprobe', 'ffmpeg']
+    assert ffmpeg.calls[1].count(media) == 1
+
+
+def test_proxies_of_missing_streams_are_skipped(ffmpeg, tmp_path):
+    ffmpeg.streams = ['video']
+    media = str(tmp_path / 'silent.mp4')
+    assert make_proxies(media, ['audio']) == {}
+    assert sorted(make_proxies(media, ['audio', 'frames'])) == ['frames']
+
+
+def test_no_needs_runs_nothing(ffmpeg, tmp_path):
+    assert make_proxies(str(tmp_path / 'media.mp4'), ['video']) == {}
+    assert ffmpeg.calls == []
+
+
+def test_proxy_stats(tmp_path):
+    media = tmp_path / 'media.mp4'
+    media.write_bytes(b'x' * 1000)
+    proxies = {'audio': {'bytes': 100}, 'frames': {'bytes': 300}}
+    stats = proxy_stats(str(media), proxies, [['audio'], ['frames', 'video'], []])
+    # Only the app that reads the audio alone skips the original
+    assert stats == {
+        'source_bytes': 1000,
+        'proxy_bytes': {'audio': 100, 'frames': 300},
+        'bytes_saved': 900,
+    }
+
+
+def test_add_documents():
+    mmif = {**MMIF, 'documents': list(MMIF['documents'])}
+    ids = add_documents(mmif, {'audio': {'path': '/m/media.16k.wav'}})
+    assert ids == {'audio': 'd2'}
+    assert mmif['documents'][1] == {
+        '@type': AUDIO_DOCUMENT,
+        'properties': {
+            'id': 'd2',
+            'mime': 'audio/wav',
+            'location': 'file:///m/media.16k.wav',
+        },
+    }
+
+
+def test_documents_for():
+    mmif = {**MMIF, 'documents': list(MMIF['documents'])}
+    ids = add_documents(
+        mmif, {'audio': {'path': '/m/a.wav'}, 'frames': {'path': '/m/f.mp4'}}
+    )
+
+    def documents(needs):
+        sent = documents_for(mmif, needs, ids)
+        return [document['properties']['id'] for document in sent['documents']]
+
+    # A proxy replaces the original video, unless the app needs that too
+    assert documents(['audio']) == [ids['audio']]
+    assert documents(['frames']) == [ids['frames']]
+    assert documents(['audio', 'video']) == ['d1', ids['audio']]
+    # Apps without needs see the original alone
+    assert documents([]) == ['d1']
+    assert documents_for(mmif, ['audio'], {}) is mmif
+
+
+@pytest.mark.skipif(not which('ffmpeg'), reason='ffmpeg is not installed')
+def test_real_proxies(tmp_path):
+    media = str(tmp_path / 'media.mp4')
+    run(
+        [
+            'ffmpeg',
+            '-loglevel',
+            'error',
+            '-f',
+            'lavfi',
+            '-i',
+            'testsrc=duration=2:size=160x120:rate=30',
+            '-f',
+            'lavfi',
+            '-i',
+            'sine=duration=2',
+            '-shortest',
+            media,
+        ],
+        check=True,
+    )
+    proxies = make_proxies(media, ['audio', 'frames'])
+    assert sorted(proxies) == ['audio', 'frames']
+    assert all(proxy['bytes'] for proxy in proxies.values())
+    assert preprocess.streams(proxies['audio']['path']) == {'audio'}
@@ -0,0 +1,102 @@
+import pytest
+
+moto = pytest.importorskip('moto')
+
+from mario import s3 as transfers  # noqa: E402
+from mario.s3 import (  # noqa: E402
+    Upload,
+    parse_url,
+    transfer_config,
+    upload_bytes,
+    upload_file,
+    upload_many,
+)
+
+BUCKET = 'clams-mmif'
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'test')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'test')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        # The shared client must be made inside the mock, and not outlive it
+        transfers.s3.cache_clear()
+        client = transfers.s3()
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+    transfers.s3.cache_clear()
+
+
+def parts(client, key: str) -> int:
+    """Parts an object was uploaded in, from its ETag. 1 if not multipart"""
+    etag = client.head_object(Bucket=BUCKET, Key=key)['ETag'].strip('"')
+    return int(etag.partition('-')[2] or 1)
+
+
+def test_parse_url():
+    assert parse_url('s3://bucket/a/b.mmif') == ('bucket', 'a/b.mmif')
+    assert parse_url('s3://bucket') == ('bucket', '')
+
+
+def test_upload_bytes(client):
+    extra = {'ContentType': 'application/json'}
+    assert upload_bytes(b'{}', BUCKET, 'a.json', extra) == 2
+    obj = client.get_object(Bucket=BUCKET, Key='a.json')
+    assert obj['Body'].read() == b'{}'
+    assert obj['ContentType'] == 'application/json'
+
+
+def test_upload_file(client, tmp_path):
+    path = tmp_path / 'media.mp4'
+    path.write_bytes(b'x' * 1000)
+    assert upload_file(str(path), BUCKET, 'media.mp4') == 1000
+    body = client.get_object(Bucket=BUCKET, Key='media.mp4')['Body'].read()
+    assert body == b'x' * 1000
+
+
+def test_multipart_threshold(client, tmp_path):
+    config = transfer_config(threshold=8 * MB, chunksize=5 * MB, concurrency=4)
+    data = bytes(range(256)) * (11 * MB // 256)
+    upload_bytes(data, BUCKET, 'large', config=config)
+    upload_bytes(data[: 7 * MB], BUCKET, 'small', config=config)
+    path = tmp_path / 'large'
+    path.write_bytes(data)
+    upload_file(str(path), BUCKET, 'large-file', config=config)
+
+    assert parts(client, 'large') == 3
+    assert parts(client, 'large-file') == 3
+    assert parts(client, 'small') == 1
+    assert client.get_object(Bucket=BUCKET, Key='large')['Body'].read() == data
+
+
+def test_upload_many(client, tmp_path):
+    path = tmp_path / 'transcript.vtt'
+    path.write_bytes(b'WEBVTT')
+    uploads = [Upload(BUCKET, f'{i}.json', data=b'{}' * i) for i in range(1, 20)] + [
+        Upload(BUCKET, 'transcript.vtt', path=str(path))
+    ]
+
+    assert upload_many(uploads, workers=4) == [2 * i for i in range(1, 20)] + [6]
+    listed = client.list_objects_v2(Bucket=BUCKET)['Contents']
+    assert len(listed) == 20
+
+
+def test_upload_many_attempts_every_upload(client):
+    uploads = [
+        Upload(BUCKET, 'a', data=b'a'),
+        Upload('missing-bucket', 'b', data=b'b'),
+        Upload(BUCKET, 'c', path='/does/not/exist'),
+        Upload(BUCKET, 'd', data=b'd'),
+    ]
+    with pytest.raises(client.exceptions.NoSuchBucket):
+        upload_many(uploads, workers=2)
+    keys = [obj['Key'] for obj in client.list_objects_v2(Bucket=BUCKET)['Contents']]
+    assert keys == ['a', 'd']
+
+
+def test_upload_missing_file(client):
+    with pytest.raises(FileNotFoundError):
+        upload_file('/does/not/exist', BUCKET, 'missing')
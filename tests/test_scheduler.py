@@ -0,0 +1,90 @@
+from time import sleep
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+from mario.scheduler import Scheduler  # noqa: E402
+
+APP = 'http://app'
+
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+
+@pytest.fixture
+def scheduler(server):
+    return Scheduler(
+        fakeredis.FakeRedis(server=server),
+        start=2,
+        minimum=1,
+        maximum=4,
+        target=1,
+        cooldown=60,
+        lease_ttl=30,
+        retry=0.05,
+    )
+
+
+def test_leases_up_to_the_limit(scheduler):
+    first, second = scheduler.try_acquire(APP), scheduler.try_acquire(APP)
+    assert first and second
+    assert scheduler.try_acquire(APP) is None
+    assert scheduler.in_flight(APP) == 2
+    scheduler.release(APP, first, 0.1, True)
+    assert scheduler.try_acquire(APP) is not None
+
+
+def test_expired_leases_are_dropped(scheduler):
+    scheduler.lease_ttl = -1
+    scheduler.try_acquire(APP), scheduler.try_acquire(APP)
+    assert scheduler.try_acquire(APP) is not None
+
+
+def test_additive_increase(scheduler):
+    limits = [scheduler.release(APP, 'lease', 0.1, True) for _ in range(20)]
+    assert limits[0] == pytest.approx(2.5)
+    assert limits == sorted(limits)
+    assert limits[-1] == 4
+
+
+def test_multiplicative_decrease_once_per_cooldown(scheduler):
+    scheduler.release(APP, 'lease', 0.1, True)
+    assert scheduler.release(APP, 'lease', 0.1, False) == pytest.approx(1.25)
+    assert scheduler.release(APP, 'lease', 0.1, False) == pytest.approx(1.25)
+    scheduler.cooldown = 0
+    assert scheduler.release(APP, 'lease', 0.1, False) == 1
+
+
+def test_slow_responses_are_overload(scheduler):
+    assert scheduler.release(APP, 'lease', 5, True) == 1
+    assert scheduler.limit(APP) == 1
+
+
+def test_slot_releases_and_backs_off_on_errors(scheduler):
+    with pytest.raises(ValueError), scheduler.slot(APP):
+        assert scheduler.in_flight(APP) == 1
+        raise ValueError
+    assert scheduler.in_flight(APP) == 0
+    assert scheduler.limit(APP) == 1
+
+
+def test_no_connection_lets_requests_through():
+    with Scheduler().slot(APP) as lease:
+        assert lease.id is None
+
+
+def test_reconnects_after_redis_errors(scheduler, server):
+    server.connected = False
+    with scheduler.slot(APP) as lease:
+        assert lease.id is None
+    assert not scheduler.available()
+    server.connected = True
+    with scheduler.slot(APP) as lease:
+        assert lease.id is None
+    sleep(0.1)
+    with scheduler.slot(APP) as lease:
+        assert lease.id is not None
+    assert scheduler.failures == 0
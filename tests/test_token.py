@@ -0,0 +1,179 @@
+from http.server import BaseHTTPRequestHandler
+from json import dumps, loads
+from time import time
+from urllib.parse import parse_qs
+
+import pytest
+
+from mario import token as tokens
+from mario.token import Token, TokenProvider, kubernetes_api, patch_secret
+from mario.utils import TokenError
+
+
+class Handler(BaseHTTPRequestHandler):
+    """A token endpoint and the Kubernetes secrets API"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status: int, body: dict):
+        data = dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def body(self) -> bytes:
+        return self.rfile.read(int(self.headers['Content-Length']))
+
+    def do_POST(self):  # noqa: N802
+        form = parse_qs(self.body().decode())
+        self.server.requests.append(form)
+        if self.server.status != 200:
+            self.reply(self.server.status, {'error': 'access_denied'})
+            return
+        self.reply(
+            200,
+            {
+                'access_token': f'token-{len(self.server.requests)}',
+                'expires_in': self.server.expires_in,
+                'token_type': 'Bearer',
+            },
+        )
+
+    def do_PATCH(self):  # noqa: N802
+        self.server.patches.append((self.path, loads(self.body())))
+        self.reply(200, {'kind': 'Secret', 'metadata': {'name': 'secret'}})
+
+
+@pytest.fixture
+def server(serve):
+    return serve(Handler, '', requests=[], patches=[], status=200, expires_in=3600)
+
+
+@pytest.fixture
+def provider(server):
+    return TokenProvider(
+        f'{server.url}/oauth/token',
+        'client',
+        'secret',
+        'audience',
+        margin=60,
+        jitter=30,
+    )
+
+
+def test_token_url():
+    assert tokens.token_url('example.auth0.com') == (
+        'https://example.auth0.com/oauth/token'
+    )
+    assert tokens.token_url('http://localhost/token') == 'http://localhost/token'
+
+
+def test_token_is_not_in_its_repr():
+    token = Token('secret-token', time() + 60)
+    assert 'secret-token' not in repr(token)
+    assert token.header == 'Bearer secret-token'
+
+
+def test_fetches_client_credentials(provider, server):
+    token = provider.token()
+    assert token.header == 'Bearer token-1'
+    assert 3500 < token.expires_in() <= 3600
+    assert server.requests == [
+        {
+            'grant_type': ['client_credentials'],
+            'client_id': ['client'],
+            'client_secret': ['secret'],
+            'audience': ['audience'],
+        }
+    ]
+
+
+def test_cached_until_shortly_before_expiry(provider, server):
+    first = provider.token()
+    assert provider.token() is first
+    assert len(server.requests) == 1
+    # Within the refresh margin
+    provider.cached = Token('old', time() + 30)
+    assert provider.token().access_token == 'token-2'
+    assert provider.refreshes == 2
+
+
+def test_refresh_is_jittered(provider, monkeypatch):
+    assert provider.next_refresh() == 0
+    provider.cached = Token('token', time() + 1000)
+    monkeypatch.setattr(tokens, 'uniform', lambda low, high: high)
+    assert provider.next_refresh() == pytest.approx(1000 - 60 - 30, abs=1)
+    monkeypatch.setattr(tokens, 'uniform', lambda low, high: low)
+    assert provider.next_refresh() == pytest.approx(1000 - 60, abs=1)
+    provider.cached = Token('token', time() + 10)
+    assert provider.next_refresh() == 0
+
+
+def test_error_status(provider, server):
+    server.status = 403
+    with pytest.raises(TokenError, match='403'):
+        provider.token()
+    assert provider.cached is None
+
+
+class Stopper:
+    """Records the waits of the refresh loop, and stops it after `waits`"""
+
+    def __init__(self, waits: int):
+        self.waits = waits
+        self.timeouts = []
+
+    def wait(self, timeout: float) -> bool:
+        self.timeouts.append(timeout)
+        return len(self.timeouts) >= self.waits
+
+    def clear(self):
+        pass
+
+    def set(self):
+        pass
+
+
+def test_failed_refreshes_back_off(provider, server, monkeypatch):
+    monkeypatch.setattr(tokens, 'uniform', lambda low, high: 0)
+    server.status = 403
+    provider.stopped = Stopper(7)
+    provider.run()
+    # Each failed refresh waits longer before trying again
+    assert provider.stopped.timeouts[1::2] == [2.0, 4.0, 8.0]
+    assert all(timeout == 0 for timeout in provider.stopped.timeouts[::2])
+
+
+def test_backoff_resets_after_a_refresh(provider, server, monkeypatch):
+    monkeypatch.setattr(tokens, 'uniform', lambda low, high: 0)
+    refreshed = []
+    provider.on_refresh = refreshed.append
+    server.status = 403
+    stopper = provider.stopped = Stopper(4)
+
+    def wait(timeout):
+        # The endpoint recovers while waiting to retry the first failure
+        if stopper.timeouts:
+            server.status = 200
+        return Stopper.wait(stopper, timeout)
+
+    stopper.wait = wait
+    provider.run()
+    assert [token.access_token for token in refreshed] == ['token-2']
+    # Then waits for the next refresh, ahead of expiry
+    assert stopper.timeouts[-1] == pytest.approx(3600 - 60, abs=1)
+
+
+def test_patch_secret(server):
+    pytest.importorskip('kubernetes')
+    token = Token('abc', time() + 3600)
+    patch_secret(token, 'argo-events', 'chowda-token', kubernetes_api(server.url))
+    assert server.patches == [
+        (
+            '/api/v1/namespaces/argo-events/secrets/chowda-token',
+            {'stringData': {'token': 'Bearer abc'}},
+        )
+    ]
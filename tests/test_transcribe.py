@@ -0,0 +1,50 @@
+from os.path import exists
+
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('rq')
+
+from rq import SimpleWorker  # noqa: E402
+
+from mario import transcribe  # noqa: E402
+from mario.transcripts import FORMATS  # noqa: E402
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    monkeypatch.setattr(transcribe, 'WHISPER_BACKEND', 'stub')
+    monkeypatch.setattr(transcribe, 'models', {})
+
+
+def test_worker_keeps_the_model_loaded(stub, tmp_path, monkeypatch):
+    loads = []
+    stub_model = transcribe.StubModel
+    monkeypatch.setattr(
+        transcribe, 'StubModel', lambda name: loads.append(name) or stub_model(name)
+    )
+    connection = fakeredis.FakeStrictRedis()
+    media = []
+    for name in ('a', 'b'):
+        path = tmp_path / f'{name}.mp4'
+        path.write_bytes(b'\0' * 3 * 1024 * 1024)
+        media.append(str(path))
+    jobs = [
+        transcribe.enqueue(path, 'tiny', str(tmp_path / 'out'), connection)
+        for path in media
+    ]
+
+    queue = transcribe.queue(connection=connection)
+    SimpleWorker([queue], connection=connection).work(burst=True)
+
+    results = [job.return_value() for job in jobs]
+    # One model load, shared by both jobs
+    assert loads == ['tiny']
+    assert results[0]['timings']['model_load'] > 0
+    assert results[1]['timings']['model_load'] == 0
+    for path, result in zip(media, results):
+        assert result['media_path'] == path
+        assert set(result['timings']) == {'model_load', 'inference', 'total'}
+        assert result['timings']['inference'] > 0
+        assert set(result['outputs']) == {'json', 'mmif', *FORMATS}
+        assert all(exists(output) for output in result['outputs'].values())
@@ -0,0 +1,76 @@
+from json import dump
+
+import pytest
+
+from mario.mmif import read
+from mario.transcripts import TIME_FRAME, media_guid, postprocess, transcript_key
+
+RESULT = {
+    'text': ' Hello. World.',
+    'language': 'en',
+    'segments': [
+        {'start': 0.0, 'end': 1.5, 'text': ' Hello.'},
+        {'start': 1.5, 'end': 3.25, 'text': ' World.'},
+    ],
+}
+
+
+@pytest.mark.parametrize(
+    'name, guid',
+    [
+        ('cpb-aacip-507-154dn40c26', 'cpb-aacip-507-154dn40c26'),
+        ('cpb-aacip-507-154dn40c26.mp4', 'cpb-aacip-507-154dn40c26'),
+        ('/m/work/cpb-aacip-1.h264.MP4', 'cpb-aacip-1'),
+        ('cpb-aacip-1.2.mp4', 'cpb-aacip-1.2'),
+        ('.mp4', '.mp4'),
+    ],
+)
+def test_media_guid(name, guid):
+    assert media_guid(name) == guid
+
+
+def test_transcript_key():
+    assert transcript_key('cpb-aacip-1.mp4', 'base', 'vtt') == (
+        'cpb-aacip-1/base/cpb-aacip-1.vtt'
+    )
+
+
+def time_frames(mmif: dict) -> dict:
+    return mmif['views'][0]['metadata']['contains'][TIME_FRAME]
+
+
+def test_postprocess(tmp_path):
+    json_path = tmp_path / 'cpb-aacip-1.json'
+    with open(json_path, 'w') as f:
+        dump(RESULT, f)
+    media = str(tmp_path / 'cpb-aacip-1.mp4')
+    outputs = postprocess(str(json_path), media)
+
+    assert set(outputs) == {'json', 'txt', 'vtt', 'srt', 'tsv', 'mmif'}
+    assert (
+        (tmp_path / 'cpb-aacip-1.srt')
+        .read_text()
+        .startswith('1\n00:00:00,000 --> 00:00:01,500\nHello.\n')
+    )
+    with open(outputs['mmif'], 'rb') as f:
+        mmif = read(f)
+    assert mmif['documents'][0]['properties']['location'] == f'file://{media}'
+    assert time_frames(mmif)['document'] == mmif['documents'][0]['properties']['id']
+    annotations = mmif['views'][0]['annotations']
+    assert annotations[0]['properties']['text']['@value'] == 'Hello. World.'
+    assert annotations[-3]['properties'] == {
+        'id': 'tf_1',
+        'start': 1500,
+        'end': 3250,
+        'frameType': 'speech',
+    }
+
+
+def test_no_media_document(tmp_path):
+    json_path = tmp_path / 'transcript.json'
+    with open(json_path, 'w') as f:
+        dump(RESULT, f)
+    with open(postprocess(str(json_path))['mmif'], 'rb') as f:
+        mmif = read(f)
+    assert mmif['documents'] == []
+    assert time_frames(mmif) == {'timeUnit': 'milliseconds'}
@@ -0,0 +1,133 @@
+from os import stat, utime
+from time import time
+
+import pytest
+
+from mario import workspace as workspaces
+from mario.workspace import Workspace, du, enforce_budget, hand_over
+
+DAY = 24 * 60 * 60
+
+
+@pytest.fixture
+def media(tmp_path):
+    path = tmp_path / 'media.mp4'
+    path.write_bytes(b'x' * 1000)
+    return str(path)
+
+
+def no_reflink(src, dst):
+    raise OSError('Operation not supported')
+
+
+def test_hand_over_prefers_reflink(media, tmp_path, monkeypatch):
+    cloned = []
+    monkeypatch.setattr(workspaces, 'reflink', lambda *paths: cloned.append(paths))
+    assert hand_over(media, str(tmp_path / 'copy.mp4')) == 'reflink'
+    assert cloned == [(media, str(tmp_path / 'copy.mp4'))]
+
+
+def test_hand_over_falls_back_to_hardlink(media, tmp_path, monkeypatch):
+    monkeypatch.setattr(workspaces, 'reflink', no_reflink)
+    dst = tmp_path / 'link.mp4'
+    # An existing file is replaced, not written through
+    dst.write_bytes(b'old')
+    assert hand_over(media, str(dst)) == 'hardlink'
+    assert stat(dst).st_ino == stat(media).st_ino
+
+
+def test_hand_over_falls_back_to_copy(media, tmp_path, monkeypatch):
+    def no_link(src, dst):
+        raise OSError('Invalid cross-device link')
+
+    monkeypatch.setattr(workspaces, 'reflink', no_reflink)
+    monkeypatch.setattr(workspaces, 'link', no_link)
+    dst = tmp_path / 'copy.mp4'
+    assert hand_over(media, str(dst)) == 'copy'
+    assert dst.read_bytes() == b'x' * 1000
+    assert stat(dst).st_ino != stat(media).st_ino
+
+
+def test_du_counts_hardlinks_once(media, tmp_path, monkeypatch):
+    monkeypatch.setattr(workspaces, 'reflink', no_reflink)
+    workspace = Workspace('guid', 'Flow/1', str(tmp_path))
+    workspace.hand_over(media, 'a.mp4')
+    workspace.hand_over(media, 'b.mp4')
+    assert du(workspace.path) == 1000 + len('Flow/1')
+
+
+def test_cleanup_removes_only_its_run(media, tmp_path):
+    ours = Workspace('guid', 'Flow/1', str(tmp_path))
+    theirs = Workspace('guid', 'Flow/2', str(tmp_path))
+    ours.hand_over(media)
+    theirs.hand_over(media)
+    assert ours.cleanup() == 2
+    assert not (tmp_path / 'work' / 'guid' / 'Flow-1').exists()
+    assert (tmp_path / 'work' / 'guid' / 'Flow-2' / 'media.mp4').exists()
+
+
+def workspace(root, run: str, size: int, age: float) -> Workspace:
+    """A workspace holding `size` bytes, last used `age` seconds ago"""
+    workspace = Workspace('guid', run, str(root))
+    with open(workspace.file('media.mp4'), 'wb') as f:
+        f.write(b'x' * size)
+    used = time() - age
+    utime(workspace.path, (used, used))
+    return workspace
+
+
+def test_enforce_budget_evicts_least_recently_used(tmp_path):
+    root = tmp_path / 'm'
+    oldest = workspace(root, 'Flow/1', 1000, 3 * DAY)
+    workspace(root, 'Flow/2', 1000, 2 * DAY)
+    workspace(root, 'Flow/3', 1000, 0)
+    # Room for 500 more bytes means freeing one stale workspace
+    freed = enforce_budget(500, 3100, DAY, str(root))
+    assert freed == 1000 + len('Flow/1')
+    assert not (root / 'work' / 'guid' / 'Flow-1').exists()
+    assert (root / 'work' / 'guid' / 'Flow-2').exists()
+    assert (root / 'work' / 'guid' / 'Flow-3').exists()
+    assert oldest.cleanup() == 0
+
+
+def test_enforce_budget_spares_runs_in_progress(tmp_path):
+    root = tmp_path / 'm'
+    workspace(root, 'Flow/1', 1000, 0)
+    workspace(root, 'Flow/2', 1000, 0)
+    assert enforce_budget(1000, 1000, DAY, str(root)) == 0
+    assert len(list((root / 'work' / 'guid').iterdir())) == 2
+
+
+def test_enforce_budget_disabled(tmp_path):
+    root = tmp_path / 'm'
+    workspace(root, 'Flow/1', 1000, 3 * DAY)
+    assert enforce_budget(10**9, 0, DAY, str(root)) == 0
+
+
+def test_relocate(tmp_path):
+    from mario.mmif import MMIFRef, dump
+
+    workspace = Workspace('cpb-aacip-1', 'Pipeline/2', str(tmp_path))
+    mmif = {
+        'documents': [
+            {'properties': {'id': 'd1', 'location': 'file:///old/media.mp4'}},
+            {'properties': {'id': 'd2', 'location': 'file:///old/media.16k.wav'}},
+            {'properties': {'id': 'd3', 'location': 'file:///old/other.mp4'}},
+        ],
+        'views': [],
+    }
+    moved = workspace.relocate(mmif, 'media.mp4')
+    # The media file and its proxies move, other documents stay
+    assert [d['properties']['location'] for d in moved['documents']] == [
+        f'file://{workspace.path}/media.mp4',
+        f'file://{workspace.path}/media.16k.wav',
+        'file:///old/other.mp4',
+    ]
+    assert workspace.relocate(moved, 'media.mp4') is moved
+
+    ref = dump(mmif, str(tmp_path / 'input.mmif'))
+    relocated = workspace.relocate(ref, 'media.mp4')
+    assert isinstance(relocated, MMIFRef)
+    assert relocated.location == workspace.file('input.mmif')
+    assert relocated.load() == moved
+    assert workspace.relocate(ref, 'missing.mp4') is ref